@@ -0,0 +1,452 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+CHECKPOINT_HEADER = 'imgtools-batch-checkpoint v1'
+# 相對路徑以清單檔所在的資料夾為基準的欄位
+PATH_KEYS = ('input', 'output', 'inputs', 'mapping')
+BROKEN_POOL_ERROR = 'BrokenProcessPool: 工作行程異常結束'
+
+
+# 每種操作接收 task dict(已合併預設值並解析路徑)，回傳可寫入 JSON 的結果
+# 工具本身的平行參數固定為 1，平行處理由 runner 的行程池負責
+def _op_pdf_to_images(task):
+    from pdf_tools.pdf_dpi_conversion_tools import PDFOperator, load_default_dpi, page_file_name
+
+    processor = PDFOperator(task['input'], task.get('password'))
+    try:
+        dpi = task.get('dpi') or load_default_dpi()
+        pages = task.get('pages', range(processor.total_pages))
+        os.makedirs(task['output'], exist_ok=True)
+        file_name_base = os.path.splitext(os.path.basename(task['input']))[0]
+        for page in pages:
+            processor.save_page_as_image(page, page_file_name(task['output'], file_name_base, page,
+                                                              processor.total_pages), dpi=dpi)
+        return {'pages': len(pages)}
+    finally:
+        processor.doc.close()
+
+
+def _op_merge_tif(task):
+    import merge_img
+    merge_img.merge_img_to_one_tif(task['input'], task['output'], tile_size=task.get('tile_size'),
+                                   levels=task.get('levels'))
+    return {'bytes': os.path.getsize(task['output'])}
+
+
+def _op_merge_pdf(task):
+    import merge_img
+    merge_img.merge_img_to_one_pdf(task['input'], task['output'])
+    return {'bytes': os.path.getsize(task['output'])}
+
+
+def _op_merge_gif(task):
+    import merge_img
+    size = task.get('size', (1000, 1000))
+    merge_img.merge_img_to_one_gif(task['input'], task['output'], duration=task.get('duration', 1000),
+                                   size=tuple(size) if size else None)
+    return {'bytes': os.path.getsize(task['output'])}
+
+
+def _op_multipage_tif(task):
+    from tif_tools.tif_tools import TifTools
+    inputs = task.get('inputs') or sorted(os.path.join(task['input'], file) for file in os.listdir(task['input'])
+                                          if '.tif' in file or '.png' in file or '.jpg' in file)
+    TifTools().save_multipage_tiff(inputs, task['output'], compression=task.get('compression', 'tiff_lzw'),
+                                   color_mode=task.get('color_mode'), workers=1)
+    return {'pages': len(inputs)}
+
+
+def _op_split_tif(task):
+    from tif_tools.tif_tools import TifTools
+    dpi = task.get('dpi')
+    paths = TifTools().split_all_page(task['input'], folder_name=task['output'], compression=task.get('compression'),
+                                      color_mode=task.get('color_mode'), dpi=tuple(dpi) if dpi else None, workers=1)
+    return {'pages': len(paths)}
+
+
+def _op_watermark(task):
+    from watermark.add_watermark import AddWatermark
+    options = {key: task[key] for key in ('position', 'font_size', 'rotation', 'font_path') if key in task}
+    if 'position' in options:
+        options['position'] = tuple(options['position'])
+    if task['input'].lower().endswith(('.pdf', '.tif', '.tiff')):
+        pages = AddWatermark.document(task['input'], task['output'], task['text'], workers=1,
+                                      dpi=task.get('dpi', 300), password=task.get('password'),
+                                      color_mode=task.get('color_mode'), **options)
+        return {'pages': pages}
+    AddWatermark.basic_auto_adaptation(task['input'], task['output'], task['text'],
+                                       save_format=task.get('color_mode'), **options)
+    return {'pages': 1}
+
+
+def _op_crop_text(task):
+    from crop_text.crop_text import crop_text_batch, crop_text_tiled
+    if task.get('tiled'):
+        paths = crop_text_tiled(task['input'], output_dir=task['output'], limit_length=task.get('limit_length'),
+                                dilate_iter=task.get('dilate_iter', 10), page=task.get('page', 0))
+    else:
+        paths, = crop_text_batch([task['input']], workers=1, output_dir=task['output'],
+                                 limit_length=task.get('limit_length'), dilate_iter=task.get('dilate_iter', 10),
+                                 proxy_scale=task.get('proxy_scale'))
+    return {'glyphs': len(paths)}
+
+
+def _op_mp4_to_gif(task):
+    from gif_tools.gif_tools import convert_mp4_to_gif
+    size = task.get('size')
+    frames = convert_mp4_to_gif(task['input'], task['output'], fps=task.get('fps'), size=tuple(size) if size else None,
+                                start=task.get('start'), end=task.get('end'))
+    return {'frames': frames}
+
+
+def _op_rename(task):
+    from rename_file_and_folder.raname_file_and_folder import rename_by_mapping
+    result = rename_by_mapping(task['input'], task['mapping'], files=task.get('files', True),
+                               folders=task.get('folders', True), journal_path=task.get('journal_path'))
+    if result['errors']:
+        raise RuntimeError(f"{len(result['errors'])} 個項目重新命名失敗，第一個: {result['errors'][0]}")
+    return {'renamed': result['renamed'], 'conflicts': result['conflicts']}
+
+
+def _op_patch_tags(task):
+    from read_img_exif.tiff_patch import patch_tags
+    # JSON 的鍵只能是字串，轉回 tag 代號
+    changes = {int(tag): value for tag, value in task['changes'].items()}
+    report = patch_tags(task['input'], changes, pages=task.get('pages', (0,)))
+    return {'changes': len(report)}
+
+
+OPERATIONS = {
+    'pdf_to_images': _op_pdf_to_images,
+    'merge_tif': _op_merge_tif,
+    'merge_pdf': _op_merge_pdf,
+    'merge_gif': _op_merge_gif,
+    'multipage_tif': _op_multipage_tif,
+    'split_tif': _op_split_tif,
+    'watermark': _op_watermark,
+    'crop_text': _op_crop_text,
+    'mp4_to_gif': _op_mp4_to_gif,
+    'rename': _op_rename,
+    'patch_tags': _op_patch_tags,
+}
+
+
+def load_manifest(manifest_path):
+    """
+    讀取工作清單，副檔名 .yaml、.yml 以 PyYAML 讀取，其他以 JSON 讀取
+    清單格式為 {'workers': 行程數, 'memory_limit_mb': 每個工作的記憶體上限, 'checkpoint': 檢查點路徑,
+    'defaults': {操作: {預設參數}}, 'tasks': [{'op': 操作, 'input': ..., 'output': ..., 其他參數}, ...]}，也可以只給 tasks 清單
+    :param manifest_path: 清單檔案路徑
+    :return: (設定 dict, 工作清單 [(工作 id, task dict)])
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        if manifest_path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('讀取 YAML 清單需要安裝 PyYAML(pip install pyyaml)，或改用 JSON 清單。')
+            manifest = yaml.safe_load(file)
+        else:
+            manifest = json.load(file)
+    if isinstance(manifest, list):
+        manifest = {'tasks': manifest}
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    defaults = manifest.get('defaults', {})
+    tasks, seen = [], set()
+    for index, task in enumerate(manifest.get('tasks', [])):
+        if task.get('op') not in OPERATIONS:
+            raise ValueError(f"第 {index + 1} 個工作的操作 {task.get('op')} 不存在，可使用: {', '.join(OPERATIONS)}")
+        task = dict(defaults.get(task['op'], {}), **task)
+        for key in PATH_KEYS:
+            if isinstance(task.get(key), str):
+                task[key] = os.path.normpath(os.path.join(base_dir, task[key]))
+            elif key == 'inputs' and task.get(key):
+                task[key] = [os.path.normpath(os.path.join(base_dir, path)) for path in task[key]]
+        # 未指定 id 時以內容的雜湊值作為 id，清單順序改變或新增工作時，已完成的工作仍可對應
+        task_id = str(task.pop('id', None) or hashlib.sha1(
+            json.dumps(task, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16])
+        if task_id in seen:
+            raise ValueError(f'第 {index + 1} 個工作的 id {task_id} 重複。')
+        seen.add(task_id)
+        tasks.append((task_id, task))
+    settings = {key: value for key, value in manifest.items() if key not in ('tasks', 'defaults')}
+    if settings.get('checkpoint'):
+        settings['checkpoint'] = os.path.join(base_dir, settings['checkpoint'])
+    return settings, tasks
+
+
+class Checkpoint:
+    """
+    以 JSON lines 記錄每個工作的結果，每完成一個工作就寫入並 fsync，中斷後重新執行時略過已完成的工作
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        self._file = None
+
+    def load(self):
+        """
+        :return: {工作 id: 結果}，只包含最後一筆記錄為完成的工作
+        """
+        self.done = {}
+        if not os.path.exists(self.path):
+            return self.done
+        with open(self.path, 'r', encoding='utf-8') as file:
+            if json.loads(file.readline() or 'null') != CHECKPOINT_HEADER:
+                raise ValueError(f'{self.path} 不是批次工作的檢查點檔案。')
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中斷時寫了一半的行
+                    continue
+                if record['status'] == 'done':
+                    self.done[record['id']] = record
+                else:
+                    self.done.pop(record['id'], None)
+        return self.done
+
+    def write(self, record):
+        if self._file is None:
+            new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            complete = True
+            if not new:
+                with open(self.path, 'rb') as file:
+                    file.seek(-1, os.SEEK_END)
+                    complete = file.read(1) == b'\n'
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if new:
+                self._file.write(json.dumps(CHECKPOINT_HEADER) + '\n')
+            elif not complete:
+                self._file.write('\n')
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if record['status'] == 'done':
+            self.done[record['id']] = record
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def _set_memory_limit(limit_mb):
+    """
+    以 RLIMIT_AS 限制行程的位址空間，超過時配置記憶體會失敗(MemoryError)；Windows 不支援則不限制
+    :return: 原本的限制，用於還原
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    previous = resource.getrlimit(resource.RLIMIT_AS)
+    soft = int(limit_mb * 1024 * 1024) if limit_mb else previous[1]
+    if previous[1] != resource.RLIM_INFINITY:
+        soft = min(soft, previous[1])
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, previous[1]))
+    except (ValueError, OSError):
+        return None
+    return previous
+
+
+def _run_task(task_id, task, memory_limit_mb):
+    """
+    在工作行程中執行一個工作，工具印出的訊息不輸出，避免與進度顯示交錯
+    :return: 檢查點記錄 dict
+    """
+    start = time.perf_counter()
+    previous = _set_memory_limit(task.get('memory_limit_mb', memory_limit_mb))
+    record = {'id': task_id, 'op': task['op']}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = OPERATIONS[task['op']](task)
+        record.update(status='done', result=result)
+    except MemoryError:
+        record.update(status='failed', error=f"MemoryError: 超過記憶體上限 {task.get('memory_limit_mb', memory_limit_mb)}MB")
+    except Exception as e:
+        record.update(status='failed', error=f'{type(e).__name__}: {e}')
+    finally:
+        if previous is not None:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, previous)
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+class _Progress:
+    """
+    顯示整體進度：完成數、失敗數、略過數、經過時間與預估剩餘時間
+    """
+
+    def __init__(self, total, skipped, stream=sys.stderr):
+        self.total = total
+        self.skipped = skipped
+        self.ok = 0
+        self.failed = 0
+        self.stream = stream
+        self.interactive = stream.isatty()
+        self._start = time.perf_counter()
+
+    def update(self, record):
+        if record['status'] == 'done':
+            self.ok += 1
+        else:
+            self.failed += 1
+            self._print(f"失敗 {record['id']} ({record['op']}): {record['error']}", newline=True)
+        self._print(self.line(), newline=not self.interactive)
+
+    def line(self):
+        finished = self.ok + self.failed
+        remaining = self.total - self.skipped - finished
+        elapsed = time.perf_counter() - self._start
+        eta = elapsed / finished * remaining if finished else None
+        return (f'[{finished + self.skipped}/{self.total}] {(finished + self.skipped) / max(self.total, 1):.1%}  '
+                f'ok {self.ok}  failed {self.failed}  skipped {self.skipped}  '
+                f'elapsed {_format_seconds(elapsed)}  eta {_format_seconds(eta) if eta is not None else "-"}')
+
+    def _print(self, text, newline):
+        if self.interactive:
+            self.stream.write('\r\033[K' + text + ('\n' if newline else ''))
+        else:
+            self.stream.write(text + '\n')
+        self.stream.flush()
+
+    def close(self):
+        if self.interactive:
+            self.stream.write('\n')
+
+
+def _format_seconds(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+def run_manifest(manifest_path, workers=None, memory_limit_mb=None, checkpoint_path=None, dry_run=False,
+                 progress=True):
+    """
+    依工作清單以行程池執行所有工作，每完成一個工作就寫入檢查點，重新執行時略過已完成的工作，失敗的工作會重新執行
+    :param manifest_path: JSON 或 YAML 清單路徑
+    :param workers: 行程數量，若為 None 則使用清單的設定或 CPU 核心數，1 則不使用行程池
+    :param memory_limit_mb: 每個工作的記憶體上限(MB)，若為 None 則使用清單的設定，工作本身的 memory_limit_mb 優先
+    :param checkpoint_path: 檢查點路徑，若為 None 則使用清單的設定或 {清單路徑}.checkpoint.jsonl
+    :param dry_run: 只回傳要執行與略過的工作 id，不執行
+    :param progress: 是否在 stderr 顯示整體進度
+    :return: {'total': 工作數, 'skipped': 略過數, 'done': 完成數, 'failed': [(工作 id, 錯誤訊息)]}
+    """
+    settings, tasks = load_manifest(manifest_path)
+    workers = workers or settings.get('workers') or os.cpu_count() or 1
+    memory_limit_mb = memory_limit_mb or settings.get('memory_limit_mb')
+    checkpoint = Checkpoint(checkpoint_path or settings.get('checkpoint') or manifest_path + '.checkpoint.jsonl')
+    done = checkpoint.load()
+    todo = [(task_id, task) for task_id, task in tasks if task_id not in done]
+    if dry_run:
+        return {'run': [task_id for task_id, _ in todo], 'skip': [task_id for task_id, _ in tasks if task_id in done]}
+
+    summary = {'total': len(tasks), 'skipped': len(tasks) - len(todo), 'done': 0, 'failed': []}
+    bar = _Progress(len(tasks), summary['skipped']) if progress else None
+
+    def record(result):
+        checkpoint.write(result)
+        if result['status'] == 'done':
+            summary['done'] += 1
+        else:
+            summary['failed'].append((result['id'], result['error']))
+        if bar:
+            bar.update(result)
+
+    try:
+        if workers == 1:
+            for task_id, task in todo:
+                record(_run_task(task_id, task, memory_limit_mb))
+            return summary
+
+        queue = iter(todo)
+        executor = ProcessPoolExecutor(max_workers=workers)
+        pending = {}
+        try:
+            while True:
+                broken = False
+                # 同時送出的工作數有上限，大型清單不會一次建立所有 future
+                while len(pending) < workers * 2:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    try:
+                        pending[executor.submit(_run_task, item[0], item[1], memory_limit_mb)] = item
+                    except BrokenProcessPool:
+                        queue = itertools.chain([item], queue)
+                        broken = True
+                        break
+                if not pending and not broken:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED) if pending else ((), ())
+                for future in finished:
+                    task_id, task = pending.pop(future)
+                    try:
+                        record(future.result())
+                    except BrokenProcessPool:
+                        broken = True
+                        record({'id': task_id, 'op': task['op'], 'status': 'failed', 'error': BROKEN_POOL_ERROR})
+                if broken:
+                    # 行程池中斷時無法得知是哪個工作造成，所有處理中的工作都記錄為失敗，下次執行時重試
+                    for task_id, task in pending.values():
+                        record({'id': task_id, 'op': task['op'], 'status': 'failed', 'error': BROKEN_POOL_ERROR})
+                    pending.clear()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=workers)
+        finally:
+            executor.shutdown(cancel_futures=True)
+        return summary
+    finally:
+        checkpoint.close()
+        if bar:
+            bar.close()
+
+
+def main():
+    """
+    依 JSON 或 YAML 工作清單批次執行各工具的操作
+    使用方式: python batch_runner/batch_runner.py manifest.yaml [--workers 4] [--memory-limit 2048] [--dry-run]
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Run a JSON or YAML manifest of ImgTools operations.')
+    parser.add_argument('manifest', type=str, help='Path to the JSON or YAML manifest.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes, 1 runs tasks inline.')
+    parser.add_argument('--memory-limit', type=float, default=None, help='Memory limit per task in MB.')
+    parser.add_argument('--checkpoint', type=str, default=None, help='Checkpoint file, completed tasks are skipped.')
+    parser.add_argument('--dry-run', action='store_true', help='List the tasks that would run without running them.')
+    args = parser.parse_args()
+
+    summary = run_manifest(args.manifest, workers=args.workers, memory_limit_mb=args.memory_limit,
+                           checkpoint_path=args.checkpoint, dry_run=args.dry_run)
+    if args.dry_run:
+        print(f"run {len(summary['run'])}, skip {len(summary['skip'])}")
+        for task_id in summary['run']:
+            print(task_id)
+        return
+    print(f"{summary['done']} done, {len(summary['failed'])} failed, {summary['skipped']} skipped "
+          f"of {summary['total']} tasks")
+    for task_id, error in summary['failed']:
+        print(f'{task_id}: {error}')
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
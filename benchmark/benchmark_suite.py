@@ -0,0 +1,539 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+SEED = 20240101
+# 基準比較時允許的變慢比例，例如 0.2 表示比基準慢 20% 以內不視為退步
+DEFAULT_TOLERANCE = 0.2
+
+
+def _text_page(size, rng, mode='1', lines=40):
+    """
+    產生類似文件掃描的頁面：白底上以隨機長度的黑色方塊模擬文字行
+    """
+    from PIL import Image, ImageDraw
+
+    width, height = size
+    page = Image.new(mode, size, 'white')
+    draw = ImageDraw.Draw(page)
+    line_height = height // (lines + 4)
+    glyph = max(2, line_height * 2 // 3)
+    for line in range(lines):
+        top = line_height * (line + 2)
+        x = width // 12
+        right = rng.randint(width // 2, width * 11 // 12)
+        while x + glyph < right:
+            fill = 'black' if mode == '1' else tuple(rng.randint(0, 120) for _ in range(3))
+            draw.rectangle((x, top, x + glyph, top + glyph), fill=fill if mode != 'L' else 0)
+            x += glyph + rng.randint(glyph // 4, glyph)
+    return page
+
+
+def create_fixtures(fixture_dir, scale=1.0):
+    """
+    以固定的亂數種子產生量測用的輸入檔，相同 scale 產生的檔案內容完全相同，不需要網路或外部檔案
+    :param fixture_dir: 輸入檔存放的資料夾
+    :param scale: 頁數與檔案數的倍率
+    :return: 各輸入檔路徑 dict，無法產生的項目(缺少 fitz 或 cv2)為 None
+    """
+    import random
+
+    from PIL import Image
+
+    rng = random.Random(SEED)
+    count = lambda base: max(1, int(round(base * scale)))
+    os.makedirs(fixture_dir, exist_ok=True)
+    fixtures = {}
+
+    # 多頁二值 tif：A4 300dpi，G4 壓縮
+    pages = [_text_page((2480, 3508), rng) for _ in range(count(8))]
+    fixtures['bilevel_tif'] = os.path.join(fixture_dir, 'bilevel.tif')
+    pages[0].save(fixtures['bilevel_tif'], save_all=True, append_images=pages[1:], compression='group4',
+                  dpi=(300, 300))
+
+    # 多頁彩色 tif：A4 150dpi，LZW 壓縮
+    pages = [_text_page((1240, 1754), rng, mode='RGB') for _ in range(count(4))]
+    fixtures['rgb_tif'] = os.path.join(fixture_dir, 'rgb.tif')
+    pages[0].save(fixtures['rgb_tif'], save_all=True, append_images=pages[1:], compression='tiff_lzw',
+                  dpi=(150, 150))
+
+    # 圖片資料夾：PNG 與 JPG 交錯
+    fixtures['images'] = os.path.join(fixture_dir, 'images')
+    os.makedirs(fixtures['images'], exist_ok=True)
+    for i in range(count(8)):
+        image = _text_page((1000, 1000), rng, mode='RGB', lines=20)
+        image.save(os.path.join(fixtures['images'], f'{i:04d}.{"png" if i % 2 else "jpg"}'))
+
+    # tif 圖片資料夾：tifftools 直接合併 tif 頁面，不接受 PNG、JPG
+    fixtures['tif_images'] = os.path.join(fixture_dir, 'tif_images')
+    os.makedirs(fixtures['tif_images'], exist_ok=True)
+    for i in range(count(8)):
+        _text_page((2480, 3508), rng).save(os.path.join(fixtures['tif_images'], f'{i:04d}.tif'), compression='group4',
+                                           dpi=(300, 300))
+
+    # 文字裁切用的單頁圖片
+    fixtures['text_image'] = os.path.join(fixture_dir, 'text.png')
+    _text_page((1600, 1200), rng, mode='L', lines=12).save(fixtures['text_image'])
+
+    fixtures['pdf'] = None
+    try:
+        import fitz
+        doc = fitz.open()
+        for i in range(count(40)):
+            page = doc.new_page(width=595, height=842)
+            for line in range(40):
+                page.insert_text((50, 60 + line * 18), f'page {i + 1} line {line + 1} ' + 'lorem ipsum ' * 5)
+            page.draw_rect(fitz.Rect(50, 760, 545, 800), color=(0, 0, 0), fill=(0.8, 0.8, 0.8))
+        fixtures['pdf'] = os.path.join(fixture_dir, 'document.pdf')
+        doc.save(fixtures['pdf'], deflate=True)
+        doc.close()
+    except ImportError:
+        pass
+
+    fixtures['mp4'] = None
+    try:
+        import cv2
+        import numpy as np
+        path = os.path.join(fixture_dir, 'clip.mp4')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (320, 240))
+        if writer.isOpened():
+            for frame_index in range(count(60)):
+                frame = np.full((240, 320, 3), 255, np.uint8)
+                x = (frame_index * 5) % 280
+                cv2.rectangle(frame, (x, 80), (x + 40, 160), (rng.randint(0, 255), 80, 160), -1)
+                writer.write(frame)
+            fixtures['mp4'] = path
+        writer.release()
+    except ImportError:
+        pass
+
+    # 重新命名用的資料夾樹的規模，實際的樹在每次量測前重新建立
+    fixtures['rename_files'] = count(2000)
+    with open(os.path.join(fixture_dir, 'fixtures.json'), 'w') as file:
+        json.dump({'scale': scale, 'fixtures': fixtures}, file, indent=2)
+    return fixtures
+
+
+def _size(*paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        else:
+            total += os.path.getsize(path)
+    return total
+
+
+def _tiff_pages(path):
+    from tif_tools.tiff_index import build_ifd_offsets
+    return len(build_ifd_offsets(path))
+
+
+def _image_count(folder):
+    return len([file for file in os.listdir(folder) if '.tif' in file or '.png' in file or '.jpg' in file])
+
+
+def _rename_tree(root, file_count):
+    """
+    建立重新命名用的資料夾樹，每個子資料夾 100 個空檔案
+    """
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    for i in range(file_count):
+        folder = os.path.join(root, f'scan_{i // 100:03d}')
+        if i % 100 == 0:
+            os.makedirs(folder)
+        open(os.path.join(folder, f'scan_{i:06d}_draft.tif'), 'wb').close()
+
+
+# 每個量測項目：準備函式傳入 (輸入檔, 工作資料夾, 參數)，回傳 (量測的函式, 處理的頁數或檔案數, 輸入的位元組數)
+# 準備的時間不計入量測，量測的函式每次執行前都會重新呼叫準備函式
+def _case_merge_tif(fixtures, work_dir, args):
+    import merge_img
+    folder = fixtures['tif_images']
+    return (lambda: merge_img.merge_img_to_one_tif(folder, os.path.join(work_dir, 'merged.tif')),
+            _image_count(folder), _size(folder))
+
+
+def _case_merge_pdf(fixtures, work_dir, args):
+    import merge_img
+    folder = fixtures['images']
+    return (lambda: merge_img.merge_img_to_one_pdf(folder, os.path.join(work_dir, 'merged.pdf')),
+            _image_count(folder), _size(folder))
+
+
+def _case_merge_gif(fixtures, work_dir, args):
+    import merge_img
+    folder = fixtures['images']
+    return (lambda: merge_img.merge_img_to_one_gif(folder, os.path.join(work_dir, 'merged.gif'), size=(500, 500)),
+            _image_count(folder), _size(folder))
+
+
+def _case_tif_save_multipage(fixtures, work_dir, args):
+    from tif_tools.tif_tools import TifTools
+    folder = fixtures['images']
+    paths = sorted(os.path.join(folder, file) for file in os.listdir(folder))
+    return (lambda: TifTools().save_multipage_tiff(paths, os.path.join(work_dir, 'multipage.tif'),
+                                                   workers=args.workers),
+            len(paths), _size(folder))
+
+
+def _case_tif_split_all_page(fixtures, work_dir, args):
+    from tif_tools.tif_tools import TifTools
+    path = fixtures['bilevel_tif']
+    output_dir = os.path.join(work_dir, 'split')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return (lambda: TifTools().split_all_page(path, folder_name=output_dir, workers=args.workers),
+            _tiff_pages(path), _size(path))
+
+
+def _case_tif_split_reencode(fixtures, work_dir, args):
+    from tif_tools.tif_tools import TifTools
+    path = fixtures['rgb_tif']
+    output_dir = os.path.join(work_dir, 'split_reencode')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return (lambda: TifTools().split_all_page(path, folder_name=output_dir, compression='group4', color_mode='1',
+                                              workers=args.workers),
+            _tiff_pages(path), _size(path))
+
+
+def _case_tif_get_pages(fixtures, work_dir, args):
+    from tif_tools.tif_tools import TifTools
+    path = fixtures['bilevel_tif']
+    pages = _tiff_pages(path)
+
+    def run():
+        for img in TifTools().get_pages(path, range(pages)):
+            img.load()
+
+    return run, pages, _size(path)
+
+
+def _case_pdf_render(fixtures, work_dir, args):
+    from pdf_tools.pdf_dpi_conversion_tools import PDFOperator
+    path = fixtures['pdf']
+
+    def run():
+        processor = PDFOperator(path)
+        for page_number in range(processor.total_pages):
+            processor.capture_full_page(page_number, dpi=args.dpi)
+        processor.doc.close()
+
+    processor = PDFOperator(path)
+    pages = processor.total_pages
+    processor.doc.close()
+    return run, pages, _size(path)
+
+
+def _case_mp4_to_gif(fixtures, work_dir, args):
+    from gif_tools.gif_tools import convert_mp4_to_gif
+    path = fixtures['mp4']
+    import cv2
+    capture = cv2.VideoCapture(path)
+    frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return lambda: convert_mp4_to_gif(path, os.path.join(work_dir, 'clip.gif')), frames, _size(path)
+
+
+def _case_crop_text(fixtures, work_dir, args):
+    from crop_text.crop_text import extract_glyphs, process_image
+    path = fixtures['text_image']
+    return lambda: extract_glyphs(process_image(path)), 1, _size(path)
+
+
+def _case_crop_text_tiled(fixtures, work_dir, args):
+    from crop_text.crop_text import iter_glyphs_tiled
+    path = fixtures['bilevel_tif']
+
+    def run():
+        for _ in iter_glyphs_tiled(path):
+            pass
+
+    return run, 1, _size(path)
+
+
+def _case_watermark_document(fixtures, work_dir, args):
+    from watermark.add_watermark import AddWatermark
+    path = fixtures['rgb_tif']
+    return (lambda: AddWatermark.document(path, os.path.join(work_dir, 'watermark.tif'), 'BENCHMARK',
+                                          workers=args.workers, font_path=args.font),
+            _tiff_pages(path), _size(path))
+
+
+def _case_read_exif_pil(fixtures, work_dir, args):
+    from read_img_exif.read_img_exif import ReadExif
+    paths = [fixtures['bilevel_tif'], fixtures['rgb_tif']]
+
+    def run():
+        for path in paths:
+            for _ in range(100):
+                dict(ReadExif.pil_tag_v2(path))
+
+    return run, 100 * len(paths), _size(*paths)
+
+
+def _case_read_exif_header(fixtures, work_dir, args):
+    from read_img_exif.read_img_exif import ReadExif
+    paths = [fixtures['bilevel_tif'], fixtures['rgb_tif']]
+    pages = {path: range(_tiff_pages(path)) for path in paths}
+
+    def run():
+        for path in paths:
+            for _ in range(100):
+                ReadExif.header_tags(path, pages=pages[path], tags=[256, 257, 259, 262, 282, 283])
+
+    return run, 100 * sum(len(page_range) for page_range in pages.values()), _size(*paths)
+
+
+def _case_rename_by_string(fixtures, work_dir, args):
+    from rename_file_and_folder.raname_file_and_folder import rename_files_by_string
+    root = os.path.join(work_dir, 'rename')
+    _rename_tree(root, fixtures['rename_files'])
+    return lambda: rename_files_by_string(root, '_draft', '_final'), fixtures['rename_files'], 0
+
+
+def _case_rename_by_mapping(fixtures, work_dir, args):
+    from rename_file_and_folder.raname_file_and_folder import rename_by_mapping
+    root = os.path.join(work_dir, 'rename')
+    _rename_tree(root, fixtures['rename_files'])
+    mapping = {'scan_': 'doc-', '_draft': '_final', '.tif': '.tiff'}
+    return lambda: rename_by_mapping(root, mapping), fixtures['rename_files'], 0
+
+
+# 名稱: (準備函式, 需要的輸入檔, 處理單位)
+CASES = {
+    'merge_img_to_one_tif': (_case_merge_tif, ['tif_images'], 'images'),
+    'merge_img_to_one_pdf': (_case_merge_pdf, ['images'], 'images'),
+    'merge_img_to_one_gif': (_case_merge_gif, ['images'], 'images'),
+    'tif_save_multipage': (_case_tif_save_multipage, ['images'], 'pages'),
+    'tif_split_all_page': (_case_tif_split_all_page, ['bilevel_tif'], 'pages'),
+    'tif_split_reencode': (_case_tif_split_reencode, ['rgb_tif'], 'pages'),
+    'tif_get_pages': (_case_tif_get_pages, ['bilevel_tif'], 'pages'),
+    'pdf_render': (_case_pdf_render, ['pdf'], 'pages'),
+    'mp4_to_gif': (_case_mp4_to_gif, ['mp4'], 'frames'),
+    'crop_text': (_case_crop_text, ['text_image'], 'pages'),
+    'crop_text_tiled': (_case_crop_text_tiled, ['bilevel_tif'], 'pages'),
+    'watermark_document': (_case_watermark_document, ['rgb_tif'], 'pages'),
+    'read_exif_pil': (_case_read_exif_pil, ['bilevel_tif', 'rgb_tif'], 'reads'),
+    'read_exif_header': (_case_read_exif_header, ['bilevel_tif', 'rgb_tif'], 'pages'),
+    'rename_by_string': (_case_rename_by_string, [], 'files'),
+    'rename_by_mapping': (_case_rename_by_mapping, [], 'files'),
+}
+
+
+def peak_rss_mb():
+    """
+    取得目前行程(含已結束的子行程)的最大常駐記憶體，Windows 上無法取得時回傳 None
+    Linux 的 ru_maxrss 會沿用啟動此行程的父行程的值，因此優先讀取 exec 後重新計算的 VmHWM
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open('/proc/self/status') as file:
+            peak = next(int(line.split()[1]) for line in file if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        pass
+    peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux 的單位為 KB，macOS 為 bytes
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_case(name, fixtures, work_dir, args):
+    """
+    在目前的行程中執行一個量測項目，取多次中的最小值
+    :return: 量測結果 dict
+    """
+    prepare, _, unit = CASES[name]
+    timings = []
+    for _ in range(args.repeat):
+        run, units, input_bytes = prepare(fixtures, work_dir, args)
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+    return {
+        'seconds': seconds,
+        'unit': unit,
+        'units': units,
+        'units_per_s': units / seconds if seconds else None,
+        'mb_per_s': input_bytes / 1e6 / seconds if seconds and input_bytes else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def measure_case(name, fixture_dir, args):
+    """
+    在新的直譯器中執行一個量測項目，使每個項目的最大記憶體互不影響
+    :return: 量測結果 dict
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--case', name, '--fixtures', fixture_dir,
+               '--repeat', str(args.repeat), '--dpi', str(args.dpi)]
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    if args.font:
+        command += ['--font', args.font]
+    # 將輸出導向檔案，工具本身印出的進度訊息不影響結果的解析
+    with tempfile.NamedTemporaryFile('r', suffix='.json', delete=False) as file:
+        result_path = file.name
+    try:
+        result = subprocess.run(command + ['--json', result_path], cwd=ROOT_DIR, capture_output=True, text=True)
+        if result.returncode:
+            lines = result.stderr.strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else 'failed')
+        with open(result_path) as file:
+            return json.load(file)
+    finally:
+        os.remove(result_path)
+
+
+def skip_reason(name, fixtures, args):
+    """
+    :return: 無法執行的原因，可以執行時回傳 None
+    """
+    missing = [key for key in CASES[name][1] if not fixtures.get(key)]
+    if missing:
+        return f"缺少輸入檔 {', '.join(missing)}"
+    if name == 'watermark_document':
+        from PIL import ImageFont
+        try:
+            ImageFont.truetype(args.font, 10)
+        except OSError:
+            return f'找不到字型 {args.font}，請以 --font 指定'
+    return None
+
+
+def compare(results, baseline, tolerance):
+    """
+    與基準比較，耗時或最大記憶體超過基準 (1 + tolerance) 倍的項目視為退步
+    :return: 錯誤訊息清單
+    """
+    errors = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['seconds'] > base['seconds'] * (1 + tolerance):
+            errors.append(f"{name}: {result['seconds']:.3f}s 比基準 {base['seconds']:.3f}s "
+                          f"慢 {result['seconds'] / base['seconds'] - 1:.0%}")
+        if result['peak_rss_mb'] and base.get('peak_rss_mb') and \
+                result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            errors.append(f"{name}: 最大記憶體 {result['peak_rss_mb']:.0f}MB 比基準 {base['peak_rss_mb']:.0f}MB "
+                          f"多 {result['peak_rss_mb'] / base['peak_rss_mb'] - 1:.0%}")
+    return errors
+
+
+def _format(value, digits=1):
+    return f'{value:.{digits}f}' if value is not None else '-'
+
+
+def main():
+    """
+    以合成的輸入檔量測各工具的處理時間、吞吐量與最大記憶體，指定基準時比基準退步則以結束碼 1 結束
+    使用方式: python benchmark/benchmark_suite.py [--scale 1] [--json result.json] [--baseline baseline.json]
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Benchmark every ImgTools operation on synthetic fixtures.')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply fixture page and file counts.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case, the fastest is kept.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Workers passed to tools that accept them, 1 keeps all work in one process.')
+    parser.add_argument('--dpi', type=int, default=150, help='DPI used for PDF rendering.')
+    parser.add_argument('--font', type=str, default=None, help='Font for the watermark case.')
+    parser.add_argument('--only', nargs='*', default=None, help='Cases to run.')
+    parser.add_argument('--fixtures', type=str, default=None,
+                        help='Fixture folder, reused when it already holds fixtures of the same scale.')
+    parser.add_argument('--json', type=str, default=None, help='Write the results to a JSON file.')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare against a stored baseline JSON.')
+    parser.add_argument('--save-baseline', type=str, default=None, help='Store the results as a new baseline.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed slowdown before a case counts as a regression.')
+    parser.add_argument('--case', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if not args.font:
+        from watermark.add_watermark import FONT_PATH
+        args.font = FONT_PATH
+
+    if args.case:
+        # 子行程：只執行一個項目並將結果寫入 --json
+        with open(os.path.join(args.fixtures, 'fixtures.json')) as file:
+            fixtures = json.load(file)['fixtures']
+        with tempfile.TemporaryDirectory() as work_dir:
+            result = run_case(args.case, fixtures, work_dir, args)
+        with open(args.json, 'w') as file:
+            json.dump(result, file)
+        return
+
+    temporary = None
+    fixture_dir = args.fixtures
+    if not fixture_dir:
+        temporary = tempfile.TemporaryDirectory()
+        fixture_dir = temporary.name
+    manifest = os.path.join(fixture_dir, 'fixtures.json')
+    fixtures = None
+    if os.path.exists(manifest):
+        with open(manifest) as file:
+            stored = json.load(file)
+        if stored['scale'] == args.scale:
+            fixtures = stored['fixtures']
+    if fixtures is None:
+        start = time.perf_counter()
+        fixtures = create_fixtures(fixture_dir, args.scale)
+        print(f'產生輸入檔 {time.perf_counter() - start:.1f}s ({fixture_dir})')
+
+    results, errors = {}, []
+    try:
+        for name in CASES:
+            if args.only and name not in args.only:
+                continue
+            reason = skip_reason(name, fixtures, args)
+            if reason:
+                print(f'{name:<24} 略過: {reason}')
+                continue
+            try:
+                result = measure_case(name, fixture_dir, args)
+            except RuntimeError as e:
+                errors.append(f'{name}: 執行失敗 {e}')
+                continue
+            results[name] = result
+            print(f"{name:<24} {result['seconds']:>8.3f}s  {_format(result['units_per_s']):>8} {result['unit']}/s  "
+                  f"{_format(result['mb_per_s']):>7} MB/s  peak {_format(result['peak_rss_mb'], 0):>5} MB")
+    finally:
+        if temporary:
+            temporary.cleanup()
+
+    report = {
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'machine': platform.machine(), 'cpu_count': os.cpu_count()},
+        'options': {'scale': args.scale, 'repeat': args.repeat, 'workers': args.workers, 'dpi': args.dpi},
+        'results': results,
+    }
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('options', {}).get('scale') != args.scale:
+            print(f"警告: 基準的 scale 為 {baseline.get('options', {}).get('scale')}，與本次 {args.scale} 不同")
+        errors.extend(compare(results, baseline['results'], args.tolerance))
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                json.dump(report, file, indent=2)
+    for error in errors:
+        print(error)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
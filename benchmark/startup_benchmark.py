@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各工具進入點：模組名稱、啟動時不應載入的重量級套件、產生第一個輸出的最小工作
+# 時間預算(毫秒)為 (import 時間, 從啟動直譯器到產生第一個輸出的時間)
+ENTRY_POINTS = {
+    'pdf_dpi_conversion_tools': {
+        'module': 'pdf_tools.pdf_dpi_conversion_tools',
+        'forbidden': ['numpy', 'PIL'],
+        'first_output': 'pdf',
+        'budget_ms': (400, 1500),
+    },
+    'merge_img': {
+        'module': 'merge_img',
+        'forbidden': ['numpy', 'cv2'],
+        'first_output': "merge_img.merge_img_to_one_pdf('{images}', 'out.pdf')",
+        'budget_ms': (300, 1000),
+    },
+    'gif_tools': {
+        'module': 'gif_tools.gif_tools',
+        'forbidden': ['cv2', 'moviepy', 'numpy'],
+        'first_output': "gif_tools.gif_tools.convert_images_to_gif('{images}', 'out.gif')",
+        'budget_ms': (200, 1500),
+    },
+    'tif_tools': {
+        'module': 'tif_tools.tif_tools',
+        'forbidden': ['numpy', 'cv2'],
+        'first_output': "tif_tools.tif_tools.TifTools().process_single_page('{tif}', 0)",
+        'budget_ms': (300, 1000),
+    },
+    'crop_text': {
+        'module': 'crop_text.crop_text',
+        'forbidden': ['cv2', 'numpy'],
+        'first_output': "crop_text.crop_text.crop_text('{tif}', save=True)",
+        'budget_ms': (200, 2000),
+    },
+    'read_img_exif': {
+        'module': 'read_img_exif.read_img_exif',
+        'forbidden': ['numpy', 'cv2'],
+        'first_output': "read_img_exif.read_img_exif.ReadExif.pil_tag_v2('{tif}')",
+        'budget_ms': (400, 1000),
+    },
+    'rename_file_and_folder': {
+        'module': 'rename_file_and_folder.raname_file_and_folder',
+        'forbidden': ['numpy', 'cv2', 'PIL'],
+        'first_output': "rename_file_and_folder.raname_file_and_folder.rename_files_by_string('{images}', 'zz', 'yy')",
+        'budget_ms': (100, 500),
+    },
+    'add_watermark': {
+        'module': 'watermark.add_watermark',
+        'forbidden': ['numpy', 'cv2'],
+        'first_output': None,  # 需要 msjhbd.ttc 字型，只量測 import
+        'budget_ms': (300, None),
+    },
+}
+
+IMPORT_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"import_ms": elapsed, "loaded": sorted({{name.split(".")[0] for name in sys.modules}})}}))
+'''
+
+
+def create_fixtures(fixture_dir):
+    """
+    產生量測用的小型輸入檔：兩張圖片的資料夾、單頁 tif、單頁 pdf
+    :param fixture_dir: 輸入檔存放的資料夾
+    :return: 各輸入檔路徑
+    """
+    from PIL import Image, ImageDraw
+
+    images_dir = os.path.join(fixture_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    for i in range(2):
+        img = Image.new('RGB', (64, 64), 'white')
+        ImageDraw.Draw(img).rectangle((10 + i, 10, 40, 40), fill='black')
+        img.save(os.path.join(images_dir, f'{i}.png'))
+    tif_path = os.path.join(fixture_dir, 'page.tif')
+    img.save(tif_path, compression='tiff_lzw')
+
+    fixtures = {'images': images_dir, 'tif': tif_path, 'pdf': None}
+    try:
+        import fitz
+        doc = fitz.open()
+        doc.new_page(width=200, height=200).insert_text((20, 40), 'startup')
+        fixtures['pdf'] = os.path.join(fixture_dir, 'page.pdf')
+        doc.save(fixtures['pdf'])
+    except ImportError:
+        pass
+    return fixtures
+
+
+def _run(args, cwd):
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    start = time.perf_counter()
+    result = subprocess.run(args, cwd=cwd, env=env, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    return elapsed, result.stdout
+
+
+def measure_entry_point(entry, fixtures, work_dir, repeat=3):
+    """
+    在新的直譯器中量測 import 時間、啟動時載入的重量級套件、以及產生第一個輸出的時間，取多次中的最小值
+    :return: 量測結果 dict
+    """
+    import_ms, loaded = [], set()
+    for _ in range(repeat):
+        _, stdout = _run([sys.executable, '-c', IMPORT_PROBE.format(module=entry['module'])], work_dir)
+        probe = json.loads(stdout.strip().splitlines()[-1])
+        import_ms.append(probe['import_ms'])
+        loaded = set(probe['loaded'])
+    result = {
+        'import_ms': min(import_ms),
+        'heavy_loaded': sorted(set(entry['forbidden']) & loaded),
+        'first_output_ms': None,
+    }
+
+    first_output = entry['first_output']
+    if first_output == 'pdf':
+        if not fixtures['pdf']:
+            return result
+        args = [sys.executable, os.path.join(ROOT_DIR, 'pdf_tools', 'pdf_dpi_conversion_tools.py'),
+                fixtures['pdf'], '--page', '1', '--dpi', '72']
+    elif first_output:
+        args = [sys.executable, '-c', f"import {entry['module']}; " + first_output.format(**fixtures)]
+    else:
+        return result
+    result['first_output_ms'] = min(_run(args, work_dir)[0] for _ in range(repeat))
+    return result
+
+
+def check_budget(name, entry, result):
+    """
+    檢查量測結果是否超出預算
+    :return: 錯誤訊息清單
+    """
+    errors = []
+    import_budget, output_budget = entry['budget_ms']
+    if result['heavy_loaded']:
+        errors.append(f"{name}: import 時載入了 {', '.join(result['heavy_loaded'])}")
+    if result['import_ms'] > import_budget:
+        errors.append(f"{name}: import {result['import_ms']:.0f}ms 超過預算 {import_budget}ms")
+    if output_budget and result['first_output_ms'] and result['first_output_ms'] > output_budget:
+        errors.append(f"{name}: 第一個輸出 {result['first_output_ms']:.0f}ms 超過預算 {output_budget}ms")
+    return errors
+
+
+def main():
+    """
+    量測每個工具的冷啟動時間，超出預算或啟動時載入重量級套件時以結束碼 1 結束
+    使用方式: python benchmark/startup_benchmark.py [--repeat 3] [--json result.json] [--scale 1.5]
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Measure cold-start time of every ImgTools entry point.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the fastest is kept.')
+    parser.add_argument('--json', type=str, default=None, help='Write the results to a JSON file.')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply every budget, for slower machines.')
+    parser.add_argument('--only', nargs='*', default=None, help='Entry points to measure.')
+    args = parser.parse_args()
+
+    results, errors = {}, []
+    with tempfile.TemporaryDirectory() as work_dir:
+        fixtures = create_fixtures(work_dir)
+        for name, entry in ENTRY_POINTS.items():
+            if args.only and name not in args.only:
+                continue
+            entry = dict(entry, budget_ms=tuple(budget * args.scale if budget else budget
+                                                for budget in entry['budget_ms']))
+            try:
+                result = measure_entry_point(entry, fixtures, work_dir, repeat=args.repeat)
+            except RuntimeError as e:
+                errors.append(f'{name}: 執行失敗 {e}')
+                continue
+            results[name] = result
+            errors.extend(check_budget(name, entry, result))
+            first_output = f"{result['first_output_ms']:.0f}ms" if result['first_output_ms'] else '-'
+            print(f"{name:<28} import {result['import_ms']:>7.1f}ms  first output {first_output:>8}  "
+                  f"heavy {','.join(result['heavy_loaded']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+    for error in errors:
+        print(error)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
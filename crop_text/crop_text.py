@@ -1,8 +1,14 @@
-import cv2
-import numpy as np
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
 from PIL import Image
 
+if __package__ in (None, ''):
+    # 在 crop_text 資料夾中直接執行時，將專案根目錄加入搜尋路徑以載入 trace_tools
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trace_tools.stage_trace import stage
+
 def process_image(image_input):
     if isinstance(image_input, Image.Image):
         # 如果傳入參數是PIL圖像，直接回傳圖像
@@ -18,92 +24,363 @@ def process_image(image_input):
         raise ValueError("Invalid input. Please provide a PIL image or a file path.")
 
 
-def crop_text(img_path, limit_length=None, dilate_iter=10, save=False):
+def dilate_binary(binary_image, radius):
     """
-    裁切圖片(白底)，並生成去背透明圖層，會根據框選出的輪廓做裁切
-    使用 limit_length 可以強制指定底圖尺寸大小，若不指定，則會生成裁切的輪廓尺寸*1.2的底圖
-    使用 dilate_iter 可以調整膨脹係數，若兩個文字間太靠近，則建議降低膨脹係數，須注意膨脹係數調整太小可能會造成文字獨立的點被分離
-    :param img_path: 圖片路徑
-    :param limit_length: 指定底圖大小
-    :param dilate_iter: 膨脹係數
-    :param save: 是否儲存圖片，若不儲存圖片則顯示圖片
-    :return:
+    以 3x3 核膨脹 radius 次的等效結果，執行時間與 radius 無關
+    3x3 核重複膨脹 n 次等同於一次 (2n+1)x(2n+1) 矩形核膨脹，也等同於棋盤距離不超過 n 的範圍，
+    因此以一次距離轉換(兩次掃描)取代，矩形核或分離的一維核在 cv2 中的耗時仍會隨半徑增加
+    :param binary_image: 二值化圖片(前景為255)
+    :param radius: 膨脹半徑，等同原本的 dilate_iter
+    :return: 膨脹後的二值化圖片
     """
-    # 載入圖片
-    image = process_image(img_path)
-    image = image.convert("RGB")
-    image = np.uint8(image)
-    image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    import cv2
 
-    # 轉換成灰階圖片
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if radius <= 0:
+        return binary_image.copy()
+    # 計算每個背景像素到最近前景像素的棋盤距離
+    distance = cv2.distanceTransform(cv2.bitwise_not(binary_image), cv2.DIST_C, 3)
+    return cv2.compare(distance, float(radius), cv2.CMP_LE)
 
-    # 二值化處理
-    threshold_value, threshold_image = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
 
-    # 膨脹操作
-    kernel = np.ones((3, 3), np.uint8)
-    dilated_image = cv2.dilate(threshold_image, kernel, iterations=dilate_iter)
+def find_glyph_boxes(threshold_image, dilate_iter=10, proxy_scale=None):
+    """
+    膨脹二值化圖片使相鄰筆畫連成一組，並回傳每組輪廓的外接矩形
+    :param threshold_image: 二值化圖片(前景為255)
+    :param dilate_iter: 膨脹係數
+    :param proxy_scale: 若指定(例如 0.25)，則在縮小的代理圖上分組，再將外接矩形換算回原始解析度，適合大圖
+    :return: 外接矩形清單 [(x, y, w, h), ...]
+    """
+    import cv2
 
-    # 尋找輪廓
-    contours, hierarchy = cv2.findContours(dilated_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not proxy_scale or proxy_scale >= 1:
+        dilated_image = dilate_binary(threshold_image, dilate_iter)
+        contours, hierarchy = cv2.findContours(dilated_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return [cv2.boundingRect(contour) for contour in contours]
 
-    # 創建img資料夾
-    if not os.path.exists('img'):
-        os.mkdir('img')
+    height, width = threshold_image.shape[:2]
+    proxy_size = (max(1, round(width * proxy_scale)), max(1, round(height * proxy_scale)))
+    # INTER_AREA 取區塊平均，只要區塊內有前景像素就視為前景，細筆畫縮小後不會消失
+    proxy = cv2.resize(threshold_image, proxy_size, interpolation=cv2.INTER_AREA)
+    proxy = cv2.threshold(proxy, 0, 255, cv2.THRESH_BINARY)[1]
+    dilated_image = dilate_binary(proxy, max(1, round(dilate_iter * proxy_scale)) if dilate_iter else 0)
+    contours, hierarchy = cv2.findContours(dilated_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    # 遍歷每個輪廓
-    for i, contour in enumerate(contours):
-        # 計算輪廓的外接矩形
+    scale_x, scale_y = width / proxy_size[0], height / proxy_size[1]
+    boxes = []
+    for contour in contours:
         x, y, w, h = cv2.boundingRect(contour)
+        x1, y1 = int(x * scale_x), int(y * scale_y)
+        x2, y2 = min(width, int((x + w) * scale_x + 0.999)), min(height, int((y + h) * scale_y + 0.999))
+        boxes.append((x1, y1, x2 - x1, y2 - y1))
+    return boxes
+
+
+def _center_on_canvas(glyph, canvas_height, canvas_width):
+    """
+    將圖片置中放置在透明底圖上，以一次 np.pad 產生結果，超出底圖的部分會被裁掉
+    """
+    import numpy as np
+
+    height, width = glyph.shape[:2]
+    x1 = max(0, int(canvas_width / 2) - int(width / 2))
+    y1 = max(0, int(canvas_height / 2) - int(height / 2))
+    # 擷取圖片的部分可能超出範圍
+    glyph = glyph[:canvas_height - y1, :canvas_width - x1]
+    height, width = glyph.shape[:2]
+    return np.pad(glyph, ((y1, canvas_height - y1 - height), (x1, canvas_width - x1 - width), (0, 0)))
+
+
+def extract_glyphs(image, limit_length=None, dilate_iter=10, proxy_scale=None):
+    """
+    裁切圖片(白底)中的每組文字，並生成去背透明的 RGBA 陣列，不寫入硬碟
+    :param image: PIL 圖像
+    :param limit_length: 指定底圖大小，若不指定，則會生成裁切的輪廓尺寸*1.2的底圖
+    :param dilate_iter: 膨脹係數
+    :param proxy_scale: 在縮小的代理圖上分組文字，例如 0.25，若為 None 則使用原圖
+    :return: RGBA 陣列清單
+    """
+    import cv2
+    import numpy as np
+
+    with stage('decode', 'crop_text') as span:
+        rgb_image = np.asarray(image.convert("RGB"))
+        span.image(image)
+
+    # 轉換成灰階圖片並二值化
+    with stage('threshold', 'crop_text'):
+        gray_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+        threshold_value, threshold_image = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    # 膨脹操作並尋找輪廓的外接矩形，執行時間不隨膨脹係數增加
+    with stage('segment', 'crop_text', dilate_iter=dilate_iter, proxy_scale=proxy_scale) as span:
+        boxes = find_glyph_boxes(threshold_image, dilate_iter, proxy_scale=proxy_scale)
+        span.add(boxes=len(boxes))
+
+    glyphs = []
+    with stage('crop', 'crop_text', boxes=len(boxes)):
+        for x, y, w, h in boxes:
+            # 擷取圖片並以二值化圖片作為 alpha 通道完成去背
+            rgba = np.dstack((rgb_image[y:y+h, x:x+w], threshold_image[y:y+h, x:x+w]))
+            if limit_length:
+                glyphs.append(_center_on_canvas(rgba, limit_length, limit_length))
+            else:
+                glyphs.append(_center_on_canvas(rgba, int(h*1.2), int(w*1.2)))
+    return glyphs
+
+
+def otsu_threshold(histogram):
+    """
+    由 256 階灰階直方圖計算 Otsu 門檻值，結果與 cv2.THRESH_OTSU 相同，可先分段累加直方圖再計算整張圖的門檻值
+    :param histogram: 長度 256 的像素數量陣列
+    :return: 門檻值，灰階值大於門檻值者為背景
+    """
+    import numpy as np
+
+    probability = np.asarray(histogram, dtype=np.float64) / max(1, np.sum(histogram))
+    omega = np.cumsum(probability)
+    mu = np.cumsum(probability * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    valid = (omega >= np.finfo(np.float32).eps) & (1 - omega >= np.finfo(np.float32).eps)
+    return int(np.argmax(np.where(valid, sigma, 0)))
+
+
+def _band_arrays(band, threshold_value):
+    """
+    將一段圖像轉為 RGB 陣列與二值化圖片(前景為255)
+    """
+    import cv2
+    import numpy as np
+
+    rgb_image = np.asarray(band.convert("RGB"))
+    gray_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+    return rgb_image, cv2.threshold(gray_image, threshold_value, 255, cv2.THRESH_BINARY_INV)[1]
+
+
+def _find(parent, node):
+    while parent[node] != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
 
-        # 擷取圖片
-        extracted_image = image[y:y+h, x:x+w]
 
-        # 擷取二值化圖片作為 alpha 通道
-        extracted_alpha = threshold_image[y:y+h, x:x+w]
+def find_glyph_boxes_tiled(reader, threshold_value, dilate_iter=10, band_height=1024):
+    """
+    分段尋找超大圖片中每組文字的外接矩形，記憶體用量只與 band_height 有關
+    每段多讀取上下 dilate_iter 列使膨脹結果與整張圖相同，再以連通元件標記，並合併跨越分段邊界的元件
+    與 RETR_EXTERNAL 不同之處：位於其他組孔洞內的獨立組也會各自輸出
+    :param reader: tif_tools.tiff_index.BandReader
+    :param threshold_value: 二值化門檻值，灰階值小於等於此值者為前景
+    :param dilate_iter: 膨脹係數
+    :param band_height: 每段的列數，會對齊 tif 的 strip/tile 高度
+    :return: 外接矩形清單 [(x, y, w, h), ...]，依 y、x 排序
+    """
+    import cv2
+    import numpy as np
 
-        # 去背處理
-        b, g, r = cv2.split(extracted_image)
-        rgba = [b, g, r, extracted_alpha]
-        extracted_image_rgba = cv2.merge(rgba, 4)
+    width, height = reader.size
+    band_height = max(1, band_height // reader.block_height) * reader.block_height
+    parent, boxes = [], []
+    previous_row = None
+    for top in range(0, height, band_height):
+        bottom = min(height, top + band_height)
+        read_top, read_bottom = max(0, top - dilate_iter), min(height, bottom + dilate_iter)
+        with stage('decode', 'crop_text', top=read_top, bottom=read_bottom) as span:
+            band = reader.read_rows(read_top, read_bottom)
+            span.image(band)
+        _, threshold_image = _band_arrays(band, threshold_value)
+        with stage('segment', 'crop_text', top=top, bottom=bottom) as span:
+            core = dilate_binary(threshold_image, dilate_iter)[top - read_top:bottom - read_top]
+            count, labels, stats, _ = cv2.connectedComponentsWithStats(core, connectivity=8)
+            span.add(boxes=count - 1)
 
-        # 建立透明底圖
-        if limit_length:
-            transparent_image = np.zeros((limit_length, limit_length, 4), dtype=np.uint8)
+        # 以全域編號記錄元件，編號 0 保留給背景
+        base = len(parent) - 1
+        for label in range(1, count):
+            x, y, w, h = stats[label, :4]
+            parent.append(len(parent))
+            boxes.append([x, y + top, x + w, y + top + h])
+        # 只有第一列與最後一列需要與相鄰的段落比對
+        current_row, last_row = (np.where(row > 0, row.astype(np.int64) + base, -1) for row in (labels[0], labels[-1]))
+        if previous_row is None:
+            previous_row = last_row
+            continue
+
+        # 與上一段最後一列八連通相鄰的元件屬於同一組
+        for dx in (-1, 0, 1):
+            upper = previous_row[max(0, -dx):width - max(0, dx)]
+            lower = current_row[max(0, dx):width - max(0, -dx)]
+            touching = (upper >= 0) & (lower >= 0)
+            for a, b in set(zip(upper[touching].tolist(), lower[touching].tolist())):
+                root_a, root_b = _find(parent, a), _find(parent, b)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+        previous_row = last_row
+
+    merged = {}
+    for node, box in enumerate(boxes):
+        root = _find(parent, node)
+        if root in merged:
+            merged_box = merged[root]
+            merged[root] = [min(merged_box[0], box[0]), min(merged_box[1], box[1]),
+                            max(merged_box[2], box[2]), max(merged_box[3], box[3])]
         else:
-            transparent_image = np.zeros((int(w*1.2), int(h*1.2), 4), dtype=np.uint8)
+            merged[root] = box
+    return sorted(((int(x1), int(y1), int(x2 - x1), int(y2 - y1)) for x1, y1, x2, y2 in merged.values()),
+                  key=lambda box: (box[1], box[0]))
+
+
+def iter_glyphs_tiled(img_path, limit_length=None, dilate_iter=10, band_height=1024, page=0):
+    """
+    以分段讀取的方式裁切超大掃描檔(白底)中的每組文字，不需將整張圖載入記憶體
+    第一次讀取累加灰階直方圖計算整張圖的 Otsu 門檻值，第二次讀取分段尋找文字外接矩形，最後再從原始檔案讀取文字所在的列完成裁切
+    strip 或 tile 儲存的 tif 只會解碼需要的部分；無法分段讀取的圖片(png、jpg 或單一 strip 的 LZW、G4 tif 等)
+    只有在不超過 BandReader 每次解碼的像素上限時才會整張載入，否則拋出 ValueError
+    :param img_path: 圖片路徑
+    :param limit_length: 指定底圖大小，若不指定，則會生成裁切的輪廓尺寸*1.2的底圖
+    :param dilate_iter: 膨脹係數
+    :param band_height: 每段的列數
+    :param page: 多頁 tif 的頁碼(從0開始)
+    :return: 依序產生 ((x, y, w, h), RGBA 陣列)
+    """
+    import cv2
+    import numpy as np
+    from tif_tools.tiff_index import BandReader
+
+    with BandReader(img_path, page=page) as reader:
+        width, height = reader.size
+        step = max(1, band_height // reader.block_height) * reader.block_height
+        histogram = np.zeros(256, dtype=np.int64)
+        with stage('histogram', 'crop_text', pixels=width * height):
+            for top in range(0, height, step):
+                rgb_image = np.asarray(reader.read_rows(top, top + step).convert("RGB"))
+                histogram += np.bincount(cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY).ravel(), minlength=256)
+            threshold_value = otsu_threshold(histogram)
 
-        # 計算圖片置中位置
-        center_x = int(transparent_image.shape[1] / 2)
-        center_y = int(transparent_image.shape[0] / 2)
-        offset_x = int(w / 2)
-        offset_y = int(h / 2)
-        x1 = center_x - offset_x
-        y1 = center_y - offset_y
-        x2 = x1 + w
-        y2 = y1 + h
+        boxes = find_glyph_boxes_tiled(reader, threshold_value, dilate_iter=dilate_iter, band_height=band_height)
+        index = 0
+        while index < len(boxes):
+            # 起點落在同一段的文字一次讀取，段落範圍延伸到其中最低的文字底部
+            top = boxes[index][1]
+            end = index
+            while end < len(boxes) and boxes[end][1] < top + step:
+                end += 1
+            bottom = max(y + h for _, y, _, h in boxes[index:end])
+            with stage('decode', 'crop_text', top=top, bottom=bottom) as span:
+                band = reader.read_rows(top, bottom)
+                span.image(band)
+            rgb_image, threshold_image = _band_arrays(band, threshold_value)
+            for x, y, w, h in boxes[index:end]:
+                y -= top
+                rgba = np.dstack((rgb_image[y:y+h, x:x+w], threshold_image[y:y+h, x:x+w]))
+                if limit_length:
+                    glyph = _center_on_canvas(rgba, limit_length, limit_length)
+                else:
+                    glyph = _center_on_canvas(rgba, int(h*1.2), int(w*1.2))
+                yield (x, y + top, w, h), glyph
+            index = end
 
-        # 將圖片置中放置在透明底圖上
-        x1 = max(0, x1)
-        y1 = max(0, y1)
-        x2 = min(transparent_image.shape[1], x2)
-        y2 = min(transparent_image.shape[0], y2)
 
-        # 擷取圖片的部分可能超出範圍
-        extracted_image_rgba = extracted_image_rgba[:y2-y1, :x2-x1]
+def crop_text_tiled(img_path, output_dir='img', limit_length=None, dilate_iter=10, band_height=1024, page=0):
+    """
+    分段裁切超大掃描檔中的文字，並逐一存成 {序號}.png，記憶體用量只與 band_height 及單組文字大小有關
+    :param img_path: 圖片路徑
+    :param output_dir: 輸出資料夾
+    :param limit_length: 指定底圖大小
+    :param dilate_iter: 膨脹係數
+    :param band_height: 每段的列數
+    :param page: 多頁 tif 的頁碼(從0開始)
+    :return: 輸出路徑清單
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    paths = []
+    for i, (_, glyph) in enumerate(iter_glyphs_tiled(img_path, limit_length=limit_length, dilate_iter=dilate_iter,
+                                                     band_height=band_height, page=page)):
+        path = os.path.join(output_dir, f'{i}.png')
+        with stage('encode', 'crop_text', path=path) as span:
+            Image.fromarray(glyph, "RGBA").save(path)
+            span.file(path)
+        paths.append(path)
+    return paths
+
+
+def crop_text(img_path, limit_length=None, dilate_iter=10, save=False, proxy_scale=None):
+    """
+    裁切圖片(白底)，並生成去背透明圖層，會根據框選出的輪廓做裁切
+    使用 limit_length 可以強制指定底圖尺寸大小，若不指定，則會生成裁切的輪廓尺寸*1.2的底圖
+    使用 dilate_iter 可以調整膨脹係數，若兩個文字間太靠近，則建議降低膨脹係數，須注意膨脹係數調整太小可能會造成文字獨立的點被分離
+    :param img_path: 圖片路徑
+    :param limit_length: 指定底圖大小
+    :param dilate_iter: 膨脹係數
+    :param save: 是否儲存圖片，若不儲存圖片則顯示圖片
+    :param proxy_scale: 在縮小的代理圖上分組文字，例如 0.25，適合大圖加速，若為 None 則使用原圖
+    :return:
+    """
+    # 載入圖片
+    image = process_image(img_path)
+    glyphs = extract_glyphs(image, limit_length=limit_length, dilate_iter=dilate_iter, proxy_scale=proxy_scale)
 
-        transparent_image[y1:y2, x1:x2] = extracted_image_rgba
+    # 創建img資料夾
+    if not os.path.exists('img'):
+        os.mkdir('img')
 
+    for i, glyph in enumerate(glyphs):
+        tmp_img = Image.fromarray(glyph, "RGBA")
         if save:
             # 儲存圖片
-            filename = os.path.join('img', f'{i}.png')
-            cv2.imwrite(filename, transparent_image)
+            tmp_img.save(os.path.join('img', f'{i}.png'))
         else:
-            tmp_img = Image.fromarray(transparent_image)
             tmp_img.show()
 
 
+def _crop_text_task(task):
+    index, image_input, output_dir, limit_length, dilate_iter, proxy_scale = task
+    if isinstance(image_input, str):
+        name = os.path.splitext(os.path.basename(image_input))[0]
+        image = Image.open(image_input)
+    else:
+        name = f"{index:05d}"
+        image = image_input
+    glyphs = extract_glyphs(image, limit_length=limit_length, dilate_iter=dilate_iter, proxy_scale=proxy_scale)
+    if not output_dir:
+        return glyphs
+
+    paths = []
+    for i, glyph in enumerate(glyphs):
+        path = os.path.join(output_dir, f"{name}_{i:03d}.png")
+        with stage('encode', 'crop_text', path=path) as span:
+            Image.fromarray(glyph, "RGBA").save(path)
+            span.file(path)
+        paths.append(path)
+    return paths
+
+
+def crop_text_batch(inputs, workers=None, output_dir=None, limit_length=None, dilate_iter=10, proxy_scale=None):
+    """
+    以多行程批次裁切多張圖片中的文字
+    :param inputs: 圖片資料夾路徑，或圖片路徑、PIL 圖像的可迭代物件
+    :param workers: 行程數量，若為 None 則使用 CPU 核心數，1 則不使用行程池
+    :param output_dir: 若指定則將結果存成 {檔名}_{序號:03d}.png，PIL 圖像輸入的檔名為輸入順序 {序號:05d}
+    :param limit_length: 指定底圖大小
+    :param dilate_iter: 膨脹係數
+    :param proxy_scale: 在縮小的代理圖上分組文字，例如 0.25
+    :return: 依輸入順序的結果清單，每個元素為該圖片的 RGBA 陣列清單，或指定 output_dir 時的輸出路徑清單
+    """
+    if isinstance(inputs, str):
+        inputs = sorted(os.path.join(inputs, file) for file in os.listdir(inputs)
+                        if '.tif' in file or '.png' in file or '.jpg' in file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    tasks = ((index, image_input, output_dir, limit_length, dilate_iter, proxy_scale)
+             for index, image_input in enumerate(inputs))
+    if workers == 1:
+        return [_crop_text_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_crop_text_task, tasks))
+
+
 if __name__ == '__main__':
     img_path = r"../merge_img/2_square.tif"
     crop_text(img_path, dilate_iter=500)
@@ -1,38 +1,169 @@
 import glob
+import math
 import os
+import queue
+import sys
+import threading
 
-import cv2
-import moviepy.editor as mp
 from PIL import Image
 
+if __package__ in (None, ''):
+    # 在 gif_tools 資料夾中直接執行時，此檔名會遮蔽同名的套件，將專案根目錄加到搜尋路徑最前面
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trace_tools.stage_trace import stage
 
-def convert_mp4_to_frame(input_file, output_folder="output", filename_template="frame_{:03d}.png"):
+# cv2、moviepy 與 gif_writer(numpy) 載入較慢，只在使用到的函數中才載入，縮短命令列工具的啟動時間
+
+
+def iter_video_frames(input_file, start=None, end=None, stride=1):
+    """
+    逐幀讀取影片的生成器，不寫入硬碟
+    :param input_file: 輸入 mp4 影片檔案路徑
+    :param start: 開始時間，單位為秒，透過 CAP_PROP_POS_MSEC 直接跳轉，不解碼之前的幀
+    :param end: 結束時間(不包含)，單位為秒，若為 None 則讀到影片結尾
+    :param stride: 每隔幾幀取一幀，預設為 1
+    :return: 依序產生 (幀編號, BGR 圖像)
+    """
+    import cv2
+
+    video_capture = cv2.VideoCapture(input_file)
+    try:
+        fps = video_capture.get(cv2.CAP_PROP_FPS) or 30
+        if start:
+            video_capture.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+        frame_index = round(video_capture.get(cv2.CAP_PROP_POS_FRAMES))
+        end_index = end * fps if end is not None else math.inf
+        # 間隔超過一秒時以 CAP_PROP_POS_MSEC 跳轉；較短的間隔以 grab 略過，避免每次跳轉都要從關鍵幀重新解碼
+        seek = stride > fps
+        while frame_index < end_index:
+            with stage('decode', 'gif', frame=frame_index) as span:
+                still_reading, image = video_capture.read()
+                if still_reading and span:
+                    span.add(pixels=image.shape[0] * image.shape[1])
+            if not still_reading:
+                break
+            yield frame_index, image
+            frame_index += stride
+            if seek:
+                video_capture.set(cv2.CAP_PROP_POS_MSEC, frame_index / fps * 1000)
+            elif not all(video_capture.grab() for _ in range(stride - 1)):
+                break
+    finally:
+        video_capture.release()
+
+
+def sample_video_frames(input_file, count, start=None, end=None):
+    """
+    在影片的時間範圍內平均跳轉讀取數幀，供計算 gif 全域調色盤使用
+    :param input_file: 輸入 mp4 影片檔案路徑
+    :param count: 讀取的幀數
+    :param start: 開始時間，單位為秒
+    :param end: 結束時間(不包含)，單位為秒，若為 None 則到影片結尾
+    :return: BGR 圖像清單，無法取得影片總幀數時為空清單
+    """
+    import cv2
+
+    video_capture = cv2.VideoCapture(input_file)
+    try:
+        fps = video_capture.get(cv2.CAP_PROP_FPS) or 30
+        total = video_capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        if total <= 0:
+            return []
+        first_index = round((start or 0) * fps)
+        end_index = min(total, end * fps) if end is not None else total
+        step = max((end_index - first_index) / count, 1)
+        images = []
+        for i in range(count):
+            frame_index = round(first_index + i * step)
+            if frame_index >= end_index:
+                break
+            with stage('sample', 'gif', frame=frame_index):
+                video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                still_reading, image = video_capture.read()
+            if not still_reading:
+                break
+            images.append(image)
+        return images
+    finally:
+        video_capture.release()
+
+
+def _imwrite_params(file_path, compression_level):
+    """
+    依副檔名取得 cv2.imwrite 的壓縮參數：png 為壓縮等級(0-9)，jpg、webp 為品質(0-100)
+    """
+    import cv2
+
+    if compression_level is None:
+        return []
+    ext = os.path.splitext(file_path)[1].lower()
+    flags = {".png": cv2.IMWRITE_PNG_COMPRESSION, ".jpg": cv2.IMWRITE_JPEG_QUALITY,
+             ".jpeg": cv2.IMWRITE_JPEG_QUALITY, ".webp": cv2.IMWRITE_WEBP_QUALITY}
+    return [flags[ext], compression_level] if ext in flags else []
+
+
+def convert_mp4_to_frame(input_file, output_folder="output", filename_template="frame_{:03d}.png", start=None,
+                         end=None, stride=1, compression_level=None, workers=4, queue_size=16):
     """
     將 mp4 影片檔案轉換為逐幀的圖片檔，並儲存到指定的資料夾。
+    讀取影片的同時，由多個執行緒從有上限的佇列中取出幀並壓縮寫檔
     :param input_file: 輸入 mp4 影片檔案路徑
     :param output_folder: 儲存輸出圖片的資料夾。如果資料夾不存在，將會自動建立
-    :param filename_template: 輸出圖片的檔名模板。應包含一個用於插入幀編號的格式化字段
+    :param filename_template: 輸出圖片的檔名模板。應包含一個用於插入幀編號的格式化字段，副檔名決定輸出格式(png、jpg、webp…)
+    :param start: 開始時間，單位為秒
+    :param end: 結束時間(不包含)，單位為秒
+    :param stride: 每隔幾幀取一幀
+    :param compression_level: png 的壓縮等級(0-9)或 jpg、webp 的品質(0-100)，若為 None 則使用 cv2 預設值
+    :param workers: 寫檔執行緒數量
+    :param queue_size: 等待寫檔的幀數上限，限制記憶體用量
     :return:
     """
+    import cv2
+
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
-    # 先將mp4文件的所有幀讀取出儲存成圖片
-    video_capture = cv2.VideoCapture(input_file)
-    still_reading, image = video_capture.read()
+    params = _imwrite_params(filename_template, compression_level)
+    frame_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    def write_frames():
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                break
+            output_path, image = item
+            try:
+                with stage('encode', 'gif', path=output_path) as span:
+                    cv2.imwrite(output_path, image, params)
+                    if span:
+                        span.add(pixels=image.shape[0] * image.shape[1])
+                        span.file(output_path)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=write_frames, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    # 主執行緒負責解碼，佇列已滿時會等待寫檔執行緒消化
     frame_count = 0
-    while still_reading:
-        output_path = os.path.join(output_folder, filename_template.format(frame_count))
-        cv2.imwrite(output_path, image)
-        # read next image
-        still_reading, image = video_capture.read()
-        frame_count += 1
-    video_capture.release()
+    try:
+        for frame_index, image in iter_video_frames(input_file, start=start, end=end, stride=stride):
+            frame_queue.put((os.path.join(output_folder, filename_template.format(frame_index)), image))
+            frame_count += 1
+    finally:
+        for _ in threads:
+            frame_queue.put(None)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
     print(f"轉換完成 共 {frame_count} 幀")
 
 
 def convert_images_to_gif(folder_path, output_path, convert_color="RGB", duration=40, loop=0):
     """
     將指定資料夾中的圖片轉換為一個 gif 檔案
+    以串流方式逐幀寫入，所有幀共用一組全域調色盤，第一幀之後只儲存與前一幀的差異區域
     :param folder_path:要讀取圖片的資料夾路徑
     :param output_path:儲存生成的 gif 檔案完整路徑
     :param convert_color:圖片轉換的顏色模式，預設為"RGB"推薦使用"L"或"RGBA"
@@ -40,6 +171,8 @@ def convert_images_to_gif(folder_path, output_path, convert_color="RGB", duratio
     :param loop:gif 的循環次數，0 表示無限循環。預設為 0
     :return:
     """
+    from gif_tools.gif_writer import write_gif
+
     # 取得圖片清單並排列
     extensions = ["tif", "png", "jpg"]  # 指定副檔名
     images = []
@@ -49,22 +182,86 @@ def convert_images_to_gif(folder_path, output_path, convert_color="RGB", duratio
     if not images:
         print("No images found.")
         return
-    # 讀取並轉換檔案，建議convert_color為 "L"、"RGBA"
-    frames = [Image.open(image).convert(convert_color) for image in images]
-    # 儲存gif 若無resize成相同大小，gif疊圖會以第一張為準，參數可以自行調整
-    frames[0].save(output_path, format="gif", append_images=frames[1:], save_all=True, duration=duration,
-                   loop=loop, dpi=(600, 600))
+    # 逐幀讀取並轉換檔案，建議convert_color為 "L"、"RGBA"；尺寸與第一張不同的圖片會resize成第一張的尺寸
+    write_gif(images, output_path, duration=duration, loop=loop, convert_color=convert_color)
 
 
-def convert_mp4_to_gif(input_file, output_path):
+def _queued(iterable, queue_size):
+    """
+    在背景執行緒中執行 iterable，並透過有上限的佇列將結果交給呼叫端，讓前後兩個階段可以同時進行
     """
-    調用上面兩個函數完成從 mp4 拆成單幀圖片在合成 gif
+    item_queue = queue.Queue(maxsize=queue_size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                item_queue.put(item)
+        except Exception as e:
+            item_queue.put(e)
+        item_queue.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = item_queue.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def convert_mp4_to_gif(input_file, output_path, fps=None, size=None, start=None, end=None, loop=0, queue_size=16,
+                       sample_count=8):
+    """
+    直接將 mp4 轉成 gif，不經過硬碟暫存：cv2 解碼 → 調整尺寸、重新取樣幀率 → gif 串流編碼
+    解碼在背景執行緒進行，幀透過有上限的佇列交給編碼，記憶體用量不隨影片長度增加
     :param input_file: 輸入 mp4 影片檔案路徑
     :param output_path: 儲存生成的 gif 檔案完整路徑
-    :return:
+    :param fps: 輸出 gif 的幀率，若為 None 則使用影片的幀率
+    :param size: 輸出 gif 的尺寸 (寬, 高)，若為 None 則使用影片的尺寸
+    :param start: 開始時間，單位為秒
+    :param end: 結束時間(不包含)，單位為秒
+    :param loop: gif 的循環次數，0 表示無限循環
+    :param queue_size: 解碼與編碼之間等待的幀數上限
+    :param sample_count: 計算全域調色盤時在時間範圍內平均取樣的幀數
+    :return: 寫入的幀數
     """
-    convert_mp4_to_frame(input_file)
-    convert_images_to_gif("./output", output_path)
+    import cv2
+
+    from gif_tools.gif_writer import write_gif
+
+    video_capture = cv2.VideoCapture(input_file)
+    video_fps = video_capture.get(cv2.CAP_PROP_FPS) or 30
+    video_capture.release()
+    fps = fps or video_fps
+
+    def to_frame(image):
+        frame = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        return frame.resize(size) if size else frame
+
+    # 佇列中的幀是依序串流的，write_gif 只能看到最前面的幀，因此另外跳轉取樣整段影片來計算調色盤
+    with stage('sample', 'gif', samples=sample_count) as span:
+        palette_frames = [to_frame(image) for image in sample_video_frames(input_file, sample_count, start, end)]
+        span.add(read=len(palette_frames))
+
+    def resampled_frames():
+        next_time = None
+        for frame_index, image in _queued(iter_video_frames(input_file, start=start, end=end), queue_size):
+            frame_time = frame_index / video_fps
+            # 依輸出幀率挑選幀，略過時間未到下一個輸出時間點的幀
+            if next_time is not None and frame_time + 0.5 / video_fps < next_time:
+                continue
+            next_time = (next_time if next_time is not None else frame_time) + 1 / fps
+            with stage('convert', 'gif', frame=frame_index) as span:
+                frame = to_frame(image)
+                span.image(frame)
+            yield frame
+
+    frame_count = write_gif(resampled_frames(), output_path, duration=1000 / fps, loop=loop,
+                            sample_count=sample_count, palette_frames=palette_frames)
+    print(f"轉換完成 共 {frame_count} 幀")
+    return frame_count
 
 
 def mp4_to_gif(input_file, output_path="output.gif"):
@@ -74,6 +271,8 @@ def mp4_to_gif(input_file, output_path="output.gif"):
     :param output_path: 儲存生成的 gif 檔案完整路徑
     :return:
     """
+    import moviepy.editor as mp
+
     clip_frame = mp.VideoFileClip(input_file)
     clip_frame.write_gif(output_path)
 
@@ -85,6 +284,8 @@ def gif_to_mp4(input_file, output_path="output.mp4"):
     :param output_path: 儲存生成的 mp4 檔案完整路徑
     :return:
     """
+    import moviepy.editor as mp
+
     clip_frame = mp.VideoFileClip(input_file)
     clip_frame.write_videofile(output_path)
 
@@ -95,7 +296,7 @@ if __name__ == "__main__":
     # _input_mp4 = "output.mp4"  # 提取計算完的mp4
     # mp4_to_gif(_input_mp4)  # moviepy將mp4轉gif
 
-    # PIL將mp4轉gif，會先提取每幀到output資料夾下，再進行合併
+    # PIL將mp4轉gif，直接在記憶體中逐幀轉換，不經過output資料夾
     # convert_mp4_to_gif("output.mp4", "output_gif_by_pil.gif")
 
     # 拆分mp4
@@ -0,0 +1,247 @@
+import io
+import itertools
+import os
+import struct
+import sys
+from collections.abc import Sequence
+
+import numpy as np
+from PIL import Image
+
+if __package__ in (None, ''):
+    # 從 gif_tools 資料夾中以 gif_writer 模組名稱載入時，將專案根目錄加入搜尋路徑以載入 trace_tools
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trace_tools.stage_trace import stage
+
+# 全域調色盤保留最後一個索引作為透明色，僅供差異幀標示「未變動」的像素
+TRANSPARENT_INDEX = 255
+
+
+def _load_frame(frame, convert_color=None):
+    """
+    讀取一幀，可傳入 PIL 圖像或圖片路徑，回傳 RGB 圖像
+    """
+    with stage('decode', 'gif') as span:
+        img = Image.open(frame) if isinstance(frame, str) else frame
+        if convert_color:
+            img = img.convert(convert_color)
+        img = img.convert("RGB")
+        span.image(img)
+    return img
+
+
+def build_palette(samples, colors=255, thumb_size=256):
+    """
+    由取樣的幀建立一組共用的全域調色盤
+    :param samples: 取樣的 RGB 圖像
+    :param colors: 調色盤顏色數量，最多 255(保留一個透明索引)
+    :param thumb_size: 取樣圖縮小後的最大邊長，只影響調色盤計算速度
+    :return: 256 色的 P 模式調色盤圖像
+    """
+    thumbs = []
+    for img in samples:
+        thumb = img.copy()
+        thumb.thumbnail((thumb_size, thumb_size))
+        thumbs.append(thumb)
+    montage = Image.new("RGB", (sum(t.width for t in thumbs), max(t.height for t in thumbs)))
+    x = 0
+    for thumb in thumbs:
+        montage.paste(thumb, (x, 0))
+        x += thumb.width
+
+    quantized = montage.quantize(colors=min(colors, TRANSPARENT_INDEX), method=Image.Quantize.MEDIANCUT)
+    used = max(index for _, index in quantized.getcolors(TRANSPARENT_INDEX + 1)) + 1
+    palette = quantized.getpalette()[:used * 3]
+    # 不足 256 色的部分以第0色補齊，映射時距離相同會選擇較前面的索引，因此透明索引不會被一般像素使用
+    palette += palette[:3] * (256 - used)
+    palette_img = Image.new("P", (1, 1))
+    palette_img.putpalette(palette)
+    return palette_img
+
+
+def _encode_image_data(img):
+    """
+    使用 PIL 的 LZW 編碼器壓縮單一 P 模式圖像，並從輸出的 gif 中取出影像描述的旗標與 LZW 資料區塊
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format="gif", interlace=False, optimize=False)
+    data = buffer.getvalue()
+
+    pos = 13
+    if data[10] & 0x80:  # 略過全域色彩表
+        pos += 3 * (2 << (data[10] & 0x07))
+    while data[pos] == 0x21:  # 略過擴充區塊
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    flags = data[pos + 9]
+    pos += 10
+    if flags & 0x80:  # 略過區域色彩表
+        pos += 3 * (2 << (flags & 0x07))
+    start = pos
+    pos += 1
+    while data[pos]:
+        pos += data[pos] + 1
+    return flags & 0x40, data[start:pos + 1]
+
+
+class GIFWriter:
+    """
+    逐幀寫入的 gif 產生器，所有幀共用一組全域調色盤
+    第一幀之後只寫入與前一幀不同的外接矩形，未變動的像素設為透明，相同的幀則合併為同一幀並延長顯示時間
+    """
+
+    def __init__(self, file_path, palette, size, duration=40, loop=0, dither=False):
+        """
+        :param file_path: 輸出 gif 路徑
+        :param palette: build_palette 建立的調色盤圖像
+        :param size: gif 畫布尺寸 (寬, 高)，尺寸不同的幀會被 resize
+        :param duration: 每一幀預設的顯示時間，單位為毫秒
+        :param loop: 循環次數，0 表示無限循環，None 表示不寫入循環設定
+        :param dither: 映射到調色盤時是否使用抖色，抖色會使相鄰幀的雜訊不同而降低差異幀的壓縮效果
+        """
+        self.file_path = file_path
+        self.palette = palette
+        self.size = size
+        self.duration = duration
+        self.dither = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+        self.frame_count = 0
+        self._previous = None
+        self._pending = None
+
+        self._file = open(file_path, "wb")
+        self._file.write(b"GIF89a")
+        self._file.write(struct.pack("<HHBBB", size[0], size[1], 0xF7, 0, 0))
+        self._file.write(bytes(palette.getpalette()[:768]))
+        if loop is not None:
+            self._file.write(b"\x21\xFF\x0BNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_frame(self, img, duration=None):
+        """
+        加入一幀
+        :param img: PIL 圖像
+        :param duration: 此幀的顯示時間，若為 None 則使用預設值
+        """
+        duration = self.duration if duration is None else duration
+        img = img.convert("RGB")
+        if img.size != self.size:
+            with stage('resize', 'gif') as span:
+                img = img.resize(self.size)
+                span.image(img)
+        with stage('quantize', 'gif') as span:
+            indexed = np.asarray(img.quantize(palette=self.palette, dither=self.dither))
+            span.image(img)
+        self.frame_count += 1
+
+        if self._previous is None:
+            self._pending = [0, 0, indexed, False, duration]
+            self._previous = indexed
+            return
+
+        changed = indexed != self._previous
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not rows.size:
+            # 與前一幀相同，只延長前一幀的顯示時間
+            self._pending[4] += duration
+            return
+        cols = np.flatnonzero(changed.any(axis=0))
+        top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        region = indexed[top:bottom, left:right].copy()
+        region[~changed[top:bottom, left:right]] = TRANSPARENT_INDEX
+
+        self._flush()
+        self._pending = [left, top, region, True, duration]
+        self._previous = indexed
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        left, top, region, transparent, duration = self._pending
+        img = Image.fromarray(region, "P")
+        img.putpalette(self.palette.getpalette())
+        with stage('encode', 'gif') as span:
+            interlace, image_data = _encode_image_data(img)
+            span.image(img)
+            span.add(bytes=len(image_data))
+
+        # Graphic Control Extension：disposal=1 保留前一幀，差異幀開啟透明色
+        packed = (1 << 2) | (1 if transparent else 0)
+        self._file.write(struct.pack("<BBBBHBB", 0x21, 0xF9, 4, packed, round(duration / 10), TRANSPARENT_INDEX, 0))
+        self._file.write(struct.pack("<BHHHHB", 0x2C, left, top, img.width, img.height, interlace))
+        self._file.write(image_data)
+        self._pending = None
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._flush()
+        self._file.write(b"\x3B")
+        self._file.close()
+
+
+def _stride_sample(items, sample_count):
+    """
+    從清單中平均取出最多 sample_count 個元素
+    """
+    step = max(len(items) / sample_count, 1)
+    return [items[int(i * step)] for i in range(min(sample_count, len(items)))]
+
+
+def write_gif(frames, output_path, duration=40, loop=0, size=None, convert_color=None, sample_count=8,
+              dither=False, sample_window=64, palette_frames=None):
+    """
+    以串流方式將多幀寫成 gif，記憶體用量固定，不隨幀數增加
+    全域調色盤必須在寫入第一幀之前決定：序列可平均取樣全部的幀；迭代器無法預先看到後面的幀，
+    只能從最前面 sample_window 幀中平均取樣，之後才出現的顏色可能不在調色盤中。
+    迭代器的來源可以重新讀取時(例如影片檔)，應由呼叫端另外取樣整段內容並以 palette_frames 傳入
+    :param frames: 幀的來源，可為 PIL 圖像或圖片路徑的序列或迭代器
+    :param output_path: 儲存生成的 gif 檔案完整路徑
+    :param duration: 每一幀在 gif 中顯示的持續時間，單位為毫秒
+    :param loop: gif 的循環次數，0 表示無限循環
+    :param size: gif 畫布尺寸 (寬, 高)，若為 None 則使用第一幀的尺寸
+    :param convert_color: 幀先轉換的顏色模式，例如 "L" 可輸出灰階 gif
+    :param sample_count: 計算全域調色盤的取樣幀數
+    :param dither: 映射到調色盤時是否使用抖色
+    :param sample_window: 迭代器輸入時，預先讀入記憶體供取樣的幀數上限
+    :param palette_frames: 計算全域調色盤用的幀(PIL 圖像或圖片路徑)，若指定則不從 frames 取樣
+    :return: 寫入的幀數
+    """
+    if isinstance(frames, Sequence):
+        if not frames:
+            return 0
+        first = _load_frame(frames[0], convert_color)
+        if not palette_frames:
+            samples = [first] + [_load_frame(frame, convert_color)
+                                 for frame in _stride_sample(frames, sample_count)[1:]]
+        remaining = (_load_frame(frame, convert_color) for frame in frames[1:])
+    else:
+        iterator = (_load_frame(frame, convert_color) for frame in frames)
+        # 已指定調色盤的取樣幀時只需要讀取第一幀決定尺寸
+        buffered = list(itertools.islice(iterator, 1 if palette_frames else max(sample_window, 1)))
+        if not buffered:
+            return 0
+        first = buffered[0]
+        if not palette_frames:
+            samples = _stride_sample(buffered, sample_count)
+        remaining = itertools.chain(buffered[1:], iterator)
+        del buffered
+    if palette_frames:
+        samples = [_load_frame(frame, convert_color) for frame in palette_frames]
+
+    if size is None:
+        size = first.size
+    with stage('palette', 'gif', samples=len(samples)):
+        palette = build_palette([sample.resize(size) if sample.size != size else sample for sample in samples])
+    with GIFWriter(output_path, palette, size, duration=duration, loop=loop, dither=dither) as writer:
+        writer.add_frame(first)
+        del samples, first
+        for frame in remaining:
+            writer.add_frame(frame)
+    return writer.frame_count
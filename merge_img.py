@@ -1,13 +1,19 @@
 import os
 import tifftools
-from PIL import Image
+from PIL import Image, ImageSequence
 
+from pdf_tools.pdf_writer import PDFWriter
+from tif_tools.tiff_writer import TiffWriter
+from trace_tools.stage_trace import stage
 
-def merge_img_to_one_tif(folder_path, save_file_path):
+
+def merge_img_to_one_tif(folder_path, save_file_path, tile_size=None, levels=None):
     """
     將資料夾下的所有圖片合成一張多幀TIF，合成多幀TIF是直接原圖合併成TIF檔，不受圖像尺寸限制
     :param folder_path: 資料夾路徑
     :param save_file_path: 儲存檔案的路徑
+    :param tile_size: 若指定則重新編碼為分塊(tiled)並含縮小解析度層(SubIFDs)的金字塔 tif
+    :param levels: 金字塔的縮小層數，若為 None 則縮小到整張圖小於一個 tile 為止
     :return: 儲存檔案的路徑
     """
     files = os.listdir(folder_path)  # 讀取資料夾內所有資料
@@ -17,14 +23,27 @@ def merge_img_to_one_tif(folder_path, save_file_path):
             img_path = os.path.join(folder_path, file)
             tif_files.append(img_path)
     tif_files.sort()
+    if tile_size:
+        with TiffWriter(save_file_path, compression='tiff_adobe_deflate', tile_size=tile_size, levels=levels) as writer:
+            for img_path in tif_files:
+                with Image.open(img_path) as img:
+                    for frame in ImageSequence.Iterator(img):
+                        with stage('decode', 'merge_img', path=img_path) as span:
+                            frame = frame.copy()
+                            span.image(frame)
+                        writer.add_page(frame)
+        return save_file_path
     # tifftools合成多幀tif檔案，效率佳又不吃記憶體；Image.save()也可以儲存多幀tif，但效率相對較差
-    tifftools.tiff_concat(tif_files, save_file_path, overwrite=True)
+    with stage('concat', 'merge_img', files=len(tif_files)) as span:
+        tifftools.tiff_concat(tif_files, save_file_path, overwrite=True)
+        span.file(save_file_path)
     return save_file_path
 
 
 def merge_img_to_one_pdf(folder_path, save_file_path):
     """
     將資料夾下的所有圖片合成PDF，不受圖像尺寸限制
+    逐頁寫入PDF，記憶體用量不隨圖片數量增加；JPEG 直接嵌入不重新編碼，G4 壓縮的二值 tif 直接嵌入 CCITT G4 資料，其他二值頁面重新編碼為 G4
     :param folder_path: 資料夾路徑
     :param save_file_path: 儲存檔案的路徑
     :return: 儲存檔案的路徑
@@ -34,29 +53,38 @@ def merge_img_to_one_pdf(folder_path, save_file_path):
     for file in files:
         if '.tif' in file or '.png' in file or '.jpg' in file:  # 檢測若file檔名包含.tif、.png、.jpg 加入要合併的清單
             img_path = os.path.join(folder_path, file)
-            img = Image.open(img_path).convert("RGB")
-            pdf_files.append(img)
-    pdf_files[0].save(save_file_path, "pdf", append_images=pdf_files[1:], save_all=True)
+            pdf_files.append(img_path)
+    pdf_files.sort()
+    with PDFWriter(save_file_path) as writer:
+        for img_path in pdf_files:
+            with stage('add_file', 'merge_img', path=img_path) as span:
+                span.add(pages=writer.add_file(img_path))
+                span.file(img_path)
     return save_file_path
 
 
-def merge_img_to_one_gif(folder_path, save_file_path, duration=1000):
+def merge_img_to_one_gif(folder_path, save_file_path, duration=1000, size=(1000, 1000)):
     """
     將資料夾下的所有圖片合成一張GIF，合成GIF建議圖像尺寸大小相近，否則會按照第一張圖的尺寸作貼圖
+    以串流方式逐幀寫入，所有幀共用一組全域調色盤，第一幀之後只儲存與前一幀的差異區域
     :param folder_path: 資料夾路徑
     :param save_file_path: 儲存檔案的路徑
     :param duration: 圖片間隔時長，單位為毫秒
+    :param size: GIF 尺寸，所有圖片會 resize 成此尺寸，若為 None 則使用第一張圖的尺寸
     :return: 儲存檔案的路徑
     """
+    from gif_tools.gif_writer import write_gif  # gif_writer 依賴 numpy，只在合成 GIF 時載入
+
     files = os.listdir(folder_path)  # 讀取資料夾內所有資料
     gif_list = []
     for file in files:
         if '.tif' in file or '.png' in file or '.jpg' in file:  # 檢測若file檔名包含.tif、.png、.jpg 加入要合併的清單
             img_path = os.path.join(folder_path, file)
-            img = Image.open(img_path).convert("RGB")
-            img = img.resize((1000, 1000))  # 若無resize成相同大小，GIF疊圖會以第一張為準，參數可以自行調整
-            gif_list.append(img)
-    gif_list[0].save(save_file_path, save_all=True, append_images=gif_list[1:], loop=0, duration=duration, disposal=0)
+            gif_list.append(img_path)
+    gif_list.sort()
+    with stage('write_gif', 'merge_img', files=len(gif_list)) as span:
+        write_gif(gif_list, save_file_path, duration=duration, loop=0, size=size)
+        span.file(save_file_path)
     return save_file_path
 
 
@@ -1,10 +1,46 @@
 import argparse
+import hashlib
 import json
+import multiprocessing
 import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import fitz
-import numpy as np
-from PIL import Image
+
+if __package__ in (None, ''):
+    # 直接執行此檔案時，將專案根目錄加入搜尋路徑以載入 trace_tools
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trace_tools.stage_trace import enable as enable_trace, stage
+
+
+GEOMETRY_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.imgtools', 'pdf_geometry')
+
+
+def geometry_cache_key(path):
+    """
+    以檔案的絕對路徑、大小與修改時間作為快取的鍵，與 tiff_index 的 IFD 索引相同，不需讀取檔案內容
+    :param path: 檔案路徑
+    :return: (十六進位字串作為快取檔名, 用於驗證快取的 dict)
+    """
+    stat = os.stat(path)
+    identity = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    key = hashlib.sha1(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+    return key, identity
+
+
+def rect_size_at_dpi(rect, dpi=None):
+    """
+    計算頁面 rect 在指定DPI下渲染出的像素尺寸，規則與 page.get_pixmap 相同
+    :param rect: 頁面範圍，fitz.Rect 或 (x0, y0, x1, y1)
+    :param dpi: 目標DPI，若為 None 則為標準 DPI
+    :return: 像素尺寸（寬和高）
+    """
+    zoom = dpi / PDFOperator.STANDARD_DPI if dpi else 1
+    irect = (fitz.Rect(*rect) * fitz.Matrix(zoom, zoom)).irect
+    return irect.width, irect.height
 
 
 class PDFOperator:
@@ -45,8 +81,53 @@ class PDFOperator:
         :param dpi: 目標DPI
         :return: 目標DPI下的尺寸（寬和高）
         """
-        pix = self.capture_full_page(page_number=page_number, dpi=dpi)
-        return pix.width, pix.height
+        # 直接由頁面 rect(已套用旋轉) 換算，與 get_pixmap 輸出的像素尺寸一致，不需實際渲染
+        return rect_size_at_dpi(self.doc[page_number].rect, dpi)
+
+    def page_geometry(self, page_number=0):
+        """
+        獲取指定頁面的幾何資訊，不進行渲染
+        :param page_number: 頁碼(從0開始)
+        :return: dict，包含 page、rect(已套用旋轉，單位為點)、rotation、image_count
+        """
+        page = self.doc[page_number]
+        return {
+            'page': page_number,
+            'rect': list(page.rect),
+            'rotation': page.rotation,
+            'image_count': len(page.get_images()),
+        }
+
+    def geometry_index(self, cache_dir=None):
+        """
+        建立整份文件的頁面幾何索引並快取在磁碟上，檔案路徑、大小與修改時間都相同時直接使用快取
+        :param cache_dir: 快取資料夾，若為 None 則使用 GEOMETRY_CACHE_DIR
+        :return: 每頁 page_geometry 的清單
+        """
+        cache_dir = cache_dir or GEOMETRY_CACHE_DIR
+        key, identity = geometry_cache_key(self.file_path)
+        cache_path = os.path.join(cache_dir, f'{key}.json')
+        try:
+            with open(cache_path, 'r') as file:
+                cache = json.load(file)
+            if all(cache.get(name) == value for name, value in identity.items()):
+                return cache['pages']
+        except (OSError, ValueError, KeyError, AttributeError):
+            # 沒有快取，或快取檔案不完整、損壞時重新建立
+            pass
+
+        index = [self.page_geometry(page) for page in range(self.total_pages)]
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先寫入暫存檔再取代，其他行程不會讀到寫到一半的快取
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(dict(identity, pages=index), file)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            # 無法寫入快取時只回傳結果
+            pass
+        return index
 
     def capture_region(self, rect, page_number=0, dpi=None):
         """
@@ -65,7 +146,9 @@ class PDFOperator:
             matrix = fitz.Matrix(1, 1)
 
         rect = fitz.Rect(*rect)
-        pix = page.get_pixmap(clip=rect, matrix=matrix)
+        with stage('render', 'pdf', page=page_number, dpi=dpi) as span:
+            pix = page.get_pixmap(clip=rect, matrix=matrix)
+            span.add(pixels=pix.width * pix.height)
         return pix
 
     def capture_full_page(self, page_number=0, dpi=None):
@@ -83,7 +166,9 @@ class PDFOperator:
         else:
             matrix = fitz.Matrix(1, 1)
 
-        pix = page.get_pixmap(matrix=matrix)
+        with stage('render', 'pdf', page=page_number, dpi=dpi) as span:
+            pix = page.get_pixmap(matrix=matrix)
+            span.add(pixels=pix.width * pix.height)
         return pix
 
     def save_page_as_image(self, page_number, file_name, dpi=None):
@@ -105,9 +190,14 @@ class PDFOperator:
         :param file_name: 儲存圖像的文件名
         :return:
         """
-        if isinstance(img, np.ndarray):
+        if not hasattr(img, 'save'):
+            # numpy 陣列才需要透過 PIL 儲存，numpy、PIL 只在此時載入以縮短 exe 啟動時間
+            import numpy as np
+            from PIL import Image
             img = Image.fromarray(np.uint8(img))
-        img.save(file_name)
+        with stage('encode', 'pdf', path=file_name) as span:
+            img.save(file_name)
+            span.file(file_name)
 
 
 def load_default_dpi():
@@ -126,6 +216,18 @@ def load_default_dpi():
     return default_dpi
 
 
+def page_file_name(output_dir, file_name_base, page_number, total_pages):
+    """
+    組合單頁輸出的檔名，格式為 {檔名}_pageNNN.png，頁碼位數依總頁數補零
+    :param output_dir: 儲存圖片的目錄
+    :param file_name_base: 檔名(不含副檔名)
+    :param page_number: 頁碼(從0開始)
+    :param total_pages: 總頁數
+    :return: 完整檔案路徑
+    """
+    return os.path.join(output_dir, f'{file_name_base}_page{str(page_number + 1).zfill(len(str(total_pages)))}.png')
+
+
 def save_all_pages_as_images(processor, output_dir, dpi):
     """
     將所有頁面的 PDF 內容儲存為 PNG 檔案
@@ -139,15 +241,86 @@ def save_all_pages_as_images(processor, output_dir, dpi):
     file_name_base = os.path.splitext(os.path.basename(processor.file_path))[0]
     total_pages = processor.total_pages
     for page in range(total_pages):
-        file_name = os.path.join(output_dir, f'{file_name_base}_page{str(page + 1).zfill(len(str(total_pages)))}.png')
+        file_name = page_file_name(output_dir, file_name_base, page, total_pages)
         processor.save_page_as_image(page, file_name, dpi=dpi)
         print(f'Page {page + 1} has been saved as {file_name}')
 
 
+def print_document_info(processor, dpi):
+    """
+    不渲染頁面，列出每頁的原始尺寸、旋轉角度、圖片數量以及指定DPI下的像素尺寸
+    :param processor: PDFOperator 實例
+    :param dpi: 指定圖像的解析度
+    :return: 頁面幾何索引
+    """
+    index = processor.geometry_index()
+    digits = len(str(processor.total_pages))
+    for geometry in index:
+        x0, y0, x1, y1 = geometry['rect']
+        width, height = rect_size_at_dpi(geometry['rect'], dpi)
+        print(f"Page {str(geometry['page'] + 1).zfill(digits)}: "
+              f"{x1 - x0:.2f} x {y1 - y0:.2f} pt, "
+              f"{(x1 - x0) / PDFOperator.STANDARD_DPI:.2f} x {(y1 - y0) / PDFOperator.STANDARD_DPI:.2f} in, "
+              f"{width} x {height} px @ {dpi} dpi, "
+              f"rotation {geometry['rotation']}, images {geometry['image_count']}")
+    return index
+
+
+# 每個子行程各自持有一個 PDFOperator，fitz 文件物件無法跨行程共用
+_worker_processor = None
+
+
+def _init_render_worker(file_path, password):
+    global _worker_processor
+    _worker_processor = PDFOperator(file_path, password)
+
+
+def _render_page_worker(page_number, file_name, dpi):
+    start = time.perf_counter()
+    _worker_processor.save_page_as_image(page_number, file_name, dpi=dpi)
+    return page_number, file_name, time.perf_counter() - start
+
+
+def save_all_pages_as_images_parallel(file_path, output_dir, dpi, workers=None, password=None, pages=None):
+    """
+    以多行程平行將 PDF 頁面儲存為 PNG 檔案，每個行程各自開啟一份 fitz 文件，輸出檔名與 save_all_pages_as_images 相同
+    :param file_path: PDF 檔案路徑
+    :param output_dir: 儲存圖片的目錄
+    :param dpi: 指定圖像的解析度
+    :param workers: 行程數量，若為 None 則使用 CPU 核心數
+    :param password: PDF 密碼
+    :param pages: 要轉換的頁碼清單(從0開始)，若為 None 則轉換所有頁面
+    :return: 依頁碼排序的 (頁碼, 檔名, 耗時秒數) 清單
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    processor = PDFOperator(file_path, password)
+    total_pages = processor.total_pages
+    processor.doc.close()
+    if pages is None:
+        pages = range(total_pages)
+    workers = workers or os.cpu_count() or 1
+
+    file_name_base = os.path.splitext(os.path.basename(file_path))[0]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                             initargs=(file_path, password)) as executor:
+        futures = [executor.submit(_render_page_worker, page,
+                                   page_file_name(output_dir, file_name_base, page, total_pages), dpi)
+                   for page in pages]
+        for future in as_completed(futures):
+            page, file_name, elapsed = future.result()
+            print(f'Page {page + 1} has been saved as {file_name} ({elapsed:.2f}s)')
+            results.append((page, file_name, elapsed))
+    results.sort()
+    return results
+
+
 def main():
     """
     PDF指定DPI抽取圖片工具，使用PDFOperator做轉換，可簡易包裝成exe
-    壓成EXE直接使用 pyinstaller -F ./folder/XXX.py 即可
+    壓成EXE直接在專案根目錄使用 pyinstaller -F --paths . ./pdf_tools/pdf_dpi_conversion_tools.py 即可
     :return:
     """
     default_dpi = load_default_dpi()
@@ -159,16 +332,35 @@ def main():
     parser.add_argument('--dpi', type=int, default=default_dpi, help='DPI for the image (default: 192).')
     parser.add_argument('--password', type=str, default=None, help='Password for the encrypted PDF file.')
     parser.add_argument('--all', action='store_true', help='Convert all pages of the PDF.')
+    parser.add_argument('--info', action='store_true',
+                        help='Print page sizes at the given DPI without rendering any page.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used with --all (default: 1, 0 for all CPU cores).')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Write per-stage timings to a Chrome trace (.json) or JSON lines (.jsonl) file.')
     args = parser.parse_args()
+    if args.trace:
+        enable_trace(args.trace)
 
     try:
         processor = PDFOperator(args.pdf_path, args.password)
         dpi = args.dpi
 
-        if args.all:
+        if args.info:
+            print_document_info(processor, dpi)
+
+        elif args.all:
             file_name_base = os.path.splitext(os.path.basename(processor.file_path))[0]
             output_dir = os.path.join(os.path.dirname(args.pdf_path), file_name_base)
-            save_all_pages_as_images(processor, output_dir, dpi)
+            if args.workers == 1:
+                save_all_pages_as_images(processor, output_dir, dpi)
+            else:
+                start = time.perf_counter()
+                results = save_all_pages_as_images_parallel(args.pdf_path, output_dir, dpi,
+                                                            workers=args.workers or None, password=args.password)
+                elapsed = time.perf_counter() - start
+                print(f'{len(results)} pages rendered in {elapsed:.2f}s '
+                      f'(render time per page: {sum(r[2] for r in results) / max(len(results), 1):.2f}s)')
             print(f'All pages have been saved in {output_dir}')
 
         else:
@@ -208,4 +400,6 @@ def main_test():
 
 
 if __name__ == '__main__':
+    # pyinstaller 打包後使用多行程需要 freeze_support
+    multiprocessing.freeze_support()
     main()
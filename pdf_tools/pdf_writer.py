@@ -0,0 +1,253 @@
+import io
+import os
+import shutil
+
+from PIL import Image
+
+from trace_tools.stage_trace import stage
+
+
+class PDFWriter:
+    """
+    逐頁寫入的 PDF 產生器，每加入一頁就直接寫入檔案並釋放該頁資料，記憶體用量不隨頁數增加
+    JPEG 直接以原始位元組嵌入(DCTDecode)，不解碼也不重新編碼；G4 tif 的每個 strip 直接嵌入為 CCITT G4 圖像，
+    其他二值頁面重新編碼為 CCITT G4 後嵌入
+    """
+    STANDARD_DPI = 72.0
+
+    def __init__(self, file_path, resolution=STANDARD_DPI, jpeg_quality=75):
+        """
+        :param file_path: 輸出 PDF 路徑
+        :param resolution: 頁面解析度，用於將像素換算成頁面尺寸，預設與 PIL 相同為 72
+        :param jpeg_quality: 需要重新編碼的彩色、灰階頁面所使用的 JPEG 品質
+        """
+        self.file_path = file_path
+        self.resolution = resolution
+        self.jpeg_quality = jpeg_quality
+        self._file = open(file_path, 'wb')
+        self._offsets = []
+        self._page_ids = []
+        self._file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        # 預留 1 號(Catalog)、2 號(Pages)物件，於 close 時寫入
+        self._catalog_id = self._reserve_object()
+        self._pages_id = self._reserve_object()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def _reserve_object(self):
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _begin_object(self, object_id=None):
+        if object_id is None:
+            object_id = self._reserve_object()
+        self._offsets[object_id - 1] = self._file.tell()
+        self._file.write(f'{object_id} 0 obj\n'.encode())
+        return object_id
+
+    def _write_object(self, body, object_id=None):
+        object_id = self._begin_object(object_id)
+        self._file.write(f'{body}\nendobj\n'.encode())
+        return object_id
+
+    def _write_stream(self, entries, data=None, source=None, length=None):
+        """
+        寫入 stream 物件，可傳入 bytes 或檔案物件(source)，檔案物件會分段複製而不整個載入記憶體
+        """
+        object_id = self._begin_object()
+        length = len(data) if data is not None else length
+        with stage('write', 'pdf', bytes=length):
+            self._file.write(f'<< {entries} /Length {length} >>\nstream\n'.encode())
+            if data is not None:
+                self._file.write(data)
+            else:
+                shutil.copyfileobj(source, self._file)
+            self._file.write(b'\nendstream\nendobj\n')
+        return object_id
+
+    def _add_page(self, image_id, width, height, dpi=None):
+        return self._add_strip_page([(image_id, height)], width, height, dpi=dpi)
+
+    def _add_strip_page(self, strips, width, height, dpi=None):
+        """
+        寫入由上到下依序堆疊多張圖像的頁面
+        :param strips: [(圖像物件編號, 列數)]，列數總和為頁面高度
+        """
+        scale = self.STANDARD_DPI / (dpi or self.resolution)
+        page_width, page_height = width * scale, height * scale
+        content, xobjects, top = [], [], 0
+        for i, (image_id, rows) in enumerate(strips):
+            # PDF 座標原點在左下角
+            bottom = (height - top - rows) * scale
+            content.append(f'q {page_width:.4f} 0 0 {rows * scale:.4f} 0 {bottom:.4f} cm /Im{i} Do Q')
+            xobjects.append(f'/Im{i} {image_id} 0 R')
+            top += rows
+        content_id = self._write_stream('', data='\n'.join(content).encode())
+        page_id = self._write_object(
+            f'<< /Type /Page /Parent {self._pages_id} 0 R /MediaBox [0 0 {page_width:.4f} {page_height:.4f}] '
+            f'/Resources << /XObject << {" ".join(xobjects)} >> >> /Contents {content_id} 0 R >>')
+        self._page_ids.append(page_id)
+        return page_id
+
+    def _image_entries(self, width, height, color_space, bits, image_filter, extra=''):
+        return (f'/Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                f'/ColorSpace /{color_space} /BitsPerComponent {bits} /Filter /{image_filter} {extra}').strip()
+
+    def add_jpeg(self, path):
+        """
+        將 JPEG 檔案原封不動嵌入為一頁(DCTDecode)
+        :param path: JPEG 檔案路徑
+        :return: 是否成功以直通方式嵌入，色彩模式不支援時回傳 False
+        """
+        with Image.open(path) as img:
+            width, height = img.size
+            mode = img.mode
+        color_spaces = {'L': 'DeviceGray', 'RGB': 'DeviceRGB', 'CMYK': 'DeviceCMYK'}
+        if mode not in color_spaces:
+            return False
+        # Adobe CMYK JPEG 以反相儲存，與 PIL 相同使用 Decode 反轉
+        extra = '/Decode [1 0 1 0 1 0 1 0]' if mode == 'CMYK' else ''
+        with open(path, 'rb') as source:
+            image_id = self._write_stream(
+                self._image_entries(width, height, color_spaces[mode], 8, 'DCTDecode', extra),
+                source=source, length=os.path.getsize(path))
+        self._add_page(image_id, width, height)
+        return True
+
+    def add_ccitt_g4(self, data, width, height, black_is_1=False, dpi=None):
+        """
+        將 CCITT G4 壓縮資料直接嵌入為一頁
+        :param data: G4 壓縮資料
+        :param width: 寬度(像素)
+        :param height: 高度(像素)
+        :param black_is_1: 資料中的 1 是否代表黑色，tif 的 PhotometricInterpretation 為 1 時為 True
+        :param dpi: 頁面解析度，若為 None 則使用 writer 的設定
+        """
+        return self.add_ccitt_g4_strips([(data, height)], width, black_is_1=black_is_1, dpi=dpi)
+
+    def add_ccitt_g4_strips(self, strips, width, black_is_1=False, dpi=None):
+        """
+        將多個各自獨立編碼的 CCITT G4 strip 嵌入為一頁，每個 strip 為一張圖像，由上到下堆疊
+        :param strips: [(G4 壓縮資料, 列數)]
+        :param width: 寬度(像素)
+        :param black_is_1: 資料中的 1 是否代表黑色，tif 的 PhotometricInterpretation 為 1 時為 True
+        :param dpi: 頁面解析度，若為 None 則使用 writer 的設定
+        """
+        placed = []
+        for data, rows in strips:
+            decode_parms = (f'/DecodeParms << /K -1 /Columns {width} /Rows {rows} '
+                            f'/BlackIs1 {str(black_is_1).lower()} >>')
+            image_id = self._write_stream(
+                self._image_entries(width, rows, 'DeviceGray', 1, 'CCITTFaxDecode', decode_parms), data=data)
+            placed.append((image_id, rows))
+        return self._add_strip_page(placed, width, sum(rows for _, rows in strips), dpi=dpi)
+
+    def add_image(self, img, dpi=None):
+        """
+        將已解碼的 PIL 圖像寫入為一頁，二值圖以 CCITT G4 儲存，其餘以 JPEG 儲存(與 PIL 預設行為相同)
+        :param img: PIL 圖像
+        :param dpi: 頁面解析度，若為 None 則使用 writer 的設定
+        """
+        width, height = img.size
+        if img.mode == '1':
+            # 以 libtiff 編碼為單一 strip 的 G4 tif，再取出 strip 資料嵌入
+            with stage('encode', 'pdf', compression='group4') as span:
+                buffer = io.BytesIO()
+                img.save(buffer, 'TIFF', compression='group4', tiffinfo={278: height})
+                span.image(img)
+                span.add(bytes=buffer.tell())
+            with Image.open(buffer) as encoded:
+                strips = self._g4_strips(encoded)
+                black_is_1 = encoded.tag_v2.get(262, 0) == 1
+            return self.add_ccitt_g4_strips(strips, width, black_is_1=black_is_1, dpi=dpi)
+
+        if img.mode != 'L':
+            with stage('convert', 'pdf', mode='RGB') as span:
+                img = img.convert('RGB')
+                span.image(img)
+        with stage('encode', 'pdf', compression='jpeg') as span:
+            buffer = io.BytesIO()
+            img.save(buffer, 'JPEG', quality=self.jpeg_quality)
+            span.image(img)
+            span.add(bytes=buffer.tell())
+        color_space = 'DeviceGray' if img.mode == 'L' else 'DeviceRGB'
+        image_id = self._write_stream(
+            self._image_entries(width, height, color_space, 8, 'DCTDecode'), data=buffer.getvalue())
+        return self._add_page(image_id, width, height, dpi=dpi)
+
+    @staticmethod
+    def _g4_strips(img):
+        """
+        讀取 G4 tif 頁面每個 strip 的壓縮資料，每個 strip 各自獨立編碼，可分別嵌入
+        :return: [(G4 壓縮資料, 列數)]，非標準 FillOrder 或非 strip 儲存的頁面回傳 None
+        """
+        tags = img.tag_v2
+        if img.info.get('compression') != 'group4' or tags.get(266, 1) != 1:
+            return None
+        offsets, byte_counts = tags.get(273), tags.get(279)
+        if not offsets or not byte_counts or len(offsets) != len(byte_counts):
+            return None
+        height = img.size[1]
+        rows_per_strip = min(tags.get(278, height), height)
+        strips = []
+        for i, (offset, byte_count) in enumerate(zip(offsets, byte_counts)):
+            img.fp.seek(offset)
+            strips.append((img.fp.read(byte_count), min(rows_per_strip, height - i * rows_per_strip)))
+        return strips
+
+    def _add_g4_frame(self, img):
+        # G4 頁面直接複製每個 strip 的壓縮資料，不解碼
+        strips = self._g4_strips(img)
+        if not strips:
+            return False
+        with stage('copy', 'pdf', compression='group4', strips=len(strips)):
+            self.add_ccitt_g4_strips(strips, img.size[0], black_is_1=img.tag_v2.get(262, 0) == 1)
+        return True
+
+    def add_file(self, path):
+        """
+        將圖片檔加入 PDF，多頁 tif 的每一頁都會加入
+        :param path: 圖片檔案路徑
+        :return: 此檔案加入的頁數
+        """
+        with Image.open(path) as img:
+            image_format = img.format
+        if image_format == 'JPEG' and self.add_jpeg(path):
+            return 1
+
+        pages = 0
+        with Image.open(path) as img:
+            for frame in range(getattr(img, 'n_frames', 1)):
+                img.seek(frame)
+                if image_format == 'TIFF' and self._add_g4_frame(img):
+                    pages += 1
+                    continue
+                with stage('decode', 'pdf', frame=frame) as span:
+                    img.load()
+                    span.image(img)
+                self.add_image(img)
+                pages += 1
+        return pages
+
+    def close(self):
+        if self._file.closed:
+            return
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self._page_ids)
+        self._write_object(f'<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>', self._pages_id)
+        self._write_object(f'<< /Type /Catalog /Pages {self._pages_id} 0 R >>', self._catalog_id)
+
+        xref_offset = self._file.tell()
+        self._file.write(f'xref\n0 {len(self._offsets) + 1}\n0000000000 65535 f \n'.encode())
+        for offset in self._offsets:
+            self._file.write(f'{offset:010d} 00000 n \n'.encode())
+        self._file.write(f'trailer\n<< /Size {len(self._offsets) + 1} /Root {self._catalog_id} 0 R >>\n'
+                         f'startxref\n{xref_offset}\n%%EOF\n'.encode())
+        self._file.close()
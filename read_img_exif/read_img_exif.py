@@ -1,4 +1,3 @@
-import numpy as np
 import tifftools
 import exifread
 from PIL import Image, TiffTags
@@ -26,6 +25,12 @@ class ReadExif:
             img_tags = exifread.process_file(f)
         return img_tags
 
+    @staticmethod
+    def header_tags(path, pages=(0,), tags=None):
+        # 以mmap讀取tif檔頭，只走訪到需要的頁面並只解碼指定的tag，多頁tif只讀少數頁面時遠快於上述方法
+        from read_img_exif.tiff_tags import read_tags
+        return read_tags(path, pages=pages, tags=tags)
+
 
 if __name__ == "__main__":
     _path = "./test.tif"
@@ -0,0 +1,241 @@
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+if __package__ in (None, ''):
+    # 在 read_img_exif 資料夾中直接執行時，將專案根目錄加入搜尋路徑以載入 tif_tools
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tif_tools.tiff_index import TIFF_SIGNATURES, _read_header, build_ifd_offsets, read_ifd_tags
+
+IMAGE_EXTENSIONS = ('.tif', '.tiff', '.jpg', '.jpeg', '.png')
+# 只將數量不多的標籤存入 tags 欄位，StripOffsets 等大型陣列不存
+MAX_STORED_COUNT = 16
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS pages (
+    path TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    dpi_x REAL,
+    dpi_y REAL,
+    compression INTEGER,
+    photometric INTEGER,
+    bits_per_sample INTEGER,
+    samples_per_pixel INTEGER,
+    tags TEXT,
+    PRIMARY KEY (path, page)
+);
+CREATE INDEX IF NOT EXISTS pages_dpi ON pages (dpi_x, dpi_y);
+CREATE INDEX IF NOT EXISTS pages_compression ON pages (compression, photometric);
+'''
+PAGE_COLUMNS = ('path', 'page', 'width', 'height', 'dpi_x', 'dpi_y', 'compression', 'photometric',
+                'bits_per_sample', 'samples_per_pixel', 'tags')
+
+
+def scan_files(root, extensions=IMAGE_EXTENSIONS):
+    """
+    以 os.scandir 走訪資料夾樹，scandir 回傳的項目已帶有檔案資訊，不需對每個檔案另外呼叫 os.stat
+    :param root: 根目錄
+    :param extensions: 要收錄的副檔名(小寫)
+    :return: 依序產生 (路徑, 檔案大小, 修改時間 ns)
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(extensions):
+                    stat = entry.stat()
+                    yield os.path.abspath(entry.path), stat.st_size, stat.st_mtime_ns
+
+
+def _resolution_to_dpi(tags, tag):
+    if tag not in tags:
+        return None
+    values = tags[tag][1]
+    value = values[0] / values[1] if len(values) > 1 and values[1] else float(values[0])
+    # ResolutionUnit 3 為公分
+    return value * 2.54 if tags.get(296, (3, [2]))[1][0] == 3 else value
+
+
+def _first(tags, tag):
+    return tags[tag][1][0] if tag in tags and tags[tag][1] else None
+
+
+def _tiff_pages(path):
+    pages = []
+    with open(path, 'rb') as fp:
+        byte_order, bigtiff, _ = _read_header(fp)
+        for page, offset in enumerate(build_ifd_offsets(path)):
+            tags = read_ifd_tags(fp, offset, byte_order, bigtiff)
+            stored = {tag: values for tag, (datatype, values) in tags.items()
+                      if len(values) <= MAX_STORED_COUNT and datatype != 2}
+            pages.append((page, _first(tags, 256), _first(tags, 257), _resolution_to_dpi(tags, 282),
+                          _resolution_to_dpi(tags, 283), _first(tags, 259), _first(tags, 262), _first(tags, 258),
+                          _first(tags, 277), json.dumps(stored)))
+    return pages
+
+
+def _image_pages(path):
+    # 非 tif 格式只讀取檔頭資訊，PIL 開啟時不會解碼像素
+    from PIL import Image
+
+    with Image.open(path) as img:
+        dpi = img.info.get('dpi') or (None, None)
+        bands = len(img.getbands())
+        return [(0, img.width, img.height, dpi[0] and float(dpi[0]), dpi[1] and float(dpi[1]), None, None,
+                 1 if img.mode == '1' else 8, bands, json.dumps({}))]
+
+
+def extract_tags(path):
+    """
+    讀取一個檔案每一頁的標籤，tif 只解析 IFD，不載入影像資料
+    :param path: 圖片路徑
+    :return: (每頁的欄位 tuple 清單, 錯誤訊息)
+    """
+    try:
+        with open(path, 'rb') as fp:
+            signature = fp.read(4)
+        if signature in TIFF_SIGNATURES:
+            return _tiff_pages(path), None
+        return _image_pages(path), None
+    except Exception as e:
+        return [], f'{type(e).__name__}: {e}'
+
+
+class TagIndex:
+    """
+    以 SQLite 儲存資料夾樹中所有圖片每一頁的標籤索引，以路徑、檔案大小、修改時間判斷是否需要重新讀取
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: SQLite 資料庫路徑
+        """
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, root, workers=None, extensions=IMAGE_EXTENSIONS, commit_every=1000):
+        """
+        更新索引：只重新讀取新增或大小、修改時間改變的檔案，並刪除已不存在的檔案
+        :param root: 根目錄
+        :param workers: 讀取標籤的行程數，若為 None 則使用 CPU 核心數，1 則不使用行程池
+        :param extensions: 要收錄的副檔名(小寫)
+        :param commit_every: 每處理多少個檔案提交一次，中斷後已提交的結果不需重新讀取
+        :return: {'scanned': 掃描的檔案數, 'updated': 重新讀取的檔案數, 'removed': 刪除的檔案數, 'errors': 讀取失敗的檔案數}
+        """
+        root = os.path.abspath(root)
+        prefix = os.path.join(root, '')
+        known = {row['path']: (row['size'], row['mtime_ns']) for row in self.connection.execute(
+            "SELECT path, size, mtime_ns FROM files WHERE path LIKE ? ESCAPE '\\'", (_like_prefix(prefix),))}
+
+        changed, seen = [], set()
+        for path, size, mtime_ns in scan_files(root, extensions):
+            seen.add(path)
+            if known.get(path) != (size, mtime_ns):
+                changed.append((path, size, mtime_ns))
+        removed = [path for path in known if path not in seen]
+
+        stats = {'scanned': len(seen), 'updated': len(changed), 'removed': len(removed), 'errors': 0}
+        with self.connection:
+            self._delete(removed)
+        paths = [path for path, _, _ in changed]
+        if workers == 1:
+            results = map(extract_tags, paths)
+            executor = None
+        else:
+            workers = workers or os.cpu_count() or 1
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(extract_tags, paths, chunksize=max(1, min(256, len(paths) // (workers * 4))))
+        try:
+            for i, ((path, size, mtime_ns), (pages, error)) in enumerate(zip(changed, results), 1):
+                stats['errors'] += bool(error)
+                self._delete([path])
+                self.connection.execute('INSERT INTO files VALUES (?, ?, ?, ?)', (path, size, mtime_ns, error))
+                self.connection.executemany(f'INSERT INTO pages VALUES ({", ".join("?" * len(PAGE_COLUMNS))})',
+                                            [(path,) + page for page in pages])
+                if i % commit_every == 0:
+                    self.connection.commit()
+            self.connection.commit()
+        finally:
+            if executor:
+                executor.shutdown()
+        return stats
+
+    def _delete(self, paths):
+        self.connection.executemany('DELETE FROM pages WHERE path = ?', ((path,) for path in paths))
+        self.connection.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in paths))
+
+    def query(self, where='1', params=()):
+        """
+        以 SQL 條件查詢頁面，可使用的欄位見 PAGE_COLUMNS
+        :param where: WHERE 條件，例如 'dpi_x < ? AND compression = ?'
+        :param params: 條件中的參數
+        :return: 每頁一個 dict 的清單，tags 欄位已轉為 {tag: values}
+        """
+        rows = self.connection.execute(f'SELECT * FROM pages WHERE {where} ORDER BY path, page', params)
+        return [dict(row, tags={int(tag): values for tag, values in json.loads(row['tags'] or '{}').items()})
+                for row in rows]
+
+    def find(self, dpi_below=None, compression=None, photometric=None, path_prefix=None):
+        """
+        常用條件的查詢，例如 find(dpi_below=300) 取得所有 DPI 小於 300 的頁面
+        :param dpi_below: 水平或垂直 DPI 小於此值
+        :param compression: 壓縮方法代號，例如 4 為 CCITT G4、5 為 LZW
+        :param photometric: PhotometricInterpretation 代號
+        :param path_prefix: 只查詢此資料夾下的檔案
+        :return: 每頁一個 dict 的清單
+        """
+        conditions, params = [], []
+        if dpi_below is not None:
+            conditions.append('(dpi_x < ? OR dpi_y < ?)')
+            params += [dpi_below, dpi_below]
+        if compression is not None:
+            conditions.append('compression = ?')
+            params.append(compression)
+        if photometric is not None:
+            conditions.append('photometric = ?')
+            params.append(photometric)
+        if path_prefix is not None:
+            conditions.append("path LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(os.path.join(os.path.abspath(path_prefix), '')))
+        return self.query(' AND '.join(conditions) or '1', params)
+
+    def errors(self):
+        """
+        :return: 讀取失敗的 (路徑, 錯誤訊息) 清單
+        """
+        return [(row['path'], row['error']) for row in
+                self.connection.execute('SELECT path, error FROM files WHERE error IS NOT NULL ORDER BY path')]
+
+
+def _like_prefix(prefix):
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+if __name__ == '__main__':
+    with TagIndex('tags.sqlite') as index:
+        print(index.update(sys.argv[1] if len(sys.argv) > 1 else '.'))
+        for row in index.find(dpi_below=300):
+            print(row['path'], row['page'], row['dpi_x'], row['dpi_y'])
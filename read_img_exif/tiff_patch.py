@@ -0,0 +1,292 @@
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+
+import numpy as np
+
+from read_img_exif.tiff_tags import RATIONAL_TYPES, TIFF_DTYPES, TiffHeader
+
+CLASSIC_TIFF_LIMIT = 2 ** 32 - 1
+
+
+def encode_value(datatype, values, byte_order='<'):
+    """
+    將標籤的值編碼為 tif 中的位元組
+    :param datatype: tif 資料型態
+    :param values: 值，可為單一數值、清單或字串；RATIONAL 可傳入 (分子, 分母) 或數值
+    :param byte_order: '<' 或 '>'
+    :return: (count, 位元組)
+    """
+    if datatype == 2:
+        raw = values if isinstance(values, bytes) else str(values).encode('latin-1')
+        raw = raw if raw.endswith(b'\x00') else raw + b'\x00'
+        return len(raw), raw
+    if isinstance(values, (int, float, np.number)) or (datatype in RATIONAL_TYPES and isinstance(values, tuple)):
+        values = [values]
+    if datatype in RATIONAL_TYPES:
+        pairs = []
+        for value in values:
+            if isinstance(value, (tuple, list)):
+                pairs.append(tuple(value))
+            else:
+                fraction = Fraction(value).limit_denominator(2 ** 31 - 1)
+                pairs.append((fraction.numerator, fraction.denominator))
+        values = [item for pair in pairs for item in pair]
+        count = len(pairs)
+    else:
+        count = len(values)
+    return count, np.asarray(values).astype(byte_order + TIFF_DTYPES[datatype]).tobytes()
+
+
+def _parse_change(change, existing_type=None):
+    """
+    解析修改內容，可直接給值(沿用原本的資料型態)，或與 tifftools 相同給 {'datatype': 型態, 'data': 值}
+    """
+    if isinstance(change, dict):
+        return change['datatype'], change['data']
+    if existing_type is None:
+        raise ValueError('新增的標籤需以 {"datatype": 型態, "data": 值} 指定資料型態。')
+    return existing_type, change
+
+
+class _Plan:
+    """
+    記錄修改檔案所需的寫入動作：原有範圍內的覆寫，以及依序附加到檔案末端的資料
+    """
+
+    def __init__(self, file_size):
+        self.file_size = file_size
+        self.end = file_size
+        self.writes = []
+        self.appends = []
+        self.report = []
+        # 重新寫到檔案末端的 IFD：{頁碼: (新的 IFD 位置, 下一個 IFD 指標的位置)}
+        self.relocated = {}
+
+    def append(self, data):
+        # tif 規範要求資料位置為偶數
+        self.end += self.end % 2
+        position = self.end
+        self.appends.append((position, data))
+        self.end += len(data)
+        return position
+
+
+def _plan_page(header, plan, page, changes):
+    byte_order = header.byte_order
+    pointer_format = f'{byte_order}{"Q" if header.bigtiff else "L"}'
+    count_size = 8 if header.bigtiff else 2
+    offset, entries = header.entries(page)
+    entry_size = entries.dtype.itemsize
+    value_size = entries.dtype['value'].itemsize
+    entry_format = f'{byte_order}HH{"Q" if header.bigtiff else "L"}'
+
+    existing = {int(entry['tag']): i for i, entry in enumerate(entries)}
+    current = header.tags(page, changes.keys())
+    new_entries = {int(entry['tag']): entry.tobytes() for entry in entries}
+    added = []
+    for tag, change in changes.items():
+        datatype, values = _parse_change(change, int(entries[existing[tag]]['type']) if tag in existing else None)
+        count, raw = encode_value(datatype, values, byte_order)
+        old = current.get(tag)
+        old = old.tolist() if isinstance(old, np.ndarray) else old
+
+        if len(raw) <= value_size:
+            action, value_field = 'inline', raw.ljust(value_size, b'\x00')
+        else:
+            old_size = 0
+            if tag in existing:
+                entry = entries[existing[tag]]
+                old_datatype = int(entry['type'])
+                items = int(entry['count']) * (2 if old_datatype in RATIONAL_TYPES else 1)
+                old_size = np.dtype(TIFF_DTYPES.get(old_datatype, 'u1')).itemsize * items
+            if value_size < old_size and len(raw) <= old_size:
+                # 新的值放得進原本的資料區，直接覆寫
+                position, = struct.unpack(pointer_format, entries[existing[tag]]['value'].tobytes())
+                action = 'in-place'
+                plan.writes.append((position, raw))
+            else:
+                action = 'append'
+                position = plan.append(raw)
+            value_field = struct.pack(pointer_format, position)
+
+        new_entries[tag] = struct.pack(entry_format, tag, datatype, count) + value_field
+        if tag not in existing:
+            added.append(tag)
+        plan.report.append({'page': page, 'tag': tag, 'old': old, 'new': values,
+                            'action': 'add-entry' if tag not in existing else action})
+
+    if not added:
+        for tag, i in existing.items():
+            if new_entries[tag] != entries[i].tobytes():
+                plan.writes.append((offset + count_size + i * entry_size, new_entries[tag]))
+        return
+
+    # 新增標籤需要更多項目空間，將整個 IFD 重新寫到檔案末端，原本的 IFD 不再使用
+    # 下一個 IFD 指標先保留為 0，所有頁面規劃完成後由 _link_relocated 依新的位置串接
+    pointer_size = struct.calcsize(pointer_format)
+    ifd = (struct.pack(f'{byte_order}{"Q" if header.bigtiff else "H"}', len(new_entries))
+           + b''.join(new_entries[tag] for tag in sorted(new_entries)) + bytes(pointer_size))
+    new_offset = plan.append(ifd)
+    plan.relocated[page] = (new_offset, new_offset + len(ifd) - pointer_size)
+
+
+def _next_field(header, page):
+    """
+    :return: 原本檔案中指定頁面 IFD 的下一個 IFD 指標位置
+    """
+    count_size = 8 if header.bigtiff else 2
+    offset, entries = header.entries(page)
+    return offset + count_size + entries.nbytes
+
+
+def _link_relocated(header, plan):
+    """
+    改寫指向重新寫入的 IFD 的指標，並設定重新寫入的 IFD 的下一個 IFD 指標
+    """
+    pointer_format = f'{header.byte_order}{"Q" if header.bigtiff else "L"}'
+    pointer_size = struct.calcsize(pointer_format)
+    for page, (new_offset, next_field) in plan.relocated.items():
+        # 下一頁也重新寫入時指向它的新位置，否則沿用原本的下一個 IFD 指標
+        if page + 1 in plan.relocated:
+            next_pointer = struct.pack(pointer_format, plan.relocated[page + 1][0])
+        else:
+            next_pointer = header.read(_next_field(header, page), pointer_size)
+        plan.writes.append((next_field, bytes(next_pointer)))
+        if page == 0:
+            plan.writes.append((8 if header.bigtiff else 4, struct.pack(pointer_format, new_offset)))
+        elif page - 1 not in plan.relocated:
+            plan.writes.append((_next_field(header, page - 1), struct.pack(pointer_format, new_offset)))
+
+
+def _check_chain(header, plan, last_page):
+    """
+    在寫入前以規劃的寫入內容模擬走訪 IFD 鏈，確認每一頁都指向預期的 IFD
+    """
+    pointer_format = f'{header.byte_order}{"Q" if header.bigtiff else "L"}'
+    count_format = f'{header.byte_order}{"Q" if header.bigtiff else "H"}'
+    entry_size = 20 if header.bigtiff else 12
+
+    def read(position, size):
+        data = None
+        for start, block in plan.appends:
+            if start <= position and position + size <= start + len(block):
+                data = bytearray(block[position - start:position - start + size])
+        if data is None:
+            data = bytearray(header.read(position, size))
+        for start, block in plan.writes:
+            low, high = max(start, position), min(start + len(block), position + size)
+            if low < high:
+                data[low - position:high - position] = block[low - start:high - start]
+        return bytes(data)
+
+    offset, = struct.unpack(pointer_format, read(8 if header.bigtiff else 4, struct.calcsize(pointer_format)))
+    for page in range(last_page + 1):
+        expected = plan.relocated[page][0] if page in plan.relocated else header.ifd_offset(page)
+        if offset != expected:
+            raise ValueError(f'{header.path} 修改後第 {page} 頁的 IFD 位置 {offset} 與預期的 {expected} 不符，未修改檔案。')
+        count, = struct.unpack(count_format, read(offset, struct.calcsize(count_format)))
+        next_position = offset + struct.calcsize(count_format) + entry_size * count
+        offset, = struct.unpack(pointer_format, read(next_position, struct.calcsize(pointer_format)))
+
+
+def plan_patch(path, changes, pages=(0,)):
+    """
+    計算修改標籤所需的寫入動作，不修改檔案
+    :param path: tif 檔案路徑
+    :param changes: {tag: 值}，沿用原本的資料型態；新增標籤或變更型態時使用 {tag: {'datatype': 型態, 'data': 值}}
+    :param pages: 要修改的頁碼清單(從0開始)
+    :return: _Plan
+    """
+    # 依頁碼順序規劃，重複的頁碼只處理一次
+    pages = sorted(set(pages))
+    plan = _Plan(os.path.getsize(path))
+    header = TiffHeader(path)
+    try:
+        for page in pages:
+            _plan_page(header, plan, page, changes)
+        _link_relocated(header, plan)
+        if pages:
+            _check_chain(header, plan, pages[-1])
+    finally:
+        header.close()
+    if not header.bigtiff and plan.end > CLASSIC_TIFF_LIMIT:
+        raise ValueError('修改後的 tif 檔案超過 4GB，classic tif 無法儲存。')
+    return plan
+
+
+def _verify(path, changes, pages):
+    header = TiffHeader(path)
+    try:
+        for page in pages:
+            offset, entries = header.entries(page)
+            types = {int(entry['tag']): int(entry['type']) for entry in entries}
+            values = header.tags(page, changes.keys())
+            for tag, change in changes.items():
+                expected = _parse_change(change, types.get(tag))[1]
+                actual = values.get(tag)
+                if actual is None or (encode_value(types[tag], actual, header.byte_order)
+                                      != encode_value(types[tag], expected, header.byte_order)):
+                    raise ValueError(f'{path} 第 {page} 頁的 tag {tag} 驗證失敗: {actual}')
+    finally:
+        header.close()
+
+
+def patch_tags(path, changes, pages=(0,), dry_run=False, verify=True):
+    """
+    直接在檔案中修改 tif 標籤，不重新編碼影像也不改寫整個檔案
+    值的大小不超過原本的空間時以 mmap 就地覆寫，超過時才將新資料附加到檔案末端，影像資料不會被移動
+    :param path: tif 檔案路徑
+    :param changes: {tag: 值}，例如 {262: 1, 282: 300, 283: 300}；新增標籤時使用 {tag: {'datatype': 型態, 'data': 值}}
+    :param pages: 要修改的頁碼清單(從0開始)
+    :param dry_run: 只回傳預計的修改內容，不修改檔案
+    :param verify: 修改後重新讀取並驗證標籤的值
+    :return: 每個修改的 dict 清單，含 page、tag、old、new、action(inline、in-place、append、add-entry)
+    """
+    pages = sorted(set(pages))
+    plan = plan_patch(path, changes, pages)
+    if dry_run:
+        return plan.report
+
+    with open(path, 'r+b') as file:
+        if plan.appends:
+            file.seek(0, os.SEEK_END)
+            for position, data in plan.appends:
+                file.write(b'\x00' * (position - file.tell()))
+                file.write(data)
+            file.flush()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_WRITE) as mm:
+            for position, data in plan.writes:
+                mm[position:position + len(data)] = data
+            mm.flush()
+    if verify:
+        _verify(path, changes, pages)
+    return plan.report
+
+
+def _patch_task(task):
+    path, changes, pages, dry_run, verify = task
+    try:
+        return path, patch_tags(path, changes, pages, dry_run=dry_run, verify=verify), None
+    except Exception as e:
+        return path, [], f'{type(e).__name__}: {e}'
+
+
+def patch_files(paths, changes, pages=(0,), workers=None, dry_run=False, verify=True):
+    """
+    以多行程批次修改多個 tif 檔案的標籤
+    :param paths: tif 檔案路徑清單
+    :param changes: {tag: 值}
+    :param pages: 要修改的頁碼清單(從0開始)
+    :param workers: 行程數量，若為 None 則使用 CPU 核心數，1 則不使用行程池
+    :param dry_run: 只回傳預計的修改內容，不修改檔案
+    :param verify: 修改後重新讀取並驗證標籤的值
+    :return: 依輸入順序的 (路徑, 修改清單, 錯誤訊息) 清單
+    """
+    tasks = [(path, changes, pages, dry_run, verify) for path in paths]
+    if workers == 1:
+        return [_patch_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_patch_task, tasks, chunksize=max(1, len(tasks) // ((workers or 1) * 16))))
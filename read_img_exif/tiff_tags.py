@@ -0,0 +1,150 @@
+import mmap
+
+import numpy as np
+
+# tif 資料型態對應的 numpy 型態，RATIONAL 類型以兩個整數一組表示
+TIFF_DTYPES = {1: 'u1', 2: 'u1', 3: 'u2', 4: 'u4', 5: 'u4', 6: 'i1', 7: 'u1', 8: 'i2', 9: 'i4', 10: 'i4', 11: 'f4',
+               12: 'f8', 13: 'u4', 16: 'u8', 17: 'i8', 18: 'u8'}
+RATIONAL_TYPES = (5, 10)
+# 數量超過此值的標籤(例如 StripOffsets)以唯讀的 numpy 視圖回傳，不複製資料
+ARRAY_VIEW_MIN_COUNT = 16
+
+
+class TiffHeader:
+    """
+    以 mmap 讀取 tif 檔頭，IFD 鏈只在需要時才往後走訪，且只解碼指定頁面的指定標籤
+    大型標籤陣列直接指向 mmap 的記憶體，不會複製；這些陣列仍被使用時 mmap 不會被釋放
+    """
+
+    def __init__(self, path):
+        """
+        :param path: tif 檔案路徑
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = bytes(self._mm[:16])
+        if header[:2] not in (b'II', b'MM'):
+            raise ValueError(f'{path} 不是 tif 檔案。')
+        self.byte_order = '<' if header[:2] == b'II' else '>'
+        version = int.from_bytes(header[2:4], 'little' if self.byte_order == '<' else 'big')
+        self.bigtiff = version == 43
+        count_type, size_type, value_size = ('u8', 'u8', 8) if self.bigtiff else ('u2', 'u4', 4)
+        self._count_dtype = np.dtype(self.byte_order + count_type)
+        self._next_dtype = np.dtype(self.byte_order + size_type)
+        self._entry_dtype = np.dtype([('tag', self.byte_order + 'u2'), ('type', self.byte_order + 'u2'),
+                                      ('count', self.byte_order + size_type), ('value', f'V{value_size}')])
+        first = np.frombuffer(self._mm, self._next_dtype, 1, 8 if self.bigtiff else 4)[0]
+        self._offsets = [int(first)] if first else []
+        # 已走訪的 IFD 位置，用於偵測循環的 IFD 鏈
+        self._seen = set(self._offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        關閉 mmap，若仍有回傳的 numpy 視圖在使用中則保留，待視圖釋放後由垃圾回收關閉
+        """
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+
+    def _entries(self, offset):
+        count = int(np.frombuffer(self._mm, self._count_dtype, 1, offset)[0])
+        return np.frombuffer(self._mm, self._entry_dtype, count, offset + self._count_dtype.itemsize)
+
+    def ifd_offset(self, page):
+        """
+        取得指定頁面 IFD 的位置，只走訪到該頁為止
+        :param page: 頁碼(從0開始)
+        :return: IFD 的位置
+        """
+        while len(self._offsets) <= page:
+            if not self._offsets:
+                break
+            last = self._offsets[-1]
+            entries = self._entries(last)
+            next_position = last + self._count_dtype.itemsize + entries.nbytes
+            next_offset = int(np.frombuffer(self._mm, self._next_dtype, 1, next_position)[0])
+            if not next_offset or next_offset in self._seen:
+                break
+            self._offsets.append(next_offset)
+            self._seen.add(next_offset)
+        if page >= len(self._offsets):
+            raise IndexError(f'頁碼 {page} 超出範圍，檔案共 {len(self._offsets)} 頁。')
+        return self._offsets[page]
+
+    @property
+    def page_count(self):
+        """
+        走訪整個 IFD 鏈計算頁數
+        """
+        try:
+            self.ifd_offset(2 ** 62)
+        except IndexError:
+            pass
+        return len(self._offsets)
+
+    def read(self, position, size):
+        """
+        讀取檔案中指定位置的位元組
+        """
+        return self._mm[position:position + size]
+
+    def entries(self, page=0):
+        """
+        取得指定頁面 IFD 的原始標籤項目
+        :param page: 頁碼(從0開始)
+        :return: (IFD 的位置, 結構化 numpy 陣列，欄位為 tag、type、count、value)
+        """
+        offset = self.ifd_offset(page)
+        return offset, self._entries(offset)
+
+    def _value(self, entry, position):
+        datatype, count = int(entry['type']), int(entry['count'])
+        dtype = np.dtype(self.byte_order + TIFF_DTYPES.get(datatype, 'u1'))
+        items = count * 2 if datatype in RATIONAL_TYPES else count
+        if dtype.itemsize * items > self._entry_dtype['value'].itemsize:
+            position = int(np.frombuffer(entry['value'].tobytes(), self._next_dtype, 1)[0])
+        values = np.frombuffer(self._mm, dtype, items, position)
+        if datatype == 2:
+            return values.tobytes().rstrip(b'\x00').decode('latin-1')
+        if datatype in RATIONAL_TYPES:
+            values = values.reshape(count, 2)
+        if count > ARRAY_VIEW_MIN_COUNT:
+            return values
+        return values.tolist()
+
+    def tags(self, page=0, tags=None):
+        """
+        讀取指定頁面的標籤
+        :param page: 頁碼(從0開始)
+        :param tags: 要讀取的標籤代號，若為 None 則讀取全部
+        :return: {tag: value}，ASCII 為字串，數量不多的值為 list，大型陣列為唯讀的 numpy 視圖
+        """
+        offset = self.ifd_offset(page)
+        entries = self._entries(offset)
+        indices = range(len(entries)) if tags is None else np.flatnonzero(np.isin(entries['tag'], list(tags)))
+        value_start = offset + self._count_dtype.itemsize + self._entry_dtype.fields['value'][1]
+        return {int(entries[i]['tag']): self._value(entries[i], value_start + i * self._entry_dtype.itemsize)
+                for i in indices}
+
+
+def read_tags(path, pages=(0,), tags=None):
+    """
+    讀取 tif 指定頁面的指定標籤，只解析需要的 IFD，例如 read_tags(path, pages=[0], tags=[256, 257, 262, 282])
+    :param path: tif 檔案路徑
+    :param pages: 頁碼清單(從0開始)
+    :param tags: 要讀取的標籤代號，若為 None 則讀取全部
+    :return: {page: {tag: value}}
+    """
+    header = TiffHeader(path)
+    try:
+        return {page: header.tags(page, tags) for page in pages}
+    finally:
+        header.close()
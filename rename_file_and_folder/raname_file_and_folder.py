@@ -1,53 +1,71 @@
 import os
+import sys
 
+if __package__ in (None, ''):
+    # 在 rename_file_and_folder 資料夾中直接執行時，將專案根目錄加入搜尋路徑以載入 rename_engine
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rename_file_and_folder.rename_engine import apply_plan, compile_mapping, plan_rename
 
-def rename_files_by_string(target_folder, target, convert2):
+
+def _rename(target_folder, convert_name, files, folders, workers, journal_path, dry_run):
+    plan = plan_rename(target_folder, convert_name, files=files, folders=folders)
+    if dry_run:
+        return apply_plan(plan, dry_run=True)
+    for _, new_path, reason in plan.conflicts:
+        print(f"Error: {os.path.basename(new_path)} {reason}")
+    result = apply_plan(plan, journal_path=journal_path, workers=workers)
+    for path, error in result['errors']:
+        print(f"Error: {path} {error}")
+    print(f"{result['renamed']} renamed, {result['conflicts']} skipped.")
+    return result
+
+
+def rename_files_by_string(target_folder, target, convert2, workers=8, journal_path=None, dry_run=False):
     """
     依據目標字串(target)對指定資料夾(target_folder)內 所有檔案 進行重新命名。
+    先掃描建立完整的重新命名計畫(以集合檢查名稱衝突)，再以多執行緒套用
     :param target_folder:待操作的目標資料夾的路徑
     :param target:目標字串，該字串在檔名中將被替換
     :param convert2:用於替換目標子串的新字串
-    :return:
+    :param workers:套用時的執行緒數量
+    :param journal_path:日誌路徑，若指定則中斷後可用 rename_engine.resume 繼續，或用 rename_engine.undo 還原
+    :param dry_run:只回傳預覽報告，不修改任何檔案
+    :return:套用結果，dry_run 時為報告文字
     """
-    for root, _, files in os.walk(target_folder, topdown=False):
-        for file_name in files:
-            if target in file_name:
-                new_file_name = file_name.replace(target, convert2)
-                org_file_path = os.path.join(root, file_name)
-                new_file_path = os.path.join(root, new_file_name)
-
-                # 檢查新檔名是否已存在
-                if os.path.exists(new_file_path):
-                    print(f"Error: {new_file_name} already exists.")
-                    continue
-
-                os.rename(org_file_path, new_file_path)
-                print(f"{org_file_path} renamed to {new_file_path}")
+    return _rename(target_folder, lambda name: name.replace(target, convert2), True, False, workers, journal_path,
+                   dry_run)
 
 
-def rename_folder_by_string(target_folder, target, convert2):
+def rename_folder_by_string(target_folder, target, convert2, workers=8, journal_path=None, dry_run=False):
     """
     依據目標字串(target)對指定資料夾(target_folder)內的 所有子資料夾 進行重新命名
+    子資料夾由最深的一層開始改名，與原本 os.walk(topdown=False) 的順序相同
     :param target_folder:待操作的目標資料夾的路徑
     :param target:目標字串，該字串在資料夾名中將被替換
     :param convert2:用於替換目標字串的新字串
-    :return:
+    :param workers:套用時的執行緒數量
+    :param journal_path:日誌路徑，若指定則中斷後可用 rename_engine.resume 繼續，或用 rename_engine.undo 還原
+    :param dry_run:只回傳預覽報告，不修改任何檔案
+    :return:套用結果，dry_run 時為報告文字
     """
-    for root, dirs, _ in os.walk(target_folder, topdown=False):  # 取得路徑下所有檔案的根目錄與檔名
-        for dir_name in dirs:  # 循序讀取檔名清單
-            if target in dir_name:
-                new_img_name = dir_name.replace(target, convert2)
-
-                # 檢查新名稱是否存在
-                org_img_path = os.path.join(root, dir_name)  # 組合成完整路徑
-                new_img_path = os.path.join(root, new_img_name)
+    return _rename(target_folder, lambda name: name.replace(target, convert2), False, True, workers, journal_path,
+                   dry_run)
 
-                if os.path.exists(new_img_path):
-                    print(f"Error: {new_img_name} already exists.")
-                    continue
 
-                print(f"{dir_name} renamed to {new_img_name}")
-                os.rename(org_img_path, new_img_path)
+def rename_by_mapping(target_folder, mapping, files=True, folders=True, workers=8, journal_path=None, dry_run=False):
+    """
+    依對照表一次替換指定資料夾(target_folder)內所有檔案與子資料夾名稱中的多個字串，只走訪資料夾樹一次
+    多個目標字串重疊時，由左至右尋找，同一位置取最長的目標字串，替換後的文字不會再被替換
+    :param target_folder:待操作的目標資料夾的路徑
+    :param mapping:{目標字串: 新字串}，或每列為 目標字串,新字串 的 CSV 檔案路徑
+    :param files:是否重新命名檔案
+    :param folders:是否重新命名資料夾
+    :param workers:套用時的執行緒數量
+    :param journal_path:日誌路徑，若指定則中斷後可用 rename_engine.resume 繼續，或用 rename_engine.undo 還原
+    :param dry_run:只回傳預覽報告，不修改任何檔案
+    :return:套用結果，dry_run 時為報告文字
+    """
+    return _rename(target_folder, compile_mapping(mapping), files, folders, workers, journal_path, dry_run)
 
 
 def create_test_files(target_folder, prefix, suffix, file_count=5):
@@ -84,5 +102,8 @@ if __name__ == "__main__":
     rename_files_by_string(target_folder, target, convert)
     rename_files_by_string(target_folder, ".txt", ".log")
 
+    # 依對照表一次替換多個字串，只走訪一次
+    rename_by_mapping(target_folder, {convert: target, ".log": ".txt"}, folders=False)
+
     # 替換文件夾名稱
     rename_folder_by_string("./", "test", "測試")
@@ -0,0 +1,265 @@
+import csv
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+JOURNAL_HEADER = 'imgtools-rename-journal v1'
+
+
+class RenamePlan:
+    """
+    重新命名計畫：掃描階段只讀取資料夾內容，所有衝突都以集合比對，不對檔案系統逐一查詢
+    每個項目為 (深度, 原路徑, 新路徑)，套用時由最深的一層開始，資料夾會在其內容都改名後才改名
+    """
+
+    def __init__(self, operations, conflicts):
+        """
+        :param operations: [(深度, 原路徑, 新路徑), ...]
+        :param conflicts: [(原路徑, 新路徑, 原因), ...]
+        """
+        self.operations = sorted(operations, key=lambda operation: -operation[0])
+        self.conflicts = conflicts
+
+    def __len__(self):
+        return len(self.operations)
+
+    def report(self):
+        """
+        產生預覽報告，不修改任何檔案
+        :return: 報告文字
+        """
+        lines = [f'{len(self.operations)} renames, {len(self.conflicts)} conflicts']
+        lines += [f'{old} -> {os.path.basename(new)}' for _, old, new in self.operations]
+        lines += [f'Error: {os.path.basename(new)} {reason} ({old})' for old, new, reason in self.conflicts]
+        return '\n'.join(lines)
+
+
+def plan_rename(target_folder, convert_name, files=True, folders=True):
+    """
+    掃描資料夾樹並建立重新命名計畫，不修改任何檔案
+    :param target_folder: 待操作的目標資料夾的路徑，目標資料夾本身不會被改名
+    :param convert_name: 傳入名稱並回傳新名稱的函式，回傳相同名稱表示不改名
+    :param files: 是否重新命名檔案
+    :param folders: 是否重新命名資料夾
+    :return: RenamePlan
+    """
+    operations, conflicts = [], []
+    stack = [(os.path.abspath(target_folder), 1)]
+    while stack:
+        folder, depth = stack.pop()
+        with os.scandir(folder) as iterator:
+            entries = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in iterator]
+
+        names = {name for name, _ in entries}
+        claimed = set()
+        for name, is_dir in entries:
+            if is_dir:
+                stack.append((os.path.join(folder, name), depth + 1))
+            if not (folders if is_dir else files):
+                continue
+            new_name = convert_name(name)
+            if new_name == name:
+                continue
+            old_path, new_path = os.path.join(folder, name), os.path.join(folder, new_name)
+            # 與原本的逐一 os.path.exists 檢查相同，目標名稱已存在或已被同資料夾的其他項目使用時略過
+            if not new_name or os.sep in new_name or (os.altsep and os.altsep in new_name):
+                conflicts.append((old_path, new_path, 'is not a valid name.'))
+            elif new_name in names or new_name in claimed:
+                conflicts.append((old_path, new_path, 'already exists.'))
+            else:
+                claimed.add(new_name)
+                operations.append((depth, old_path, new_path))
+    return RenamePlan(operations, conflicts)
+
+
+def load_mapping(csv_path):
+    """
+    讀取對照表 CSV，每列兩欄為 (目標字串, 新字串)，空白列略過，第一列若為 target,convert2 則視為標題
+    :param csv_path: CSV 檔案路徑，可為 Excel 輸出的 UTF-8 BOM 編碼
+    :return: 依檔案順序的 {目標字串: 新字串}
+    """
+    mapping = {}
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as file:
+        for line_number, row in enumerate(csv.reader(file), 1):
+            if not row or not any(row):
+                continue
+            if line_number == 1 and [cell.strip() for cell in row[:2]] == ['target', 'convert2']:
+                continue
+            if len(row) < 2:
+                raise ValueError(f'{csv_path} 第 {line_number} 列需要兩欄。')
+            if row[0] in mapping and mapping[row[0]] != row[1]:
+                raise ValueError(f'{csv_path} 第 {line_number} 列的 {row[0]} 重複且對應不同的新字串。')
+            mapping[row[0]] = row[1]
+    return mapping
+
+
+def compile_mapping(mapping):
+    """
+    將對照表編譯成一個正規表示式，一次完成所有替換
+    規則固定：由左至右尋找，同一位置有多個目標字串符合時取最長者，替換後的文字不會再被替換
+    :param mapping: {目標字串: 新字串} 或對照表 CSV 路徑
+    :return: 傳入名稱並回傳新名稱的函式，可直接傳給 plan_rename
+    """
+    if isinstance(mapping, (str, os.PathLike)):
+        mapping = load_mapping(mapping)
+    mapping = dict(mapping)
+    if not mapping:
+        return lambda name: name
+    if '' in mapping:
+        raise ValueError('目標字串不可為空字串。')
+    # Python 的 | 會選擇第一個符合的選項，依長度由長到短排列即為最長者優先，長度相同時依字串排序使結果固定
+    targets = sorted(mapping, key=lambda target: (-len(target), target))
+    pattern = re.compile('|'.join(map(re.escape, targets)))
+    return lambda name: pattern.sub(lambda match: mapping[match.group()], name)
+
+
+class _Journal:
+    """
+    以 JSON lines 記錄的重新命名日誌：先寫入完整計畫，之後每完成一項附加一行 ["D", 索引]，還原則附加 ["U", 索引]
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def write_plan(self, plan):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(JOURNAL_HEADER) + '\n')
+            for index, (depth, old, new) in enumerate(plan.operations):
+                # 新路徑與原路徑在同一個資料夾，只記錄新名稱
+                file.write(json.dumps(['P', index, depth, old, os.path.basename(new)], ensure_ascii=False) + '\n')
+
+    def load(self):
+        """
+        :return: (計畫項目清單 [(深度, 原路徑, 新路徑)], 已完成的索引集合)
+        """
+        operations, done = [], set()
+        with open(self.path, 'r', encoding='utf-8') as file:
+            if json.loads(file.readline()) != JOURNAL_HEADER:
+                raise ValueError(f'{self.path} 不是重新命名日誌。')
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中斷時寫了一半的行
+                    continue
+                if record[0] == 'P':
+                    _, _, depth, old, new_name = record
+                    operations.append((depth, old, os.path.join(os.path.dirname(old), new_name)))
+                elif record[0] == 'D':
+                    done.add(record[1])
+                elif record[0] == 'U':
+                    done.discard(record[1])
+        return operations, done
+
+    def mark(self, kind, index):
+        if self._file is None:
+            with open(self.path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                complete = file.read(1) == b'\n'
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if not complete:
+                # 結束上次中斷時寫了一半的行
+                self._file.write('\n')
+        self._file.write(f'["{kind}", {index}]\n')
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def _rename(task):
+    index, source, destination = task
+    try:
+        os.rename(source, destination)
+        return index, None
+    except OSError as e:
+        # 中斷後重新執行時，已改名但尚未記錄的項目視為完成
+        if not os.path.lexists(source) and os.path.lexists(destination):
+            return index, None
+        return index, f'{type(e).__name__}: {e}'
+
+
+def _run_levels(tasks, journal, kind, workers, ascending=False):
+    """
+    依深度分層執行，同一層的項目互不影響，以執行緒池平行處理；每層結束後寫入日誌
+    """
+    errors = []
+    tasks = sorted(tasks, key=lambda task: task[0] if ascending else -task[0])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _, level in groupby(tasks, key=lambda task: task[0]):
+            for index, error in executor.map(_rename, [task[1:] for task in level]):
+                if error:
+                    errors.append((index, error))
+                elif journal:
+                    journal.mark(kind, index)
+            if journal:
+                journal.flush()
+    return errors
+
+
+def apply_plan(plan, journal_path=None, workers=8, dry_run=False):
+    """
+    套用重新命名計畫
+    :param plan: plan_rename 建立的 RenamePlan
+    :param journal_path: 日誌路徑，若指定則可在中斷後以 resume 繼續，或以 undo 還原
+    :param workers: 執行緒數量，網路磁碟上平行呼叫 os.rename 可大幅縮短等待時間
+    :param dry_run: 只回傳預覽報告，不修改任何檔案
+    :return: {'renamed': 成功數, 'conflicts': 衝突數, 'errors': [(原路徑, 錯誤訊息)]}，dry_run 時回傳報告文字
+    """
+    if dry_run:
+        return plan.report()
+    journal = None
+    if journal_path:
+        journal = _Journal(journal_path)
+        journal.write_plan(plan)
+    tasks = [(depth, index, old, new) for index, (depth, old, new) in enumerate(plan.operations)]
+    try:
+        errors = _run_levels(tasks, journal, 'D', workers)
+    finally:
+        if journal:
+            journal.close()
+    return {'renamed': len(tasks) - len(errors), 'conflicts': len(plan.conflicts),
+            'errors': [(plan.operations[index][1], error) for index, error in errors]}
+
+
+def resume(journal_path, workers=8):
+    """
+    依日誌繼續執行中斷的重新命名
+    :param journal_path: 日誌路徑
+    :param workers: 執行緒數量
+    :return: {'renamed': 本次成功數, 'errors': [(原路徑, 錯誤訊息)]}
+    """
+    journal = _Journal(journal_path)
+    operations, done = journal.load()
+    tasks = [(depth, index, old, new) for index, (depth, old, new) in enumerate(operations) if index not in done]
+    try:
+        errors = _run_levels(tasks, journal, 'D', workers)
+    finally:
+        journal.close()
+    return {'renamed': len(tasks) - len(errors), 'errors': [(operations[index][1], error) for index, error in errors]}
+
+
+def undo(journal_path, workers=8):
+    """
+    依日誌還原已完成的重新命名，由最淺的一層開始，使資料夾先恢復原名
+    :param journal_path: 日誌路徑
+    :param workers: 執行緒數量
+    :return: {'restored': 還原數, 'errors': [(新路徑, 錯誤訊息)]}
+    """
+    journal = _Journal(journal_path)
+    operations, done = journal.load()
+    tasks = [(operations[index][0], index, operations[index][2], operations[index][1]) for index in sorted(done)]
+    try:
+        errors = _run_levels(tasks, journal, 'U', workers, ascending=True)
+    finally:
+        journal.close()
+    return {'restored': len(tasks) - len(errors), 'errors': [(operations[index][2], error) for index, error in errors]}
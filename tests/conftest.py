@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 與各工具相同以專案根目錄為匯入起點
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from watermark import add_watermark
+from watermark.add_watermark import AddWatermark
+
+
+@pytest.fixture(autouse=True)
+def default_font(monkeypatch):
+    # 測試環境不一定有 msjhbd.ttc，改用 Pillow 內建字體
+    monkeypatch.setattr(add_watermark, 'load_font', lambda font_path, font_size: ImageFont.load_default(font_size))
+
+
+@pytest.mark.parametrize('watermark_text', ['', '   '])
+def test_apply_bilevel_empty_text_returns_page(watermark_text):
+    page = Image.new('1', (64, 48), 1)
+    original = page.tobytes()
+    result = AddWatermark.apply_bilevel(page, watermark_text)
+    assert result is page
+    assert result.mode == '1'
+    assert result.tobytes() == original
+
+
+@pytest.mark.parametrize('watermark_text', ['', '   '])
+def test_apply_empty_text_keeps_image(watermark_text):
+    image = Image.new('RGB', (64, 48), 'white')
+    original = image.tobytes()
+    assert AddWatermark.apply(image, watermark_text).convert('RGB').tobytes() == original
+
+
+def test_apply_bilevel_draws_text():
+    page = Image.new('1', (200, 120), 1)
+    original = page.tobytes()
+    result = AddWatermark.apply_bilevel(page, 'TEST', font_size=40)
+    assert result.mode == '1'
+    assert result.tobytes() != original
+
+
+def _full_layer_watermark(image, watermark_text, font_size, rotation=45):
+    # 舊版的做法：整張圖大小的圖層繪字、旋轉後整張貼上，作為裁切圖層合成結果的對照
+    font = ImageFont.load_default(font_size)
+    base_image = image.convert("RGBA")
+    left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), watermark_text, font=font)
+    position = (int((base_image.width - (right - left)) / 2), int((base_image.height - (bottom - top)) / 2))
+    txt_layer = Image.new("RGBA", base_image.size, (255, 255, 255, 0))
+    ImageDraw.Draw(txt_layer).text(position, watermark_text, font=font, fill=(0, 0, 0, 100))
+    txt_layer = txt_layer.rotate(rotation, resample=Image.BICUBIC, expand=1)
+    offset = ((txt_layer.width - base_image.width) // 2, (txt_layer.height - base_image.height) // 2)
+    base_image.paste(txt_layer, (-offset[0], -offset[1]), txt_layer)
+    return base_image
+
+
+def _gradient(size):
+    return Image.linear_gradient('L').resize(size).convert('RGB')
+
+
+@pytest.mark.parametrize('size, rotation', [((300, 200), None), ((180, 260), 30), ((256, 256), 90)])
+def test_apply_matches_full_layer_composite(size, rotation):
+    image = _gradient(size)
+    font_size = int(min(size) * 0.2)
+    expected = _full_layer_watermark(image, 'TEST', font_size, rotation or 45)
+    assert AddWatermark.apply(image, 'TEST', rotation=rotation).tobytes() == expected.tobytes()
+
+
+def test_layer_is_cached_per_canvas_size():
+    add_watermark.watermark_layer.cache_clear()
+    for _ in range(3):
+        AddWatermark.apply(_gradient((200, 150)), 'CACHE')
+    AddWatermark.apply(_gradient((150, 200)), 'CACHE')
+    info = add_watermark.watermark_layer.cache_info()
+    assert (info.hits, info.misses) == (2, 2)
+
+
+def test_batch_matches_sequential(tmp_path):
+    folder = tmp_path / 'input'
+    folder.mkdir()
+    for i, size in enumerate([(200, 150), (200, 150), (160, 220), (200, 150)]):
+        _gradient(size).save(folder / f'page{i}.png')
+
+    sequential = AddWatermark.batch(str(folder), str(tmp_path / 'sequential'), 'BATCH', workers=1)
+    parallel = AddWatermark.batch(str(folder), str(tmp_path / 'parallel'), 'BATCH', workers=2)
+
+    names = ['page0.png', 'page1.png', 'page2.png', 'page3.png']
+    assert [os.path.basename(path) for path in sequential] == names
+    assert [os.path.basename(path) for path in parallel] == names
+    for expected_path, path in zip(sequential, parallel):
+        with Image.open(expected_path) as expected, Image.open(path) as actual:
+            assert actual.size == expected.size
+            assert actual.tobytes() == expected.tobytes()
+        with Image.open(folder / os.path.basename(path)) as original, Image.open(path) as actual:
+            assert actual.convert('RGB').tobytes() != original.tobytes()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from crop_text.crop_text import extract_glyphs, iter_glyphs_tiled
+from tif_tools.tiff_index import BandReader
+
+
+def _page(size=(160, 400), mode='L'):
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0]), dtype=np.uint8), 'L').convert(mode)
+
+
+def _glyph_page(size=(240, 600)):
+    img = np.full((size[1], size[0]), 255, np.uint8)
+    for i, y in enumerate(range(10, size[1] - 40, 50)):
+        x = 20 + (i * 37) % (size[0] - 60)
+        img[y:y + 30, x:x + 8] = 0
+        img[y + 11:y + 19, x:x + 30] = 40
+    return Image.fromarray(img, 'L')
+
+
+@pytest.fixture
+def decoded_heights(monkeypatch):
+    heights = []
+    read_blocks = BandReader._read_blocks
+
+    def spy(self, first, last):
+        img = read_blocks(self, first, last)
+        heights.append(img.height)
+        return img
+
+    monkeypatch.setattr(BandReader, '_read_blocks', spy)
+    return heights
+
+
+@pytest.mark.parametrize('compression', ['raw', 'tiff_lzw', 'tiff_adobe_deflate', 'group4'])
+def test_multi_strip_bands_are_smaller_than_image(tmp_path, decoded_heights, compression):
+    img = _page(mode='1' if compression == 'group4' else 'L')
+    path = str(tmp_path / 'strips.tif')
+    img.save(path, compression=compression, tiffinfo={278: 16})
+    with BandReader(path) as reader:
+        band = reader.read_rows(100, 150)
+    assert np.array_equal(np.asarray(band), np.asarray(img)[100:150])
+    assert decoded_heights and max(decoded_heights) < img.height
+
+
+@pytest.mark.parametrize('compression', ['raw', 'tiff_adobe_deflate'])
+def test_single_strip_is_read_progressively(tmp_path, decoded_heights, compression):
+    img = _page(mode='RGB')
+    path = str(tmp_path / 'single.tif')
+    img.save(path, compression=compression, tiffinfo={278: img.height})
+    with BandReader(path, max_block_pixels=img.width * 100) as reader:
+        # 往後、往前與跨段讀取的結果都與整張圖相同
+        for top, bottom in [(0, 10), (300, 400), (50, 190), (0, 400)]:
+            assert np.array_equal(np.asarray(reader.read_rows(top, bottom)), np.asarray(img)[top:bottom])
+    assert max(decoded_heights[:-1]) <= 192
+
+
+def test_single_compressed_strip_without_row_access_raises(tmp_path):
+    img = _page()
+    path = str(tmp_path / 'single.tif')
+    img.save(path, compression='tiff_lzw', tiffinfo={278: img.height})
+    with pytest.raises(ValueError):
+        BandReader(path, max_block_pixels=img.width * 100)
+
+
+def test_non_tiff_over_limit_raises(tmp_path):
+    img = _page()
+    path = str(tmp_path / 'page.png')
+    img.save(path)
+    with pytest.raises(ValueError):
+        BandReader(path, max_block_pixels=img.width * 100)
+    with BandReader(path) as reader:
+        assert np.array_equal(np.asarray(reader.read_rows(10, 20)), np.asarray(img)[10:20])
+
+
+def test_tiled_glyphs_match_full_crop(tmp_path):
+    img = _glyph_page()
+    path = str(tmp_path / 'glyphs.tif')
+    img.save(path, compression='tiff_lzw', tiffinfo={278: 32})
+    full = extract_glyphs(img, dilate_iter=4)
+    tiled = [glyph for _, glyph in iter_glyphs_tiled(path, dilate_iter=4, band_height=64)]
+    assert len(tiled) == len(full) > 1
+    key = lambda glyph: glyph.tobytes()
+    for a, b in zip(sorted(full, key=key), sorted(tiled, key=key)):
+        assert np.array_equal(a, b)
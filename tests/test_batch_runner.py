@@ -0,0 +1,123 @@
+import json
+import os
+
+import pytest
+
+from batch_runner import batch_runner
+from batch_runner.batch_runner import BROKEN_POOL_ERROR, Checkpoint, load_manifest, run_manifest
+
+
+def _op_touch(task):
+    # 記錄每次執行，task 指定 requires 時，該檔案不存在則失敗
+    with open(task['output'], 'a', encoding='utf-8') as file:
+        file.write(task['name'] + '\n')
+    if task.get('requires') and not os.path.exists(task['requires']):
+        raise FileNotFoundError(task['requires'])
+    if task.get('crash'):
+        os._exit(1)
+    return {'name': task['name']}
+
+
+@pytest.fixture(autouse=True)
+def touch_operation(monkeypatch):
+    monkeypatch.setitem(batch_runner.OPERATIONS, 'touch', _op_touch)
+
+
+def _write_manifest(folder, tasks, **settings):
+    path = os.path.join(folder, 'manifest.json')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(dict(settings, defaults={'touch': {'output': 'runs.log'}}, tasks=tasks), file)
+    return path
+
+
+def _runs(folder):
+    with open(os.path.join(folder, 'runs.log'), encoding='utf-8') as file:
+        return sorted(file.read().split())
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_resume_skips_completed_tasks(tmp_path, workers):
+    folder = str(tmp_path)
+    tasks = [{'op': 'touch', 'name': name} for name in 'abc']
+    tasks.append({'op': 'touch', 'name': 'd', 'requires': os.path.join(folder, 'ready')})
+    manifest = _write_manifest(folder, tasks)
+
+    summary = run_manifest(manifest, workers=workers, progress=False)
+    assert (summary['total'], summary['skipped'], summary['done']) == (4, 0, 3)
+    assert len(summary['failed']) == 1 and summary['failed'][0][1].startswith('FileNotFoundError')
+    assert _runs(folder) == ['a', 'b', 'c', 'd']
+
+    open(os.path.join(folder, 'ready'), 'w').close()
+    summary = run_manifest(manifest, workers=workers, progress=False)
+    assert summary == {'total': 4, 'skipped': 3, 'done': 1, 'failed': []}
+    # 只有失敗的工作重新執行
+    assert _runs(folder) == ['a', 'b', 'c', 'd', 'd']
+
+    assert run_manifest(manifest, workers=workers, progress=False)['skipped'] == 4
+    assert _runs(folder) == ['a', 'b', 'c', 'd', 'd']
+
+
+def test_checkpoint_survives_interrupted_write(tmp_path):
+    folder = str(tmp_path)
+    manifest = _write_manifest(folder, [{'op': 'touch', 'name': 'a', 'id': 'a'},
+                                        {'op': 'touch', 'name': 'b', 'id': 'b'}])
+    run_manifest(manifest, workers=1, progress=False)
+    checkpoint_path = manifest + '.checkpoint.jsonl'
+    # 模擬中斷時寫了一半的行，以及最後一筆記錄為失敗的工作
+    with open(checkpoint_path, 'a', encoding='utf-8') as file:
+        file.write('{"id": "b", "status": "failed"}\n{"id": "a", "sta')
+
+    assert sorted(Checkpoint(checkpoint_path).load()) == ['a']
+    assert run_manifest(manifest, dry_run=True) == {'run': ['b'], 'skip': ['a']}
+    assert run_manifest(manifest, workers=1, progress=False)['done'] == 1
+    assert sorted(Checkpoint(checkpoint_path).load()) == ['a', 'b']
+
+
+def test_checkpoint_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.jsonl'
+    path.write_text('{"id": "a", "status": "done"}\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        Checkpoint(str(path)).load()
+
+
+def test_task_ids_follow_content_not_order(tmp_path):
+    folder = str(tmp_path)
+    tasks = [{'op': 'touch', 'name': name} for name in 'abc']
+    manifest = _write_manifest(folder, tasks, checkpoint='state.jsonl')
+    run_manifest(manifest, workers=1, progress=False)
+    assert os.path.exists(os.path.join(folder, 'state.jsonl'))
+
+    manifest = _write_manifest(folder, tasks[::-1] + [{'op': 'touch', 'name': 'e'}], checkpoint='state.jsonl')
+    plan = run_manifest(manifest, dry_run=True)
+    assert len(plan['skip']) == 3 and len(plan['run']) == 1
+
+
+def test_load_manifest_resolves_paths_and_defaults(tmp_path):
+    manifest = _write_manifest(str(tmp_path), [{'op': 'touch', 'name': 'a', 'input': 'in/a.tif'}], workers=3)
+    settings, tasks = load_manifest(manifest)
+    assert settings == {'workers': 3}
+    (_, task), = tasks
+    assert task['input'] == os.path.join(str(tmp_path), 'in', 'a.tif')
+    assert task['output'] == os.path.join(str(tmp_path), 'runs.log')
+
+    with open(manifest, 'w', encoding='utf-8') as file:
+        json.dump([{'op': 'missing'}], file)
+    with pytest.raises(ValueError):
+        load_manifest(manifest)
+
+
+def test_broken_pool_marks_task_failed_and_continues(tmp_path):
+    folder = str(tmp_path)
+    tasks = [{'op': 'touch', 'name': 'crash', 'id': 'crash', 'crash': True}]
+    tasks += [{'op': 'touch', 'name': name, 'id': name} for name in 'abcd']
+    manifest = _write_manifest(folder, tasks)
+
+    summary = run_manifest(manifest, workers=2, progress=False)
+    failed = dict(summary['failed'])
+    assert failed['crash'] == BROKEN_POOL_ERROR
+    assert summary['done'] + len(failed) == 5
+    # 與崩潰的工作同時處理中的工作也記錄為失敗，移除崩潰的工作後重新執行，其餘工作全部完成
+    manifest = _write_manifest(folder, tasks[1:])
+    summary = run_manifest(manifest, workers=2, progress=False)
+    assert summary['skipped'] + summary['done'] == 4 and not summary['failed']
+    assert set(Checkpoint(manifest + '.checkpoint.jsonl').load()) == set('abcd')
@@ -0,0 +1,54 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from crop_text.crop_text import crop_text_batch, dilate_binary, extract_glyphs
+
+
+def _binary(size=(120, 90), seed=0):
+    rng = np.random.default_rng(seed)
+    return ((rng.random((size[1], size[0])) > 0.995) * 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('radius', [0, 1, 3, 10, 40, 150])
+def test_dilate_binary_matches_repeated_3x3_dilation(radius):
+    image = _binary()
+    expected = cv2.dilate(image, np.ones((3, 3), np.uint8), iterations=radius) if radius else image
+    result = dilate_binary(image, radius)
+    assert result.dtype == np.uint8
+    assert np.array_equal(result, expected)
+
+
+def _glyph_images(count=3):
+    images = []
+    for i in range(count):
+        img = np.full((80, 120), 255, np.uint8)
+        img[10 + i:40 + i, 10:18] = 0
+        img[50:70, 60 + i * 5:90 + i * 5] = 30
+        images.append(Image.fromarray(img, 'L'))
+    return images
+
+
+def test_crop_text_batch_matches_sequential_path(tmp_path):
+    images = _glyph_images()
+    expected = [extract_glyphs(image, dilate_iter=3) for image in images]
+    for workers in (1, 2):
+        results = crop_text_batch(images, workers=workers, dilate_iter=3)
+        assert len(results) == len(expected)
+        for glyphs, expected_glyphs in zip(results, expected):
+            assert len(glyphs) == len(expected_glyphs) == 2
+            assert all(np.array_equal(a, b) for a, b in zip(glyphs, expected_glyphs))
+
+
+def test_crop_text_batch_writes_files(tmp_path):
+    folder = tmp_path / 'input'
+    folder.mkdir()
+    for i, image in enumerate(_glyph_images()):
+        image.save(folder / f'page{i}.png')
+    paths = crop_text_batch(str(folder), workers=2, output_dir=str(tmp_path / 'output'), dilate_iter=3)
+    assert [len(page_paths) for page_paths in paths] == [2, 2, 2]
+    assert os.path.basename(paths[0][0]) == 'page0_000.png'
+    assert all(os.path.exists(path) for page_paths in paths for path in page_paths)
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各工具的 __main__ 以工具資料夾為工作目錄撰寫，例如 tif_tools.py 使用 "./test_file.tif"
+SCRIPTS = [
+    'tif_tools/tif_tools.py',
+    'tif_tools/tiff_writer.py',
+    'crop_text/crop_text.py',
+    'gif_tools/gif_tools.py',
+    'gif_tools/gif_writer.py',
+    'watermark/add_watermark.py',
+    'rename_file_and_folder/raname_file_and_folder.py',
+    'read_img_exif/tag_index.py',
+]
+
+
+@pytest.mark.parametrize('script', SCRIPTS)
+def test_script_loads_from_its_own_folder(script):
+    folder, file_name = os.path.split(os.path.join(ROOT_DIR, script))
+    # 與直接執行腳本相同，腳本所在的資料夾位於搜尋路徑最前面，但不執行 __main__ 區塊
+    code = f'import runpy; runpy.run_path({file_name!r}, run_name="imgtools_entry_point")'
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONPATH'}
+    result = subprocess.run([sys.executable, '-c', code], cwd=folder, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
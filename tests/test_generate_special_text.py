@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from watermark.generate_special_text import apply_text_mask, generate_line_pattern_image
+
+
+def _draw_line_pattern(width, height, min_line_length, max_line_length, line_spacing, seed):
+    # 以與 generate_line_pattern_image 相同的亂數逐條呼叫 draw.line，作為向量化結果的對照
+    rng = np.random.default_rng(seed)
+    rows, cols = -(-height // line_spacing), -(-width // line_spacing)
+    line_length = rng.integers(min_line_length, max_line_length, size=(rows, cols), endpoint=True, dtype=np.int16)
+    scale_x = rng.random((rows, cols), dtype=np.float32) * np.float32(0.2) + np.float32(0.9)
+    scale_y = rng.random((rows, cols), dtype=np.float32) * np.float32(0.2) + np.float32(0.9)
+    dx = (line_length * scale_x).astype(np.int32)
+    dy = (line_length * scale_y).astype(np.int32)
+
+    image = Image.new('1', (width, height), 1)
+    draw = ImageDraw.Draw(image)
+    for row, y in enumerate(range(0, height, line_spacing)):
+        for col, x in enumerate(range(0, width, line_spacing)):
+            draw.line([(x, y), (x + int(dx[row, col]), y + int(dy[row, col]))], fill=0, width=1)
+    return image
+
+
+@pytest.mark.parametrize('width, height, min_length, max_length, spacing', [
+    (120, 90, 4, 8, 4),
+    (101, 77, 2, 15, 5),
+    (64, 64, 10, 20, 3),
+])
+def test_line_pattern_matches_draw_line(width, height, min_length, max_length, spacing):
+    expected = _draw_line_pattern(width, height, min_length, max_length, spacing, seed=7)
+    image = generate_line_pattern_image(width, height, min_length, max_length, spacing, 0, seed=7)
+    assert image.mode == '1'
+    assert image.size == (width, height)
+    assert image.tobytes() == expected.tobytes()
+
+
+def test_line_pattern_is_reproducible_with_seed():
+    first = generate_line_pattern_image(80, 60, 4, 8, 4, 30, seed=1)
+    assert first.tobytes() == generate_line_pattern_image(80, 60, 4, 8, 4, 30, seed=1).tobytes()
+    assert first.tobytes() != generate_line_pattern_image(80, 60, 4, 8, 4, 30, seed=2).tobytes()
+
+
+def test_apply_text_mask_keeps_pattern_inside_text(monkeypatch):
+    font = ImageFont.load_default(40)
+    monkeypatch.setattr(ImageFont, 'truetype', lambda *args, **kwargs: font)
+    background = generate_line_pattern_image(160, 80, 4, 8, 4, 0, seed=0)
+
+    masked = apply_text_mask(background, 'AB', 'unused.ttf', 40)
+
+    mask = Image.new('1', background.size, 0)
+    draw = ImageDraw.Draw(mask)
+    left, top, right, bottom = draw.textbbox((0, 0), 'AB', font=font)
+    draw.text(((160 - (right - left)) // 2, (80 - (bottom - top)) // 2), 'AB', font=font, fill=1)
+    expected = Image.composite(background, Image.new('1', background.size, 1), mask)
+    assert masked.tobytes() == expected.tobytes()
+    assert 0 < np.count_nonzero(~np.asarray(masked)) < np.count_nonzero(~np.asarray(background))
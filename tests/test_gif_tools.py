@@ -0,0 +1,80 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from gif_tools.gif_tools import convert_mp4_to_frame, convert_mp4_to_gif, iter_video_frames
+
+FPS = 10
+FRAME_COUNT = 30
+
+
+@pytest.fixture(scope='module')
+def video_path(tmp_path_factory):
+    # 每一幀的亮度依幀編號遞增，並加上一個移動的方塊，方便辨認讀到的是哪一幀
+    path = str(tmp_path_factory.mktemp('video') / 'clip.mp4')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (64, 48))
+    for i in range(FRAME_COUNT):
+        frame = np.full((48, 64, 3), i * 8, np.uint8)
+        frame[8:16, i:i + 8] = 255
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def _read_frames(folder):
+    return {name: cv2.imread(os.path.join(folder, name)) for name in sorted(os.listdir(folder))}
+
+
+def test_iter_video_frames_range_and_stride(video_path):
+    indices = [index for index, _ in iter_video_frames(video_path, start=1, end=2.5, stride=2)]
+    assert indices == [10, 12, 14, 16, 18, 20, 22, 24]
+    assert [index for index, _ in iter_video_frames(video_path, stride=12)] == [0, 12, 24]
+
+
+def test_convert_mp4_to_frame_matches_decoded_frames(video_path, tmp_path):
+    expected = {f'frame_{index:03d}.png': image
+                for index, image in iter_video_frames(video_path, start=1, end=2.5, stride=2)}
+    for workers in (1, 4):
+        folder = str(tmp_path / f'workers{workers}')
+        convert_mp4_to_frame(video_path, folder, start=1, end=2.5, stride=2, workers=workers, queue_size=2)
+        frames = _read_frames(folder)
+        assert list(frames) == sorted(expected)
+        assert all(np.array_equal(frames[name], expected[name]) for name in expected)
+
+
+def test_convert_mp4_to_frame_raises_write_errors(video_path, tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(cv2, 'imwrite', fail)
+    with pytest.raises(OSError, match='disk full'):
+        convert_mp4_to_frame(video_path, str(tmp_path), end=1, workers=2, queue_size=1)
+
+
+@pytest.mark.parametrize('fps, expected_count', [(None, 20), (5, 10), (4, 8)])
+def test_convert_mp4_to_gif_resamples_fps(video_path, tmp_path, monkeypatch, fps, expected_count):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'out.gif')
+    assert convert_mp4_to_gif(video_path, path, fps=fps, size=(32, 24), end=2) == expected_count
+    with Image.open(path) as img:
+        assert img.n_frames == expected_count
+        assert img.size == (32, 24)
+        assert img.info['duration'] == 1000 // (fps or FPS)
+    # 不再經過 ./output 暫存資料夾
+    assert os.listdir(tmp_path) == ['out.gif']
+
+
+def test_convert_mp4_to_gif_keeps_frame_order(video_path, tmp_path):
+    path = str(tmp_path / 'out.gif')
+    convert_mp4_to_gif(video_path, path, start=1, end=2, queue_size=1)
+    brightness = []
+    with Image.open(path) as img:
+        for i in range(img.n_frames):
+            img.seek(i)
+            brightness.append(img.convert('L').getpixel((40, 40)))
+    assert len(brightness) == 10
+    assert brightness == sorted(brightness)
+    assert brightness[-1] - brightness[0] > 40
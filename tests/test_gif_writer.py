@@ -0,0 +1,42 @@
+from PIL import Image
+
+from gif_tools.gif_writer import write_gif
+
+COLORS = [(220, 30, 30), (30, 30, 220)]
+
+
+def _frames(count):
+    # 前半段為紅色，後半段為藍色，並加上一個移動的方塊使每一幀都不同
+    for i in range(count):
+        frame = Image.new('RGB', (32, 32), COLORS[i * 2 // count])
+        frame.paste((255, 255, 255), (i % 28, 0, i % 28 + 4, 4))
+        yield frame
+
+
+def _last_frame_color(path):
+    with Image.open(path) as img:
+        img.seek(img.n_frames - 1)
+        return img.convert('RGB').getpixel((16, 16))
+
+
+def _close(color, expected, tolerance=16):
+    return all(abs(a - b) <= tolerance for a, b in zip(color, expected))
+
+
+def test_iterator_palette_samples_across_window(tmp_path):
+    path = str(tmp_path / 'out.gif')
+    assert write_gif(_frames(40), path) == 40
+    assert _close(_last_frame_color(path), COLORS[1])
+
+
+def test_iterator_palette_frames(tmp_path):
+    path = str(tmp_path / 'out.gif')
+    palette_frames = [Image.new('RGB', (32, 32), color) for color in COLORS]
+    assert write_gif(_frames(200), path, palette_frames=palette_frames) == 200
+    assert _close(_last_frame_color(path), COLORS[1])
+
+
+def test_sequence_palette_samples_all_frames(tmp_path):
+    path = str(tmp_path / 'out.gif')
+    assert write_gif(list(_frames(200)), path) == 200
+    assert _close(_last_frame_color(path), COLORS[1])
@@ -0,0 +1,59 @@
+import os
+
+import fitz
+import pytest
+
+from pdf_tools.pdf_dpi_conversion_tools import PDFOperator, geometry_cache_key
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = str(tmp_path / 'doc.pdf')
+    with fitz.open() as doc:
+        doc.new_page(width=595, height=842)
+        doc.new_page(width=842, height=595).set_rotation(90)
+        doc.save(path)
+    return path
+
+
+def _index(path, cache_dir):
+    operator = PDFOperator(path)
+    try:
+        return operator.geometry_index(cache_dir=cache_dir)
+    finally:
+        operator.doc.close()
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError('快取命中時不應重新計算頁面幾何')
+
+
+def test_geometry_cache_hit_skips_pages(tmp_path, pdf_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    index = _index(pdf_path, cache_dir)
+    assert [page['rotation'] for page in index] == [0, 90]
+    monkeypatch.setattr(PDFOperator, 'page_geometry', _fail)
+    assert _index(pdf_path, cache_dir) == index
+
+
+def test_geometry_cache_rebuilds_when_file_changes(tmp_path, pdf_path):
+    cache_dir = str(tmp_path / 'cache')
+    _index(pdf_path, cache_dir)
+    stat = os.stat(pdf_path)
+    os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert geometry_cache_key(pdf_path)[0] + '.json' not in os.listdir(cache_dir)
+    _index(pdf_path, cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+@pytest.mark.parametrize('content', ['', '[{"page": 0', '[]', '{"pages": []}'])
+def test_corrupt_geometry_cache_is_a_miss(tmp_path, pdf_path, content):
+    cache_dir = str(tmp_path / 'cache')
+    os.makedirs(cache_dir)
+    cache_path = os.path.join(cache_dir, geometry_cache_key(pdf_path)[0] + '.json')
+    with open(cache_path, 'w') as file:
+        file.write(content)
+    assert len(_index(pdf_path, cache_dir)) == 2
+    # 重新建立的快取可正常使用，且沒有留下暫存檔
+    assert len(_index(pdf_path, cache_dir)) == 2
+    assert os.listdir(cache_dir) == [os.path.basename(cache_path)]
@@ -0,0 +1,41 @@
+import os
+
+import fitz
+from PIL import Image
+
+from pdf_tools.pdf_dpi_conversion_tools import PDFOperator, save_all_pages_as_images, save_all_pages_as_images_parallel
+
+
+def test_parallel_render_matches_sequential(tmp_path):
+    path = str(tmp_path / 'text.pdf')
+    with fitz.open() as doc:
+        for i in range(3):
+            doc.new_page(width=200, height=150).insert_text((20, 60 + i * 20), f'page {i + 1}')
+        doc.save(path)
+
+    operator = PDFOperator(path)
+    try:
+        save_all_pages_as_images(operator, str(tmp_path / 'sequential'), dpi=96)
+    finally:
+        operator.doc.close()
+    results = save_all_pages_as_images_parallel(path, str(tmp_path / 'parallel'), dpi=96, workers=2)
+
+    assert [page for page, _, _ in results] == [0, 1, 2]
+    names = sorted(os.listdir(tmp_path / 'sequential'))
+    assert names == ['text_page1.png', 'text_page2.png', 'text_page3.png']
+    assert sorted(os.listdir(tmp_path / 'parallel')) == names
+    for name in names:
+        with Image.open(tmp_path / 'sequential' / name) as expected, \
+                Image.open(tmp_path / 'parallel' / name) as actual:
+            assert actual.size == expected.size
+            assert actual.tobytes() == expected.tobytes()
+
+
+def test_parallel_render_selected_pages(tmp_path):
+    path = str(tmp_path / 'doc.pdf')
+    with fitz.open() as doc:
+        for _ in range(12):
+            doc.new_page(width=100, height=100)
+        doc.save(path)
+    results = save_all_pages_as_images_parallel(path, str(tmp_path), dpi=72, workers=2, pages=[10, 1])
+    assert [(page, os.path.basename(name)) for page, name, _ in results] == [(1, 'doc_page02.png'), (10, 'doc_page11.png')]
@@ -0,0 +1,48 @@
+import fitz
+import numpy as np
+from PIL import Image, ImageDraw
+
+from pdf_tools.pdf_writer import PDFWriter
+
+
+def _bilevel_page(size=(600, 480)):
+    img = Image.new('1', size, 1)
+    draw = ImageDraw.Draw(img)
+    for i in range(0, size[1], 37):
+        draw.rectangle((i % size[0], i, i % size[0] + 50, i + 20), fill=0)
+    return img
+
+
+def _render(path, page=0):
+    with fitz.open(path) as doc:
+        pixmap = doc[page].get_pixmap(dpi=72, colorspace=fitz.csGRAY)
+        return np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width)
+
+
+def _write_pdf(tmp_path, source):
+    path = str(tmp_path / 'out.pdf')
+    with PDFWriter(path) as writer:
+        assert writer.add_file(source) == 1
+    with open(path, 'rb') as file:
+        return path, file.read()
+
+
+def test_multi_strip_g4_pages_are_embedded_as_ccitt(tmp_path):
+    img = _bilevel_page()
+    source = str(tmp_path / 'g4.tif')
+    img.save(source, compression='group4', tiffinfo={278: 64})
+    with Image.open(source) as check:
+        assert len(check.tag_v2[273]) > 1
+    path, data = _write_pdf(tmp_path, source)
+    assert data.count(b'/CCITTFaxDecode') == len(range(0, img.height, 64))
+    assert b'/FlateDecode' not in data
+    assert np.array_equal(_render(path) > 127, np.asarray(img))
+
+
+def test_bilevel_lzw_pages_are_reencoded_as_ccitt(tmp_path):
+    img = _bilevel_page()
+    source = str(tmp_path / 'lzw.tif')
+    img.save(source, compression='tiff_lzw')
+    path, data = _write_pdf(tmp_path, source)
+    assert data.count(b'/CCITTFaxDecode') == 1
+    assert np.array_equal(_render(path) > 127, np.asarray(img))
@@ -0,0 +1,177 @@
+import os
+
+import pytest
+
+from rename_file_and_folder import rename_engine
+from rename_file_and_folder.raname_file_and_folder import rename_by_mapping
+from rename_file_and_folder.rename_engine import apply_plan, compile_mapping, load_mapping, plan_rename, resume, undo
+
+
+def _tree(root):
+    return sorted(os.path.relpath(os.path.join(folder, name), root)
+                  for folder, folders, files in os.walk(root) for name in folders + files)
+
+
+def _make(root, paths):
+    for path in paths:
+        path = os.path.join(root, path)
+        if path.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+
+def _replace(target, convert2):
+    return lambda name: name.replace(target, convert2)
+
+
+def test_plan_detects_conflicts_without_renaming(tmp_path):
+    root = str(tmp_path)
+    _make(root, ['old_a.txt', 'new_a.txt', 'old_b.txt', 'x_old.txt', 'x_new.txt'])
+    before = _tree(root)
+
+    # old_a → new_a 已存在；x_old → x_new 已存在；old_b → new_b 可改名
+    plan = plan_rename(root, _replace('old', 'new'))
+    assert [os.path.basename(new) for _, _, new in plan.operations] == ['new_b.txt']
+    assert sorted((os.path.basename(old), reason) for old, _, reason in plan.conflicts) == [
+        ('old_a.txt', 'already exists.'), ('x_old.txt', 'already exists.')]
+    assert _tree(root) == before
+
+
+def test_plan_rejects_duplicate_and_invalid_names(tmp_path):
+    root = str(tmp_path)
+    _make(root, ['a1.txt', 'a2.txt', 'sep.txt'])
+    plan = plan_rename(root, lambda name: {'a1.txt': 'a.txt', 'a2.txt': 'a.txt', 'sep.txt': 'x/y.txt'}[name])
+    assert len(plan) == 1
+    reasons = sorted(reason for _, _, reason in plan.conflicts)
+    assert reasons == ['already exists.', 'is not a valid name.']
+
+
+def test_apply_renames_folders_after_their_contents(tmp_path):
+    root = str(tmp_path)
+    _make(root, ['old/old/old.txt', 'old/keep.txt', 'other/old.txt'])
+    plan = plan_rename(root, _replace('old', 'new'))
+    assert apply_plan(plan, workers=4) == {'renamed': 4, 'conflicts': 0, 'errors': []}
+    assert _tree(root) == ['new', 'new/keep.txt', 'new/new', 'new/new/new.txt', 'other', 'other/new.txt']
+
+
+def test_apply_files_only_and_dry_run(tmp_path):
+    root = str(tmp_path)
+    _make(root, ['old/old.txt'])
+    report = apply_plan(plan_rename(root, _replace('old', 'new'), folders=False), dry_run=True)
+    assert report.splitlines()[0] == '1 renames, 0 conflicts'
+    assert _tree(root) == ['old', 'old/old.txt']
+    apply_plan(plan_rename(root, _replace('old', 'new'), folders=False))
+    assert _tree(root) == ['old', 'old/new.txt']
+
+
+def test_undo_restores_tree(tmp_path):
+    root = str(tmp_path / 'root')
+    _make(root, ['old/old/old.txt', 'old/a_old.txt', 'b_old/'])
+    before = _tree(root)
+    journal_path = str(tmp_path / 'rename.journal')
+
+    apply_plan(plan_rename(root, _replace('old', 'new')), journal_path=journal_path, workers=4)
+    assert _tree(root) == ['b_new', 'new', 'new/a_new.txt', 'new/new', 'new/new/new.txt']
+    assert undo(journal_path, workers=4) == {'restored': 5, 'errors': []}
+    assert _tree(root) == before
+    # 還原的項目已記錄在日誌中，再次還原不會有任何動作
+    assert undo(journal_path) == {'restored': 0, 'errors': []}
+
+
+def test_resume_after_interruption(tmp_path, monkeypatch):
+    root = str(tmp_path / 'root')
+    _make(root, ['old/old_1.txt', 'old/old_2.txt', 'old/old_3.txt', 'old_4.txt'])
+    journal_path = str(tmp_path / 'rename.journal')
+    plan = plan_rename(root, _replace('old', 'new'))
+
+    rename = os.rename
+    calls = []
+
+    def interrupted_rename(source, destination):
+        calls.append(source)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        rename(source, destination)
+
+    monkeypatch.setattr(rename_engine.os, 'rename', interrupted_rename)
+    with pytest.raises(KeyboardInterrupt):
+        apply_plan(plan, journal_path=journal_path, workers=1)
+    monkeypatch.setattr(rename_engine.os, 'rename', rename)
+
+    # 模擬中斷時寫了一半的日誌行，以及已改名但尚未寫入日誌的項目
+    with open(journal_path, 'a', encoding='utf-8') as file:
+        file.write('["D", ')
+    _, old, new = plan.operations[3]
+    rename(old, new)
+
+    assert resume(journal_path) == {'renamed': 3, 'errors': []}
+    assert _tree(root) == ['new', 'new/new_1.txt', 'new/new_2.txt', 'new/new_3.txt', 'new_4.txt']
+    assert resume(journal_path) == {'renamed': 0, 'errors': []}
+    assert undo(journal_path)['restored'] == 5
+    assert _tree(root) == ['old', 'old/old_1.txt', 'old/old_2.txt', 'old/old_3.txt', 'old_4.txt']
+
+
+def test_apply_reports_errors(tmp_path):
+    root = str(tmp_path)
+    _make(root, ['old.txt'])
+    plan = plan_rename(root, _replace('old', 'new'))
+    os.remove(os.path.join(root, 'old.txt'))
+    result = apply_plan(plan)
+    assert result['renamed'] == 0
+    assert result['errors'][0][0] == os.path.join(root, 'old.txt')
+    assert result['errors'][0][1].startswith('FileNotFoundError')
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('abcab', 'zy'),
+    ('aab', 'xy'),
+    ('ababc', 'yz'),
+    ('cba', 'cbx'),
+])
+def test_mapping_longest_match_from_left(name, expected):
+    convert_name = compile_mapping({'a': 'x', 'ab': 'y', 'abc': 'z'})
+    assert convert_name(name) == expected
+
+
+def test_mapping_does_not_replace_substituted_text():
+    assert compile_mapping({'a': 'b', 'b': 'c'})('ab') == 'bc'
+    assert compile_mapping({'P01': 'P02', 'P02': 'P03'})('P01_P02.tif') == 'P02_P03.tif'
+    assert compile_mapping({'a.b': 'x', '(': '['})('a.b(acb') == 'x[acb'
+
+
+def test_mapping_rejects_empty_target():
+    assert compile_mapping({})('name') == 'name'
+    with pytest.raises(ValueError):
+        compile_mapping({'': 'x'})
+
+
+def test_load_mapping_csv(tmp_path):
+    path = tmp_path / 'mapping.csv'
+    path.write_text('target,convert2\nOLD,NEW\n\n"A,B",C\nOLD,NEW\n', encoding='utf-8-sig')
+    assert load_mapping(str(path)) == {'OLD': 'NEW', 'A,B': 'C'}
+    path.write_text('OLD,NEW\nOLD,OTHER\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        load_mapping(str(path))
+    path.write_text('OLD\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        load_mapping(str(path))
+
+
+def test_rename_by_mapping_single_pass(tmp_path, monkeypatch):
+    root = str(tmp_path / 'root')
+    _make(root, ['P01/P01_P10.tif', 'P10/readme.txt', 'P100.tif'])
+    mapping = tmp_path / 'mapping.csv'
+    mapping.write_text('P01,Q01\nP10,Q10\nP100,Q100\n', encoding='utf-8')
+
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(rename_engine.os, 'scandir', lambda path: scans.append(path) or scandir(path))
+    result = rename_by_mapping(root, str(mapping), workers=2)
+    scanned = list(scans)
+
+    assert result == {'renamed': 4, 'conflicts': 0, 'errors': []}
+    assert _tree(root) == ['Q01', 'Q01/Q01_Q10.tif', 'Q10', 'Q10/readme.txt', 'Q100.tif']
+    # 每個資料夾只掃描一次
+    assert len(scanned) == len(set(scanned)) == 3
@@ -0,0 +1,19 @@
+import os
+
+from PIL import Image
+
+from read_img_exif.tag_index import TagIndex
+
+
+def test_find_path_prefix_escapes_wildcards(tmp_path):
+    for folder in ['a_b', 'axb']:
+        os.makedirs(tmp_path / folder)
+        Image.new('L', (8, 8)).save(tmp_path / folder / 'page.tif', dpi=(200, 200))
+    with TagIndex(str(tmp_path / 'tags.db')) as index:
+        index.update(str(tmp_path), workers=1)
+        rows = index.find(path_prefix=str(tmp_path / 'a_b'))
+        assert [os.path.basename(os.path.dirname(row['path'])) for row in rows] == ['a_b']
+
+        # 第二次更新只比對此資料夾下已記錄的檔案
+        index.update(str(tmp_path / 'a_b'), workers=1)
+        assert len(index.find(path_prefix=str(tmp_path))) == 2
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+from PIL import Image
+
+from tif_tools.tif_tools import TifTools
+from tif_tools.tiff_writer import TiffWriter
+
+
+def _two_page_tif(path, mode, compression):
+    pages = [Image.new(mode, (32, 24), 'white'), Image.new(mode, (32, 24), 'black')]
+    pages[0].save(path, save_all=True, append_images=pages[1:], compression=compression)
+    return path
+
+
+@pytest.mark.parametrize('mode, compression', [('RGB', 'tiff_lzw'), ('RGB', 'jpeg'), ('L', 'raw')])
+def test_split_to_group4_converts_to_bilevel(tmp_path, mode, compression):
+    path = _two_page_tif(str(tmp_path / 'source.tif'), mode, compression)
+    save_paths = TifTools().split_all_page(path, str(tmp_path / 'output'), compression='group4', workers=1)
+    assert len(save_paths) == 2
+    for save_path in save_paths:
+        with Image.open(save_path) as img:
+            assert img.mode == '1'
+            assert img.info['compression'] == 'group4'
+
+
+@pytest.mark.parametrize('color_mode', ['L', 'RGB'])
+def test_split_group4_source_with_color_mode_falls_back_to_lzw(tmp_path, color_mode):
+    path = _two_page_tif(str(tmp_path / 'source.tif'), '1', 'group4')
+    save_paths = TifTools().split_all_page(path, str(tmp_path / 'output'), color_mode=color_mode, workers=1)
+    for save_path in save_paths:
+        with Image.open(save_path) as img:
+            assert img.mode == color_mode
+            assert img.info['compression'] == 'tiff_lzw'
+
+
+def test_split_group4_source_to_bilevel_keeps_group4(tmp_path):
+    path = _two_page_tif(str(tmp_path / 'source.tif'), '1', 'group4')
+    save_paths = TifTools().split_all_page(path, str(tmp_path / 'output'), color_mode='1', workers=1)
+    for save_path in save_paths:
+        with Image.open(save_path) as img:
+            assert img.info['compression'] == 'group4'
+
+
+def test_split_failure_removes_partial_page(tmp_path, monkeypatch):
+    path = _two_page_tif(str(tmp_path / 'source.tif'), 'L', 'raw')
+    output = tmp_path / 'output'
+
+    def broken_save(img, fp, **params):
+        with open(fp, 'wb') as file:
+            file.write(b'II*\x00')
+        raise OSError('encoder error -2')
+
+    monkeypatch.setattr(Image.Image, 'save', broken_save)
+    with pytest.raises(OSError):
+        TifTools().split_all_page(path, str(output), compression='tiff_lzw', workers=1)
+    assert os.listdir(output) == []
+
+
+def test_split_tiled_group4_source_falls_back_to_lzw(tmp_path):
+    path = _two_page_tif(str(tmp_path / 'source.tif'), '1', 'group4')
+    save_paths = TifTools().split_all_page(path, str(tmp_path / 'output'), tile_size=16, workers=1)
+    for save_path in save_paths:
+        with Image.open(save_path) as img:
+            assert img.tag_v2[259] == 5
+            assert img.tag_v2[322] == 16
+
+
+def test_split_tiled_rejects_group4(tmp_path):
+    path = _two_page_tif(str(tmp_path / 'source.tif'), '1', 'group4')
+    with pytest.raises(ValueError):
+        TifTools().split_all_page(path, str(tmp_path / 'output'), compression='group4', tile_size=16)
+
+
+def _open_files():
+    paths = set()
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            paths.add(os.readlink(f'/proc/self/fd/{fd}'))
+        except OSError:
+            pass
+    return paths
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='需要 /proc 檢查開啟的檔案')
+def test_save_multipage_tiff_closes_sources(tmp_path, monkeypatch):
+    sources = []
+    for i in range(5):
+        path = str(tmp_path / f'{i}.tif')
+        Image.new('RGB', (32, 24), (i * 40, 0, 0)).save(path)
+        sources.append(path)
+    output = str(tmp_path / 'merged.tif')
+
+    # 頁面交給 writer 在背景壓縮時，來源檔案應已關閉
+    held = []
+    add_page = TiffWriter.add_page
+
+    def spy(self, img):
+        held.append(_open_files() & set(sources))
+        return add_page(self, img)
+
+    monkeypatch.setattr(TiffWriter, 'add_page', spy)
+    TifTools().save_multipage_tiff(sources, output, workers=2)
+    assert held == [set()] * 5
+    with Image.open(output) as img:
+        assert img.n_frames == 5
+        img.seek(4)
+        assert img.convert('RGB').getpixel((0, 0)) == (160, 0, 0)
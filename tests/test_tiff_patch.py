@@ -0,0 +1,49 @@
+from PIL import Image
+
+from read_img_exif.tiff_patch import patch_tags
+from read_img_exif.tiff_tags import read_tags
+
+ARTIST = {315: {'datatype': 2, 'data': 'x'}}
+
+
+def _two_page_tif(path):
+    first = Image.new('L', (16, 8), 32)
+    second = Image.new('L', (8, 16), 200)
+    first.save(path, save_all=True, append_images=[second], compression='raw')
+    return path
+
+
+def _assert_pages(path):
+    with Image.open(path) as img:
+        assert img.n_frames == 2
+        for page, size in enumerate([(16, 8), (8, 16)]):
+            img.seek(page)
+            img.load()
+            assert img.size == size
+            assert img.tag_v2[315] == 'x'
+
+
+def test_patch_unsorted_pages(tmp_path):
+    path = _two_page_tif(str(tmp_path / 'q.tif'))
+    report = patch_tags(path, ARTIST, pages=[1, 0])
+    assert [item['page'] for item in report] == [0, 1]
+    _assert_pages(path)
+
+
+def test_patch_repeated_pages(tmp_path):
+    path = _two_page_tif(str(tmp_path / 'q.tif'))
+    report = patch_tags(path, ARTIST, pages=[0, 0, 1, 1])
+    assert len(report) == 2
+    _assert_pages(path)
+    assert read_tags(path, pages=[0, 1], tags=[315])
+
+
+def test_patch_single_page_keeps_chain(tmp_path):
+    path = _two_page_tif(str(tmp_path / 'q.tif'))
+    patch_tags(path, ARTIST, pages=[1])
+    with Image.open(path) as img:
+        assert img.n_frames == 2
+        img.seek(1)
+        assert img.tag_v2[315] == 'x'
+        img.seek(0)
+        assert 315 not in img.tag_v2
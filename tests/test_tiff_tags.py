@@ -0,0 +1,31 @@
+import struct
+
+from PIL import Image
+
+from read_img_exif.tiff_tags import TiffHeader
+
+
+def _multipage_tif(path, pages):
+    images = [Image.new('L', (8, 8), i * 10) for i in range(pages)]
+    images[0].save(path, save_all=True, append_images=images[1:], compression='raw')
+    return path
+
+
+def test_page_count(tmp_path):
+    path = _multipage_tif(str(tmp_path / 'pages.tif'), 50)
+    with TiffHeader(path) as header:
+        assert header.page_count == 50
+        assert len({header.ifd_offset(page) for page in range(50)}) == 50
+
+
+def test_cyclic_ifd_chain_stops(tmp_path):
+    path = _multipage_tif(str(tmp_path / 'cycle.tif'), 3)
+    with TiffHeader(path) as header:
+        first = header.ifd_offset(0)
+        last, entries = header.entries(2)
+    # 讓最後一頁的下一個 IFD 指標指回第一頁
+    with open(path, 'r+b') as file:
+        file.seek(last + 2 + entries.nbytes)
+        file.write(struct.pack('<L', first))
+    with TiffHeader(path) as header:
+        assert header.page_count == 3
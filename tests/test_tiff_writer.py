@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from tif_tools.tiff_writer import TiffWriter, encode_tiled_page
+
+
+def _gradient(size=(300, 200), mode='RGB'):
+    x = np.linspace(0, 255, size[0], dtype=np.uint8)
+    y = np.linspace(0, 255, size[1], dtype=np.uint8)
+    rgb = np.dstack([np.add.outer(y // 2, x // 2), np.tile(x, (size[1], 1)), np.tile(y[:, None], (1, size[0]))])
+    return Image.fromarray(rgb.astype(np.uint8), 'RGB').convert(mode)
+
+
+def _write(path, pages, **options):
+    with TiffWriter(path, **options) as writer:
+        for page in pages:
+            writer.add_page(page)
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('compression, code', [('tiff_lzw', 5), ('tiff_adobe_deflate', 8), ('raw', 1)])
+def test_tiled_output_keeps_pixels(tmp_path, compression, code):
+    pages = [_gradient(), _gradient(mode='L'), _gradient().convert('1')]
+    path = str(tmp_path / 'tiled.tif')
+    _write(path, pages, compression=compression, tile_size=64, workers=2)
+    with Image.open(path) as img:
+        assert img.n_frames == len(pages)
+        for i, page in enumerate(pages):
+            img.seek(i)
+            assert img.tag_v2[259] == code
+            assert img.tag_v2[322] == 64
+            assert len(img.tag_v2[330]) == 3
+            assert np.array_equal(np.asarray(img), np.asarray(page))
+
+
+def test_tiled_output_is_independent_of_workers(tmp_path):
+    pages = [_gradient(), _gradient(mode='L')]
+    sequential = _write(str(tmp_path / 'sequential.tif'), pages, compression='tiff_lzw', tile_size=32, workers=1)
+    parallel = _write(str(tmp_path / 'parallel.tif'), pages, compression='tiff_lzw', tile_size=32, workers=4)
+    assert parallel == sequential
+
+
+def test_tiled_levels_match_sequential_encoder(tmp_path):
+    page = _gradient()
+    path = str(tmp_path / 'tiled.tif')
+    _write(path, [page], compression='tiff_adobe_deflate', tile_size=64, workers=4)
+    data = open(path, 'rb').read()
+    for _, tiles in encode_tiled_page(page, 'tiff_adobe_deflate', tile_size=64):
+        for tile in tiles:
+            assert tile in data
+
+
+@pytest.mark.parametrize('compression', ['group4', 'jpeg'])
+def test_tiled_rejects_unsupported_compression(tmp_path, compression):
+    with pytest.raises(ValueError):
+        TiffWriter(str(tmp_path / 'tiled.tif'), compression=compression, tile_size=64)
+
+
+def test_strip_output_is_independent_of_workers(tmp_path):
+    pages = [_gradient(), _gradient(mode='L'), _gradient().convert('1')]
+    sequential = _write(str(tmp_path / 'sequential.tif'), pages, workers=1)
+    parallel = _write(str(tmp_path / 'parallel.tif'), pages, workers=4)
+    assert parallel == sequential
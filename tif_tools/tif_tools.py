@@ -1,33 +1,92 @@
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import tifftools
-from PIL import Image
+from PIL import Image, ImageSequence
+
+if __package__ in (None, ''):
+    # 在 tif_tools 資料夾中直接執行時，此檔名會遮蔽同名的套件，將專案根目錄加到搜尋路徑最前面
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tif_tools import tiff_index
+from tif_tools.tiff_writer import TILED_COMPRESSIONS, TiffWriter, tiled_compression_code
+from trace_tools.stage_trace import stage
+
+
+# 只能儲存二值(模式 '1')圖像的壓縮方法
+BILEVEL_COMPRESSIONS = ('group3', 'group4', 'tiff_ccitt')
+# JPEG 壓縮不支援的模式，及指定 JPEG 壓縮時的轉換目標
+JPEG_CONVERT_MODES = {'1': 'L', 'P': 'RGB'}
+
+
+def _fit_compression(img, compression, inherited):
+    """
+    確認壓縮方法適用於圖像的模式
+    指定的壓縮方法不適用時轉換圖像，例如 group4 轉為模式 '1'；
+    沿用原頁面的壓縮方法不適用時(例如 group4 頁面轉為 'L')改用 tiff_lzw
+    :param img: PIL 圖像
+    :param compression: PIL 的 tif 壓縮方法
+    :param inherited: 壓縮方法是否沿用原頁面
+    :return: (圖像, 壓縮方法)
+    """
+    if compression in BILEVEL_COMPRESSIONS:
+        target = '1' if img.mode != '1' else None
+    elif compression == 'jpeg':
+        target = JPEG_CONVERT_MODES.get(img.mode)
+    else:
+        target = None
+    if target is None:
+        return img, compression
+    if inherited:
+        return img, 'tiff_lzw'
+    with stage('convert', 'tif', mode=target) as span:
+        img = img.convert(target)
+        span.image(img)
+    return img, compression
 
 
 class TifTools:
-    def save_multipage_tiff(self, image_paths, output_path, compression='tiff_lzw', color_mode=None):
+    def save_multipage_tiff(self, image_paths, output_path, compression='tiff_lzw', color_mode=None, workers=None,
+                            use_process=False, tile_size=None, levels=None):
         """
         壓縮多個圖片成一個多頁的 tif 檔
+        逐頁讀取、轉換並寫入，頁面壓縮在執行緒池中平行進行，記憶體只保留等待寫入的頁面
         :param image_paths: 圖片檔案路徑列表
         :param output_path: 壓縮後的 tif 檔輸出路徑
-        :param compression: 壓縮方法，預設為 'tiff_lzw'
+        :param compression: 壓縮方法，預設為 'tiff_lzw'，可使用 'tiff_adobe_deflate'、'group4'
         :param color_mode: 位元深度轉換，根據PIL設定，例如 '1'、'L'、'RGB'、'RGBA'
+        :param workers: 壓縮使用的執行緒數，若為 None 則使用 CPU 核心數
+        :param use_process: 改用行程池壓縮，適合壓縮方法無法在執行緒中平行的情況
+        :param tile_size: 若指定則輸出分塊(tiled)並含縮小解析度層(SubIFDs)的金字塔 tif，壓縮方法僅支援 raw、LZW 與 Deflate
+        :param levels: 金字塔的縮小層數，若為 None 則縮小到整張圖小於一個 tile 為止
         """
-        if convert:
-            images = [Image.open(image_path).convert(color_mode) for image_path in image_paths]
-        else:
-            images = [Image.open(image_path) for image_path in image_paths]
-
-        # 轉換所有圖片到第一張圖片的模式和大小
-        images = [image.convert(images[0].mode).resize(images[0].size) for image in images]
-
-        # 儲存多頁tif
-        images[0].save(
-            output_path,
-            save_all=True,
-            append_images=images[1:],
-            compression=compression
-        )
+        mode, size = None, None
+        with TiffWriter(output_path, compression=compression, workers=workers, use_process=use_process,
+                        tile_size=tile_size, levels=levels) as writer:
+            for image_path in image_paths:
+                # 解碼後立即關閉來源檔案，頁面在背景壓縮時不會佔用檔案
+                with stage('decode', 'tif', path=image_path) as span:
+                    with Image.open(image_path) as image:
+                        image.load()
+                    span.image(image)
+                    span.file(image_path)
+                if color_mode:
+                    with stage('convert', 'tif', mode=color_mode) as span:
+                        image = image.convert(color_mode)
+                        span.image(image)
+                if mode is None:
+                    mode, size = image.mode, image.size
+
+                # 轉換所有圖片到第一張圖片的模式和大小
+                if image.mode != mode:
+                    with stage('convert', 'tif', mode=mode) as span:
+                        image = image.convert(mode)
+                        span.image(image)
+                if image.size != size:
+                    with stage('resize', 'tif') as span:
+                        image = image.resize(size)
+                        span.image(image)
+                writer.add_page(image)
 
         print(f"Multipage tif has been saved to {output_path}")
 
@@ -36,53 +95,125 @@ class TifTools:
         file_name, _ = os.path.splitext(file_name_with_ext)  # 去除副檔名
         return file_name
 
-    def split_all_page(self, path, folder_name="output"):
+    def split_all_page(self, path, folder_name="output", compression=None, color_mode=None, dpi=None, workers=None,
+                       tile_size=None, levels=None):
         """
         將多頁 tif 檔拆分並儲存為單頁 tif 檔
+        預設直接複製每頁的 IFD 標籤與 strip/tile 資料，不解碼像素，輸出與原頁面完全相同；
+        只有指定 compression、color_mode 或 tile_size 時才會解碼並重新編碼
         :param path: tif檔案路徑
         :param folder_name: 存儲資料夾名稱，如果不設定則自動命名並儲存至同一層 output 資料夾下
+        :param compression: 重新編碼的壓縮方法，例如 'tiff_lzw'、'group4'(會轉為模式 '1')，若為 None 則不重新編碼
+        :param color_mode: 重新編碼的顏色模式，例如 '1'、'L'，若為 None 則不重新編碼
+        :param dpi: 重新編碼時寫入的 dpi，例如 (600, 600)，若為 None 則沿用原頁面
+        :param workers: 平行寫入的執行緒數，若為 None 則使用 CPU 核心數
+        :param tile_size: 若指定則輸出分塊(tiled)並含縮小解析度層(SubIFDs)的金字塔 tif，
+                          壓縮方法僅支援 raw、LZW 與 Deflate，沿用原頁面的壓縮方法不支援時改用 LZW
+        :param levels: 金字塔的縮小層數，若為 None 則縮小到整張圖小於一個 tile 為止
+        :return: 輸出檔案路徑清單
         """
-        img = Image.open(path)
+        if tile_size and compression:
+            tiled_compression_code(compression)
         file_name = self._get_file_name(path)
 
         if not os.path.exists(folder_name):
             os.makedirs(folder_name)
 
-        for page in range(img.n_frames):
-            img.seek(page)
-            tmp_img = img.convert("1")
-            tmp_file_name = f"{file_name}_page{str(page + 1).zfill(3)}.tif"
-            save_path = os.path.join(folder_name, tmp_file_name)
-            tmp_img.save(save_path, dpi=(600, 600), compression="tiff_lzw")
-            print(save_path)
+        ifds = tifftools.read_tiff(path)["ifds"]
+        save_paths = [os.path.join(folder_name, f"{file_name}_page{str(page + 1).zfill(3)}.tif")
+                      for page in range(len(ifds))]
 
-    def process_single_page(self, path, page, show=False, save=False, output_path=""):
+        def copy_page(page):
+            with stage('copy', 'tif', page=page) as span:
+                tifftools.write_tiff(ifds[page], save_paths[page], allowExisting=True)
+                span.file(save_paths[page])
+            return save_paths[page]
+
+        def reencode_page(page):
+            with stage('decode', 'tif', page=page) as span:
+                img = Image.open(path)
+                img.seek(page)
+                img.load()
+                span.image(img)
+            if color_mode:
+                with stage('convert', 'tif', page=page, mode=color_mode) as span:
+                    tmp_img = img.convert(color_mode)
+                    span.image(tmp_img)
+            else:
+                tmp_img = img
+            tmp_img, page_compression = _fit_compression(tmp_img, compression or img.info.get("compression", "raw"),
+                                                         inherited=not compression)
+            if tile_size and page_compression not in TILED_COMPRESSIONS:
+                page_compression = "tiff_lzw"
+            params = {"compression": page_compression}
+            if dpi or "dpi" in img.info:
+                params["dpi"] = dpi or img.info["dpi"]
+            try:
+                if tile_size:
+                    with TiffWriter(save_paths[page], workers=1, tile_size=tile_size, levels=levels,
+                                    **params) as writer:
+                        writer.add_page(tmp_img)
+                else:
+                    with stage('encode', 'tif', page=page, compression=page_compression) as span:
+                        tmp_img.save(save_paths[page], **params)
+                        span.image(tmp_img)
+                        span.file(save_paths[page])
+            except Exception:
+                # 不留下寫到一半的頁面
+                if os.path.exists(save_paths[page]):
+                    os.remove(save_paths[page])
+                raise
+            return save_paths[page]
+
+        task = reencode_page if compression or color_mode or tile_size else copy_page
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for save_path in executor.map(task, range(len(ifds))):
+                print(save_path)
+        return save_paths
+
+    def process_single_page(self, path, page, show=False, save=False, output_path="", sidecar=False):
         """
-        查看或儲存單一頁面的 tif 圖片
+        查看或儲存單一頁面的 tif 圖片，透過 IFD 索引直接跳到指定頁面
         :param path: tif 檔案的路徑
         :param page: 指定想要處理的頁數
         :param show: 是否要顯示該頁，預設為False
         :param save: 是否要儲存該頁，預設為False
         :param output_path: 若儲存，儲存的資料夾路徑(不包含檔名)
+        :param sidecar: 是否將 IFD 索引存成 .ifdx 檔供之後的執行重複使用
         :return: 處理後的圖片物件
         """
         file_name = self._get_file_name(path)
-        img = Image.open(path)
-        img.seek(page)
+        with stage('open', 'tif', page=page) as span:
+            img = tiff_index.open_page(path, page, sidecar=sidecar)
+            span.image(img)
         if show:
             img.show()
         if save or output_path:
             tmp_file_name = f"{file_name}_page{str(page + 1).zfill(3)}.tif"
             save_path = os.path.join(output_path, tmp_file_name)  # 若未指定output_path，預設儲存在同層資料夾下
-            img.save(save_path, dpi=(600, 600), compression="tiff_lzw")
+            with stage('encode', 'tif', page=page, compression='tiff_lzw') as span:
+                img.save(save_path, dpi=(600, 600), compression="tiff_lzw")
+                span.file(save_path)
             print(save_path)
         return img
 
-    def merge_img_to_one_tif(self, folder_path, save_file_path):
+    def get_pages(self, path, indices, sidecar=False):
+        """
+        透過 IFD 索引一次取得多頁 tif 的多個指定頁面
+        :param path: tif 檔案的路徑
+        :param indices: 頁碼清單(從0開始)
+        :param sidecar: 是否將 IFD 索引存成 .ifdx 檔供之後的執行重複使用
+        :return: 圖片物件清單
+        """
+        return tiff_index.get_pages(path, indices, sidecar=sidecar)
+
+    def merge_img_to_one_tif(self, folder_path, save_file_path, tile_size=None, levels=None):
         """
         將資料夾下的所有圖片合成一張多幀TIF，合成多幀TIF是直接原圖合併成TIF檔，不受圖像尺寸限制
         :param folder_path: 資料夾路徑
         :param save_file_path: 儲存檔案的路徑
+        :param tile_size: 若指定則重新編碼為分塊(tiled)並含縮小解析度層(SubIFDs)的金字塔 tif
+        :param levels: 金字塔的縮小層數，若為 None 則縮小到整張圖小於一個 tile 為止
         :return: 儲存檔案的路徑
         """
         files = os.listdir(folder_path)  # 讀取資料夾內所有資料
@@ -92,8 +223,21 @@ class TifTools:
                 img_path = os.path.join(folder_path, file)
                 tif_files.append(img_path)
         tif_files.sort()
+        if tile_size:
+            with TiffWriter(save_file_path, compression='tiff_adobe_deflate', tile_size=tile_size,
+                            levels=levels) as writer:
+                for img_path in tif_files:
+                    with Image.open(img_path) as img:
+                        for frame in ImageSequence.Iterator(img):
+                            with stage('decode', 'tif', path=img_path) as span:
+                                frame = frame.copy()
+                                span.image(frame)
+                            writer.add_page(frame)
+            return save_file_path
         # tifftools合成多幀tif檔案，效率佳又不吃記憶體；Image.save()也可以儲存多幀tif，但效率相對較差
-        tifftools.tiff_concat(tif_files, save_file_path, overwrite=True)
+        with stage('concat', 'tif', files=len(tif_files)) as span:
+            tifftools.tiff_concat(tif_files, save_file_path, overwrite=True)
+            span.file(save_file_path)
         return save_file_path
 
 
@@ -0,0 +1,391 @@
+import functools
+import io
+import json
+import os
+import struct
+import zlib
+
+from PIL import Image
+
+from tif_tools.tiff_writer import TIFF_TYPE_FORMATS, OFFSET_TAGS, TiffWriter
+
+SIDECAR_SUFFIX = '.ifdx'
+TIFF_SIGNATURES = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+# BandReader 每次解碼的像素數上限
+MAX_BLOCK_PIXELS = 1 << 26
+# 過大的 strip 分段讀取時每段的列數
+STREAM_BLOCK_ROWS = 64
+
+
+def _read_header(fp):
+    """
+    讀取 tif 檔頭
+    :return: (位元組順序, 是否為 BigTIFF, 第一個 IFD 的位置)
+    """
+    fp.seek(0)
+    header = fp.read(16)
+    byte_order = '<' if header[:2] == b'II' else '>'
+    version, = struct.unpack_from(f'{byte_order}H', header, 2)
+    if version == 43:
+        return byte_order, True, struct.unpack_from(f'{byte_order}Q', header, 8)[0]
+    return byte_order, False, struct.unpack_from(f'{byte_order}L', header, 4)[0]
+
+
+def read_ifd_tags(fp, offset, byte_order, bigtiff=False):
+    """
+    從檔案讀取一個 IFD 的所有標籤，只 seek 到需要的位置，不載入整個檔案
+    :param fp: 以二進位模式開啟的 tif 檔案
+    :param offset: IFD 的位置
+    :param byte_order: struct 的位元組順序，'<' 或 '>'
+    :param bigtiff: 是否為 BigTIFF
+    :return: {tag: (datatype, values)}
+    """
+    count_format, entry_format, value_size = ('Q', 'HHQ8s', 8) if bigtiff else ('H', 'HHL4s', 4)
+    count_size = struct.calcsize(f'{byte_order}{count_format}')
+    entry_size = struct.calcsize(f'{byte_order}{entry_format}')
+    fp.seek(offset)
+    entry_count, = struct.unpack(f'{byte_order}{count_format}', fp.read(count_size))
+    entries = fp.read(entry_size * entry_count)
+    tags = {}
+    for i in range(entry_count):
+        tag, datatype, count, value = struct.unpack_from(f'{byte_order}{entry_format}', entries, entry_size * i)
+        value_format = TIFF_TYPE_FORMATS.get(datatype, 'B')
+        size = struct.calcsize(f'{byte_order}{value_format}') * count
+        if size <= value_size:
+            raw = value[:size]
+        else:
+            value_offset, = struct.unpack(f'{byte_order}{"Q" if bigtiff else "L"}', value)
+            fp.seek(value_offset)
+            raw = fp.read(size)
+        tags[tag] = (datatype, list(struct.unpack(f'{byte_order}{value_format * count}', raw)))
+    return tags
+
+
+def build_ifd_offsets(path):
+    """
+    沿著 IFD 鏈讀取每一頁 IFD 的位置，每頁只讀取標籤數量與下一頁指標，不解析標籤內容
+    :param path: tif 檔案路徑
+    :return: 每一頁 IFD 位置的清單
+    """
+    offsets, seen = [], set()
+    with open(path, 'rb') as fp:
+        byte_order, bigtiff, offset = _read_header(fp)
+        count_format, entry_size, next_format = ('Q', 20, 'Q') if bigtiff else ('H', 12, 'L')
+        count_size = struct.calcsize(f'{byte_order}{count_format}')
+        next_size = struct.calcsize(f'{byte_order}{next_format}')
+        while offset and offset not in seen:
+            offsets.append(offset)
+            seen.add(offset)
+            fp.seek(offset)
+            entry_count, = struct.unpack(f'{byte_order}{count_format}', fp.read(count_size))
+            fp.seek(offset + count_size + entry_size * entry_count)
+            offset, = struct.unpack(f'{byte_order}{next_format}', fp.read(next_size))
+    return offsets
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_ifd_offsets(path, mtime_ns, size, sidecar):
+    sidecar_path = path + SIDECAR_SUFFIX
+    if sidecar and os.path.exists(sidecar_path):
+        with open(sidecar_path, 'r') as file:
+            index = json.load(file)
+        if index.get('mtime_ns') == mtime_ns and index.get('size') == size:
+            return tuple(index['offsets'])
+
+    offsets = tuple(build_ifd_offsets(path))
+    if sidecar:
+        try:
+            with open(sidecar_path, 'w') as file:
+                json.dump({'mtime_ns': mtime_ns, 'size': size, 'offsets': offsets}, file)
+        except OSError:
+            # 唯讀的資料夾無法寫入索引檔，只使用行程內快取
+            pass
+    return offsets
+
+
+def ifd_offsets(path, sidecar=False):
+    """
+    取得 tif 每一頁 IFD 位置的索引，索引快取在行程內(LRU)，檔案的修改時間或大小改變時自動重建
+    :param path: tif 檔案路徑
+    :param sidecar: 是否同時將索引存成檔案旁的 .ifdx 檔，供其他行程重複使用
+    :return: 每一頁 IFD 位置的 tuple
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _cached_ifd_offsets(path, stat.st_mtime_ns, stat.st_size, sidecar)
+
+
+class _PageFile(io.RawIOBase):
+    """
+    包裝 tif 檔案，將檔頭中第一個 IFD 的位置改為指定頁面的 IFD，使 PIL 開啟時直接讀到該頁而不需走訪 IFD 鏈
+    """
+
+    def __init__(self, fp, ifd_offset):
+        super().__init__()
+        self._fp = fp
+        byte_order, bigtiff, _ = _read_header(fp)
+        self._pointer_start = 8 if bigtiff else 4
+        self._pointer = struct.pack(f'{byte_order}{"Q" if bigtiff else "L"}', ifd_offset)
+        fp.seek(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._fp.seek(offset, whence)
+
+    def tell(self):
+        return self._fp.tell()
+
+    def fileno(self):
+        # libtiff 解碼時會直接使用檔案描述符，並依 PIL 傳入的 IFD 位置切換頁面
+        return self._fp.fileno()
+
+    def readinto(self, buffer):
+        position = self._fp.tell()
+        size = self._fp.readinto(buffer)
+        pointer_end = self._pointer_start + len(self._pointer)
+        if size and position < pointer_end and position + size > self._pointer_start:
+            start = max(position, self._pointer_start)
+            end = min(position + size, pointer_end)
+            pointer_offset = start - self._pointer_start
+            buffer[start - position:end - position] = self._pointer[pointer_offset:pointer_offset + end - start]
+        return size
+
+
+def open_page(path, page, sidecar=False):
+    """
+    透過 IFD 索引直接開啟多頁 tif 的指定頁面，不需從第一頁依序 seek
+    :param path: tif 檔案路徑
+    :param page: 頁碼(從0開始)
+    :param sidecar: 是否使用 .ifdx 索引檔
+    :return: 已載入的 PIL 圖像
+    """
+    offsets = ifd_offsets(path, sidecar=sidecar)
+    if not 0 <= page < len(offsets):
+        raise IndexError(f'頁碼 {page} 超出範圍，檔案共 {len(offsets)} 頁。')
+    with open(path, 'rb') as fp:
+        img = Image.open(_PageFile(fp, offsets[page]))
+        img.load()
+    return img
+
+
+def get_pages(path, indices, sidecar=False):
+    """
+    一次取得多頁 tif 的多個指定頁面
+    :param path: tif 檔案路徑
+    :param indices: 頁碼清單(從0開始)
+    :param sidecar: 是否使用 .ifdx 索引檔
+    :return: 已載入的 PIL 圖像清單
+    """
+    return [open_page(path, page, sidecar=sidecar) for page in indices]
+
+
+class _DeflateRows:
+    """
+    逐列解壓縮 Deflate 壓縮的 strip，每次只保留要求的列，往前讀取時從該 strip 的開頭重新解壓縮
+    """
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, path, offsets, byte_counts, rows_per_strip, row_bytes):
+        self.path = path
+        self.offsets = offsets
+        self.byte_counts = byte_counts
+        self.rows_per_strip = rows_per_strip
+        self.row_bytes = row_bytes
+        self._strip = None
+
+    def _restart(self, strip):
+        self._strip = strip
+        self._row = 0
+        self._position = self.offsets[strip]
+        self._remaining = self.byte_counts[strip]
+        self._decompressor = zlib.decompressobj()
+
+    def _decompress(self, fp, size):
+        # 以 max_length 限制每次輸出的大小，高壓縮比的空白區域也不會一次展開
+        output = bytearray()
+        while len(output) < size:
+            data = self._decompressor.unconsumed_tail
+            if not data:
+                if not self._remaining:
+                    break
+                fp.seek(self._position)
+                data = fp.read(min(self.CHUNK_SIZE, self._remaining))
+                self._position += len(data)
+                self._remaining -= len(data)
+            output += self._decompressor.decompress(data, size - len(output))
+        return output
+
+    def read(self, top, bottom):
+        """
+        :return: 第 top 列到第 bottom 列(不含)的未壓縮資料
+        """
+        output = bytearray()
+        with open(self.path, 'rb') as fp:
+            row = top
+            while row < bottom:
+                strip = row // self.rows_per_strip
+                first = row - strip * self.rows_per_strip
+                last = min(bottom - strip * self.rows_per_strip, self.rows_per_strip)
+                if self._strip != strip or self._row > first:
+                    self._restart(strip)
+                skip = (first - self._row) * self.row_bytes
+                while skip > 0:
+                    skipped = len(self._decompress(fp, min(skip, self.CHUNK_SIZE)))
+                    if not skipped:
+                        break
+                    skip -= skipped
+                rows = self._decompress(fp, (last - first) * self.row_bytes)
+                if len(rows) < (last - first) * self.row_bytes:
+                    raise ValueError(f'{self.path} 的 strip {strip} 資料不完整。')
+                output += rows
+                self._row = last
+                row = strip * self.rows_per_strip + last
+        return bytes(output)
+
+
+class BandReader:
+    """
+    依列範圍讀取大圖的一部分，供超大掃描檔分段處理，每次解碼的像素數不超過 max_block_pixels
+    未分平面(PlanarConfiguration=1)的 strip 或 tile tif 只讀取並解碼涵蓋該範圍的 strip/tile：
+    將這些已壓縮的資料複製到記憶體中的小型 tif 再交給 PIL 解碼。
+    單一 strip 超過上限時(例如整張圖只有一個 strip)，未壓縮與 Deflate(無 predictor)的 strip 以 STREAM_BLOCK_ROWS 列為單位逐段讀取，
+    其他壓縮方法無法只解碼部分列，會拋出 ValueError；其他格式(png、jpg、分平面的 tif)只能整張載入，超過上限時同樣拋出 ValueError，
+    需先轉存為多 strip 或分塊的 tif
+    """
+
+    def __init__(self, path, page=0, sidecar=False, max_block_pixels=MAX_BLOCK_PIXELS):
+        """
+        :param path: 圖片檔案路徑
+        :param page: 多頁 tif 的頁碼(從0開始)
+        :param sidecar: 是否使用 .ifdx 索引檔
+        :param max_block_pixels: 每次解碼的像素數上限
+        """
+        self.path = path
+        self._tags = None
+        self._image = None
+        self._rows = None
+        with open(path, 'rb') as fp:
+            if fp.read(4) in TIFF_SIGNATURES:
+                byte_order, bigtiff, _ = _read_header(fp)
+                tags = read_ifd_tags(fp, ifd_offsets(path, sidecar=sidecar)[page], byte_order, bigtiff)
+                if self._can_stream(tags, byte_order):
+                    self._tags = tags
+
+        if self._tags is None:
+            self._image = Image.open(path)
+            if page:
+                self._image.seek(page)
+            self.size = self._image.size
+            self.block_height = self.size[1]
+            if self.size[0] * self.size[1] > max_block_pixels:
+                self._image.close()
+                raise ValueError(f'{path} 無法分段讀取，整張圖 {self.size[0]}x{self.size[1]} 超過 {max_block_pixels} 像素的上限，'
+                                 f'請先轉存為多 strip 或分塊(tiled)的 tif。')
+            return
+        self.size = (self._tags[256][1][0], self._tags[257][1][0])
+        if 322 in self._tags:
+            self._offset_tag = 324
+            self.block_height = self._tags[323][1][0]
+            self._blocks_per_row = -(-self.size[0] // self._tags[322][1][0])
+            if self._tags[322][1][0] * self.block_height > max_block_pixels:
+                raise ValueError(f'{path} 的 tile 超過 {max_block_pixels} 像素的上限。')
+        else:
+            self._offset_tag = 273
+            self.block_height = min(self._tags.get(278, (4, [self.size[1]]))[1][0], self.size[1])
+            self._blocks_per_row = 1
+            if self.size[0] * self.block_height > max_block_pixels:
+                self._split_strips()
+
+    @staticmethod
+    def _can_stream(tags, byte_order):
+        if tags.get(284, (3, [1]))[1][0] != 1 or not (273 in tags or 324 in tags):
+            return False
+        # 資料會被複製到 little-endian 的 tif 中，big-endian 的多位元組樣本無法直接沿用
+        return byte_order == '<' or max(tags.get(258, (3, [1]))[1]) <= 8
+
+    def _split_strips(self):
+        """
+        將過大的 strip 改以 STREAM_BLOCK_ROWS 列為單位讀取
+        """
+        compression = self._tags.get(259, (3, [1]))[1][0]
+        predictor = self._tags.get(317, (3, [1]))[1][0]
+        row_bytes = -(-self.size[0] * sum(self._tags.get(258, (3, [1]))[1]) // 8)
+        offsets, byte_counts = self._tags[273][1], self._tags[279][1]
+        rows_per_strip = self.block_height
+        if compression == 1:
+            # 未壓縮的 strip 中每一列的位置固定，直接切成較小的 strip
+            strips = []
+            for strip, offset in enumerate(offsets):
+                strip_rows = min(rows_per_strip, self.size[1] - strip * rows_per_strip)
+                strips += [(offset + row * row_bytes, min(STREAM_BLOCK_ROWS, strip_rows - row) * row_bytes)
+                           for row in range(0, strip_rows, STREAM_BLOCK_ROWS)]
+            self._tags[273] = (4, [offset for offset, _ in strips])
+            self._tags[279] = (4, [count for _, count in strips])
+            self._tags[278] = (4, [STREAM_BLOCK_ROWS])
+        elif compression in (8, 32946) and predictor == 1:
+            self._rows = _DeflateRows(self.path, offsets, byte_counts, rows_per_strip, row_bytes)
+        else:
+            raise ValueError(f'{self.path} 的 strip 有 {rows_per_strip} 列，超過每次解碼的像素上限，'
+                             f'壓縮方法 {compression} 無法只解碼部分列，請先轉存為多 strip 或分塊(tiled)的 tif。')
+        self.block_height = min(STREAM_BLOCK_ROWS, self.size[1])
+
+    def _read_blocks(self, first, last):
+        top = first * self.block_height
+        height = min(last * self.block_height, self.size[1]) - top
+        tags = {tag: value for tag, value in self._tags.items() if tag not in (273, 279, 324, 325, 330)}
+        tags[257] = (4, [height])
+        if self._rows is not None:
+            # 逐列解壓縮的資料以未壓縮的 strip 交給 PIL
+            blocks = [self._rows.read(top, top + height)]
+            tags.pop(317, None)
+            tags[259] = (3, [1])
+            tags[278] = (4, [height])
+        else:
+            count_tag = OFFSET_TAGS[self._offset_tag]
+            start, end = first * self._blocks_per_row, last * self._blocks_per_row
+            offsets = self._tags[self._offset_tag][1][start:end]
+            byte_counts = self._tags[count_tag][1][start:end]
+            blocks = []
+            with open(self.path, 'rb') as fp:
+                for offset, count in zip(offsets, byte_counts):
+                    fp.seek(offset)
+                    blocks.append(fp.read(count))
+
+        buffer = io.BytesIO()
+        writer = TiffWriter(buffer, workers=1)
+        writer.write_raw_page(tags, blocks)
+        img = Image.open(io.BytesIO(buffer.getvalue()))
+        img.load()
+        writer.close()
+        return img
+
+    def read_rows(self, top, bottom):
+        """
+        讀取第 top 列到第 bottom 列(不含)的圖像
+        :param top: 起始列
+        :param bottom: 結束列(不含)
+        :return: PIL 圖像，模式與原始檔案相同
+        """
+        top, bottom = max(0, top), min(self.size[1], bottom)
+        if self._image is not None:
+            return self._image.crop((0, top, self.size[0], bottom))
+        first = top // self.block_height
+        last = -(-bottom // self.block_height)
+        img = self._read_blocks(first, last)
+        offset = first * self.block_height
+        return img.crop((0, top - offset, self.size[0], bottom - offset))
+
+    def close(self):
+        if self._image is not None:
+            self._image.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
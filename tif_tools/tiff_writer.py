@@ -0,0 +1,364 @@
+import io
+import math
+import os
+import struct
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+if __package__ in (None, ''):
+    # 從 tif_tools 資料夾中以 tiff_writer 模組名稱載入時，將專案根目錄加入搜尋路徑以載入 trace_tools
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trace_tools.stage_trace import stage
+
+# tif 資料型態對應的 struct 格式，RATIONAL 類型由兩個整數組成
+TIFF_TYPE_FORMATS = {1: 'B', 2: 'B', 3: 'H', 4: 'L', 5: 'LL', 6: 'b', 7: 'B', 8: 'h', 9: 'l', 10: 'll', 11: 'f',
+                     12: 'd', 13: 'L', 16: 'Q', 17: 'q', 18: 'Q'}
+# 資料偏移量標籤與其對應的位元組數標籤：StripOffsets/StripByteCounts、TileOffsets/TileByteCounts
+OFFSET_TAGS = {273: 279, 324: 325}
+CLASSIC_TIFF_LIMIT = 2 ** 32 - 1
+# 分塊輸出自行壓縮每個 tile，支援不壓縮(1)、LZW(5)與 Adobe Deflate(8)
+TILED_COMPRESSIONS = {None: 1, 'raw': 1, 'tiff_lzw': 5, 'tiff_adobe_deflate': 8, 'tiff_deflate': 8}
+# PIL 模式對應 (BitsPerSample, PhotometricInterpretation, ExtraSamples)
+TILED_MODES = {'1': ([1], 1, None), 'L': ([8], 1, None), 'RGB': ([8, 8, 8], 2, None),
+               'RGBA': ([8, 8, 8, 8], 2, [2])}
+
+
+def read_ifd(data, offset, byte_order):
+    """
+    解析記憶體中 classic tif 的一個 IFD
+    :param data: tif 檔案內容
+    :param offset: IFD 的位置
+    :param byte_order: struct 的位元組順序，'<' 或 '>'
+    :return: ({tag: (datatype, values)}, 下一個 IFD 的位置)
+    """
+    entry_count, = struct.unpack_from(f'{byte_order}H', data, offset)
+    tags = {}
+    for i in range(entry_count):
+        tag, datatype, count, value = struct.unpack_from(f'{byte_order}HHL4s', data, offset + 2 + 12 * i)
+        value_format = TIFF_TYPE_FORMATS.get(datatype, 'B')
+        size = struct.calcsize(f'{byte_order}{value_format}') * count
+        if size <= 4:
+            raw = value[:size]
+        else:
+            value_offset, = struct.unpack(f'{byte_order}L', value)
+            raw = data[value_offset:value_offset + size]
+        tags[tag] = (datatype, list(struct.unpack(f'{byte_order}{value_format * count}', raw)))
+    next_offset, = struct.unpack_from(f'{byte_order}L', data, offset + 2 + 12 * entry_count)
+    return tags, next_offset
+
+
+def encode_page(img, compression='tiff_lzw', **save_params):
+    """
+    將單一頁面壓縮成單頁 tif 的位元組，供 TiffWriter 在執行緒或行程中平行呼叫
+    :param img: PIL 圖像
+    :param compression: PIL 的 tif 壓縮方法，例如 'tiff_lzw'、'tiff_adobe_deflate'、'group4'
+    :param save_params: 其他傳給 Image.save 的參數，例如 dpi
+    :return: 單頁 tif 的位元組
+    """
+    if compression == 'group4' and img.mode != '1':
+        with stage('convert', 'tif', mode='1') as span:
+            img = img.convert('1')
+            span.image(img)
+    if 'dpi' not in save_params and 'dpi' in img.info:
+        save_params['dpi'] = img.info['dpi']
+    with stage('encode', 'tif', compression=compression) as span:
+        buffer = io.BytesIO()
+        img.save(buffer, format='TIFF', compression=compression, **save_params)
+        span.image(img)
+        span.add(bytes=buffer.tell())
+    return buffer.getvalue()
+
+
+def _tiled_ifd_tags(img, compression_code, tile_size, subfile_type, dpi):
+    bits, photometric, extra_samples = TILED_MODES[img.mode]
+    tags = {
+        254: (4, [subfile_type]),
+        256: (4, [img.width]),
+        257: (4, [img.height]),
+        258: (3, bits),
+        259: (3, [compression_code]),
+        262: (3, [photometric]),
+        277: (3, [len(bits)]),
+        284: (3, [1]),
+        322: (3, [tile_size]),
+        323: (3, [tile_size]),
+    }
+    if extra_samples:
+        tags[338] = (3, extra_samples)
+    if dpi:
+        tags[282] = (5, [round(dpi[0] * 100), 100])
+        tags[283] = (5, [round(dpi[1] * 100), 100])
+        tags[296] = (3, [2])
+    return tags
+
+
+def tiled_compression_code(compression):
+    """
+    :param compression: PIL 的 tif 壓縮方法
+    :return: 分塊輸出使用的 tif 壓縮代號，不支援的壓縮方法會拋出 ValueError
+    """
+    if compression not in TILED_COMPRESSIONS:
+        supported = ', '.join(name for name in TILED_COMPRESSIONS if name)
+        raise ValueError(f'分塊輸出不支援壓縮方法 {compression}，僅支援 {supported}。')
+    return TILED_COMPRESSIONS[compression]
+
+
+def _compress_lzw_tile(tile):
+    # 以 libtiff 將單一 tile 編碼為只有一個 strip 的 tif，該 strip 即為 LZW 壓縮的 tile 資料
+    buffer = io.BytesIO()
+    tile.save(buffer, format='TIFF', compression='tiff_lzw', tiffinfo={278: tile.height})
+    data = buffer.getvalue()
+    tags, _ = read_ifd(data, struct.unpack_from('<L', data, 4)[0], '<')
+    offset, count = tags[273][1][0], tags[279][1][0]
+    return data[offset:offset + count]
+
+
+def pyramid_levels(img, tile_size=256, levels=None):
+    """
+    產生金字塔的各層圖像，每層都是上一層縮小一半的結果
+    :param img: PIL 圖像
+    :param tile_size: tile 邊長
+    :param levels: 縮小層數(2x、4x、8x…)，若為 None 則縮小到整張圖小於一個 tile 為止
+    :return: 各層圖像清單，第一層為原始解析度
+    """
+    if img.mode not in TILED_MODES:
+        img = img.convert('RGB')
+    if levels is None:
+        levels = max(0, math.ceil(math.log2(max(img.size) / tile_size)))
+    images = [img]
+    for level in range(1, levels + 1):
+        # 二值圖縮小後以灰階儲存，縮圖才不會失真
+        with stage('resize', 'tif', level=level) as span:
+            img = (img.convert('L') if img.mode == '1' else img).reduce(2)
+            span.image(img)
+        images.append(img)
+    return images
+
+
+def encode_tiled_level(img, compression='tiff_adobe_deflate', tile_size=256, level=0, dpi=None):
+    """
+    將金字塔的一層壓縮成 tile，各層互相獨立，可在執行緒或行程中平行呼叫
+    :param img: 此層的 PIL 圖像
+    :param compression: 壓縮方法，支援 'raw'、'tiff_lzw' 與 'tiff_adobe_deflate'
+    :param tile_size: tile 邊長，需為 16 的倍數
+    :param level: 層級，0 為原始解析度
+    :param dpi: 原始解析度的 dpi，縮小層會依比例換算
+    :return: (標籤, tile 資料清單)
+    """
+    compression_code = tiled_compression_code(compression)
+    level_dpi = (dpi[0] / 2 ** level, dpi[1] / 2 ** level) if dpi else None
+    tags = _tiled_ifd_tags(img, compression_code, tile_size, 1 if level else 0, level_dpi)
+    with stage('encode', 'tif', compression=compression, level=level, tile_size=tile_size) as span:
+        tiles = []
+        for y in range(0, img.height, tile_size):
+            for x in range(0, img.width, tile_size):
+                # 邊緣 tile 需補滿完整大小
+                tile = img.crop((x, y, x + tile_size, y + tile_size))
+                if compression_code == 5:
+                    tiles.append(_compress_lzw_tile(tile))
+                elif compression_code == 8:
+                    tiles.append(zlib.compress(tile.tobytes()))
+                else:
+                    tiles.append(tile.tobytes())
+        if span:
+            span.image(img)
+            span.add(bytes=sum(map(len, tiles)))
+    return tags, tiles
+
+
+def encode_tiled_page(img, compression='tiff_adobe_deflate', tile_size=256, levels=None, dpi=None):
+    """
+    將單一頁面依序壓縮成分塊(tiled)的多解析度金字塔；TiffWriter 則將各層分別交給執行緒池或行程池平行壓縮
+    :param img: PIL 圖像
+    :param compression: 壓縮方法，支援 'raw'、'tiff_lzw' 與 'tiff_adobe_deflate'
+    :param tile_size: tile 邊長，需為 16 的倍數
+    :param levels: 縮小層數(2x、4x、8x…)，若為 None 則縮小到整張圖小於一個 tile 為止
+    :param dpi: 寫入的 dpi，若為 None 則沿用圖像的 dpi
+    :return: 各層的 (標籤, tile 資料清單)，第一層為原始解析度
+    """
+    tiled_compression_code(compression)
+    dpi = dpi or img.info.get('dpi')
+    return [encode_tiled_level(level_img, compression, tile_size, level, dpi)
+            for level, level_img in enumerate(pyramid_levels(img, tile_size, levels))]
+
+
+class TiffWriter:
+    """
+    逐頁寫入的多頁 tif 產生器
+    每頁在執行緒池或行程池中壓縮，完成後依加入順序寫入該頁的 strip 與 IFD 並釋放，記憶體只保留等待寫入的頁面
+    """
+
+    def __init__(self, file_path, compression='tiff_lzw', workers=None, use_process=False, max_pending=None,
+                 tile_size=None, levels=None, **save_params):
+        """
+        :param file_path: 輸出 tif 路徑，也可傳入可讀寫的檔案物件(例如 io.BytesIO)
+        :param compression: 壓縮方法，預設為 'tiff_lzw'，可使用 'tiff_adobe_deflate'、'group4' 等 PIL 支援的方法
+        :param tile_size: 若指定則輸出分塊(tiled) tif，並將縮小的解析度層寫入 SubIFDs，壓縮方法僅支援 raw、LZW 與 Deflate
+        :param levels: 分塊輸出時的縮小層數，若為 None 則縮小到整張圖小於一個 tile 為止
+        :param workers: 壓縮使用的執行緒或行程數，若為 None 則使用 CPU 核心數
+        :param use_process: 是否使用行程池，預設使用執行緒池
+        :param max_pending: 最多同時等待寫入的頁數，若為 None 則為 workers 的兩倍
+        :param save_params: 其他傳給 Image.save 的參數，例如 dpi
+        """
+        if tile_size:
+            tiled_compression_code(compression)
+        self.file_path = file_path
+        self.compression = compression
+        self.save_params = save_params
+        self.tile_size = tile_size
+        self.levels = levels
+        self.page_count = 0
+        workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or workers * 2
+        executor_class = ProcessPoolExecutor if use_process else ThreadPoolExecutor
+        self._executor = executor_class(max_workers=workers)
+        self._pending = deque()
+
+        self._file = file_path if hasattr(file_path, 'write') else open(file_path, 'w+b')
+        self._file.write(b'II*\x00\x00\x00\x00\x00')
+        # 上一個 IFD 中「下一個 IFD 位置」欄位所在的位置，第一頁則填入檔頭
+        self._next_ifd_pointer = 4
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_page(self, img):
+        """
+        加入一頁，頁面會在背景壓縮，並依加入順序寫入檔案；分塊輸出時金字塔的每一層各自平行壓縮
+        :param img: PIL 圖像
+        """
+        if self.tile_size:
+            dpi = self.save_params.get('dpi') or img.info.get('dpi')
+            futures = [self._executor.submit(encode_tiled_level, level_img, self.compression, self.tile_size, level,
+                                             dpi)
+                       for level, level_img in enumerate(pyramid_levels(img, self.tile_size, self.levels))]
+        else:
+            futures = [self._executor.submit(encode_page, img, self.compression, **self.save_params)]
+        self._pending.append(futures)
+        while self._pending and (len(self._pending) > self.max_pending
+                                 or all(future.done() for future in self._pending[0])):
+            self._write_result(self._pending.popleft())
+
+    def _write_result(self, futures):
+        results = [future.result() for future in futures]
+        if self.tile_size:
+            return self.write_tiled_page(results)
+        return self.write_encoded_page(results[0])
+
+    def _align(self):
+        # tif 規範要求資料位置為偶數
+        if self._file.tell() % 2:
+            self._file.write(b'\x00')
+
+    def write_encoded_page(self, page_data):
+        """
+        將 encode_page 產生的單頁 tif 附加到檔案末端：先寫入影像資料，再寫入 IFD，最後回填上一頁的 IFD 指標
+        :param page_data: 單頁 tif 的位元組
+        :return: 此頁 IFD 的位置
+        """
+        byte_order = '<' if page_data[:2] == b'II' else '>'
+        first_ifd, = struct.unpack_from(f'{byte_order}L', page_data, 4)
+        tags, _ = read_ifd(page_data, first_ifd, byte_order)
+        with stage('write', 'tif', bytes=len(page_data)):
+            self._file.seek(0, os.SEEK_END)
+
+            for offset_tag, count_tag in OFFSET_TAGS.items():
+                if offset_tag not in tags:
+                    continue
+                offsets = []
+                for offset, count in zip(tags[offset_tag][1], tags[count_tag][1]):
+                    self._align()
+                    offsets.append(self._file.tell())
+                    self._file.write(page_data[offset:offset + count])
+                tags[offset_tag] = (4, offsets)
+            return self.write_ifd(tags)
+
+    def _write_tiles(self, tiles):
+        offsets = []
+        for tile in tiles:
+            self._align()
+            offsets.append(self._file.tell())
+            self._file.write(tile)
+        return (4, offsets), (4, [len(tile) for tile in tiles])
+
+    def write_raw_page(self, tags, blocks):
+        """
+        直接寫入已壓縮的 strip 或 tile 資料與其標籤，不重新編碼
+        :param tags: {tag: (datatype, values)}，含 TileWidth 時視為 tile，否則為 strip
+        :param blocks: 已壓縮的 strip 或 tile 資料清單
+        :return: 此頁 IFD 的位置
+        """
+        self._file.seek(0, os.SEEK_END)
+        offset_tag = 324 if 322 in tags else 273
+        tags[offset_tag], tags[OFFSET_TAGS[offset_tag]] = self._write_tiles(blocks)
+        return self.write_ifd(tags)
+
+    def write_tiled_page(self, levels):
+        """
+        寫入 encode_tiled_page 產生的金字塔頁面：縮小的各層寫成 SubIFD，原始解析度的 IFD 串接到上一頁之後
+        :param levels: 各層的 (標籤, tile 資料清單)
+        :return: 此頁 IFD 的位置
+        """
+        with stage('write', 'tif') as span:
+            self._file.seek(0, os.SEEK_END)
+            sub_ifds = []
+            for tags, tiles in levels[1:]:
+                tags[324], tags[325] = self._write_tiles(tiles)
+                sub_ifds.append(self.write_ifd(tags, chain=False))
+            tags, tiles = levels[0]
+            tags[324], tags[325] = self._write_tiles(tiles)
+            if sub_ifds:
+                tags[330] = (13, sub_ifds)
+            if span:
+                span.add(bytes=sum(len(tile) for _, level_tiles in levels for tile in level_tiles))
+            return self.write_ifd(tags)
+
+    def write_ifd(self, tags, chain=True):
+        """
+        於檔案末端寫入一個 IFD，並串接到上一頁之後
+        :param tags: {tag: (datatype, values)}
+        :param chain: 是否串接到頁面的 IFD 鏈，SubIFD 不串接
+        :return: 此 IFD 的位置
+        """
+        self._file.seek(0, os.SEEK_END)
+        entries = []
+        for tag in sorted(tags):
+            datatype, values = tags[tag]
+            value_format = TIFF_TYPE_FORMATS.get(datatype, 'B')
+            count = len(values) // len(value_format)
+            raw = struct.pack(f'<{value_format * count}', *values)
+            if len(raw) > 4:
+                self._align()
+                position = self._file.tell()
+                self._file.write(raw)
+                raw = struct.pack('<L', position)
+            entries.append(struct.pack('<HHL', tag, datatype, count) + raw.ljust(4, b'\x00'))
+
+        self._align()
+        ifd_offset = self._file.tell()
+        if ifd_offset + 6 + 12 * len(entries) > CLASSIC_TIFF_LIMIT:
+            raise ValueError('tif 檔案超過 4GB，classic tif 無法儲存。')
+        self._file.write(struct.pack('<H', len(entries)) + b''.join(entries) + b'\x00\x00\x00\x00')
+        if not chain:
+            return ifd_offset
+
+        self._file.seek(self._next_ifd_pointer)
+        self._file.write(struct.pack('<L', ifd_offset))
+        self._next_ifd_pointer = ifd_offset + 2 + 12 * len(entries)
+        self.page_count += 1
+        return ifd_offset
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            while self._pending:
+                self._write_result(self._pending.popleft())
+        finally:
+            self._executor.shutdown()
+            self._file.close()
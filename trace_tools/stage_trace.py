@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+import time
+
+# 設定此環境變數為輸出路徑即啟用追蹤，副檔名 .jsonl 輸出 JSON lines，其他輸出 Chrome trace(可在 chrome://tracing 或 Perfetto 開啟)
+TRACE_ENV = 'IMGTOOLS_TRACE'
+
+_writer = None
+
+
+class _NullSpan:
+    """
+    未啟用追蹤時 stage 回傳的共用物件，所有方法都不做任何事
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def add(self, **fields):
+        pass
+
+    def image(self, img):
+        pass
+
+    def file(self, path):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """
+    一個階段的計時區間，離開 with 區塊時寫出一筆事件
+    """
+    __slots__ = ('name', 'category', 'args', '_ts', '_start')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        # ts 使用牆上時鐘使多個行程的事件可對齊，耗時則以 perf_counter 計算
+        self._ts = time.time_ns() // 1000
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        writer = _writer
+        if writer:
+            writer.write({'name': self.name, 'cat': self.category, 'ph': 'X', 'ts': self._ts,
+                          'dur': round(duration * 1e6, 1), 'pid': os.getpid(), 'tid': threading.get_ident(),
+                          'args': self.args})
+        return False
+
+    def __bool__(self):
+        return True
+
+    def add(self, **fields):
+        """
+        附加欄位到事件，數值欄位會累加，例如 add(bytes=1024)
+        """
+        for key, value in fields.items():
+            if isinstance(value, (int, float)) and isinstance(self.args.get(key), (int, float)):
+                self.args[key] += value
+            else:
+                self.args[key] = value
+
+    def image(self, img):
+        """
+        記錄 PIL 圖像的像素數、尺寸與模式
+        """
+        self.add(pixels=img.width * img.height)
+        self.args['size'] = list(img.size)
+        self.args['mode'] = img.mode
+
+    def file(self, path):
+        """
+        記錄檔案大小
+        """
+        try:
+            self.add(bytes=os.path.getsize(path))
+        except (OSError, TypeError):
+            pass
+
+
+class _TraceWriter:
+    """
+    以附加模式寫入事件，多個行程可同時寫入同一個檔案
+    Chrome trace 的 JSON 陣列允許省略結尾的 ]，因此每筆事件都可以獨立附加，中斷時已寫入的事件仍可讀取
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.chrome = not path.lower().endswith('.jsonl')
+        self._lock = threading.Lock()
+        # 以 O_APPEND 開啟，每筆事件一次寫入，多個行程的事件不會交錯
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if self.chrome and os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, b'[\n')
+
+    def write(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str) + (',\n' if self.chrome else '\n')
+        with self._lock:
+            os.write(self._fd, line.encode('utf-8'))
+
+    def close(self):
+        os.close(self._fd)
+
+
+def enable(path):
+    """
+    啟用追蹤並將事件寫入指定檔案，同時設定環境變數，之後啟動的子行程也會寫入同一個檔案
+    :param path: 輸出路徑，副檔名 .jsonl 為 JSON lines，其他為 Chrome trace
+    """
+    global _writer
+    disable()
+    path = os.path.abspath(path)
+    os.environ[TRACE_ENV] = path
+    _writer = _TraceWriter(path)
+
+
+def disable():
+    """
+    停止追蹤
+    """
+    global _writer
+    if _writer:
+        _writer.close()
+    _writer = None
+
+
+def enabled():
+    return _writer is not None
+
+
+def stage(name, category='imgtools', **args):
+    """
+    標記一個處理階段，例如
+        with stage('decode', path=path) as span:
+            img = Image.open(path)
+            span.image(img)
+    未啟用追蹤時回傳不做任何事的共用物件；需要額外計算的欄位可用 if span: 判斷後再計算
+    :param name: 階段名稱，例如 decode、convert、resize、encode、write
+    :param category: 事件分類，通常為工具名稱
+    :param args: 附加到事件的欄位
+    :return: 可用於 with 的區間物件
+    """
+    if _writer is None:
+        return _NULL_SPAN
+    return _Span(name, category, args)
+
+
+def load_events(path):
+    """
+    讀取追蹤檔案中的事件，可讀取兩種格式以及中斷時未完成的檔案
+    :param path: 追蹤檔案路徑
+    :return: 事件 dict 清單
+    """
+    events = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip().rstrip(',')
+            if not line or line in ('[', ']'):
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return events
+
+
+def summarize(path):
+    """
+    依階段彙總追蹤檔案
+    :param path: 追蹤檔案路徑
+    :return: {(分類, 名稱): {'count', 'seconds', 'bytes', 'pixels'}}，依總耗時由大到小排序
+    """
+    totals = {}
+    for event in load_events(path):
+        total = totals.setdefault((event.get('cat'), event['name']),
+                                  {'count': 0, 'seconds': 0.0, 'bytes': 0, 'pixels': 0})
+        total['count'] += 1
+        total['seconds'] += event.get('dur', 0) / 1e6
+        args = event.get('args', {})
+        total['bytes'] += args.get('bytes', 0) if isinstance(args.get('bytes'), int) else 0
+        total['pixels'] += args.get('pixels', 0) if isinstance(args.get('pixels'), int) else 0
+    return dict(sorted(totals.items(), key=lambda item: -item[1]['seconds']))
+
+
+if os.environ.get(TRACE_ENV):
+    _writer = _TraceWriter(os.environ[TRACE_ENV])
+
+
+if __name__ == '__main__':
+    import sys
+
+    # 使用方式: python trace_tools/stage_trace.py trace.json
+    for (category, name), total in summarize(sys.argv[1]).items():
+        print(f"{category:<16} {name:<20} {total['count']:>6} 次 {total['seconds']:>9.3f}s "
+              f"{total['bytes'] / 1e6:>9.1f} MB {total['pixels'] / 1e6:>9.1f} MP")
@@ -1,24 +1,161 @@
+import functools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
 from PIL import Image, ImageDraw, ImageFont
 
+if __package__ in (None, ''):
+    # 在 watermark 資料夾中直接執行時，將專案根目錄加入搜尋路徑以載入 trace_tools
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trace_tools.stage_trace import stage
+
+FONT_PATH = "msjhbd.ttc"
+
+
+@functools.lru_cache(maxsize=16)
+def load_font(font_path, font_size):
+    """
+    載入字體，相同的字體與大小只會從硬碟讀取一次
+    """
+    return ImageFont.truetype(font_path, font_size)
+
+
+@functools.lru_cache(maxsize=32)
+def watermark_layer(watermark_text, canvas_size, position, font_size, rotation, font_path=FONT_PATH,
+                    fill=(0, 0, 0, 100)):
+    """
+    產生旋轉後的浮水印圖層，並只保留文字的外接矩形，相同參數的結果會被快取重複使用
+    圖層的繪製與旋轉方式與整張圖層相同，因此合成結果與直接貼上整張旋轉圖層完全一致
+    :param watermark_text: 浮水印文字
+    :param canvas_size: 原始圖像尺寸 (寬, 高)
+    :param position: 文字位置
+    :param font_size: 字體大小
+    :param rotation: 旋轉角度
+    :param font_path: 字體文件的路徑
+    :param fill: 文字顏色(RGBA)
+    :return: (裁切後的圖層, 貼上位置)，若沒有可見的文字則為 (None, None)
+    """
+    with stage('render_layer', 'watermark', font_size=font_size, rotation=rotation) as span:
+        # 創建一個新的透明圖層，大小與原始圖像相同
+        txt_layer = Image.new("RGBA", canvas_size, (255, 255, 255, 0))
+
+        # 在新圖層上繪製水印文字
+        draw = ImageDraw.Draw(txt_layer)
+        draw.text(position, watermark_text, font=load_font(font_path, font_size), fill=fill)
+
+        # 旋轉浮水印圖層
+        txt_layer = txt_layer.rotate(rotation, resample=Image.BICUBIC, expand=1)
+        span.image(txt_layer)
+
+    # 計算旋轉後的圖層與基本圖像的偏移量
+    offset_x = (txt_layer.width - canvas_size[0]) // 2
+    offset_y = (txt_layer.height - canvas_size[1]) // 2
+
+    # 透明度為0的像素不影響合成結果，只保留文字的外接矩形
+    bbox = txt_layer.getchannel("A").getbbox()
+    if not bbox:
+        return None, None
+    return txt_layer.crop(bbox), (bbox[0] - offset_x, bbox[1] - offset_y)
+
+
+def _watermark_task(task):
+    input_image_path, output_image_path, watermark_text, options = task
+    AddWatermark.basic_auto_adaptation(input_image_path, output_image_path, watermark_text, **options)
+    return output_image_path
+
+
+# 文件浮水印的每個行程各自開啟一份來源文件
+_document_source = None
+
+
+class _DocumentSource:
+    """
+    逐頁讀取多頁 tif 或 PDF，tif 透過 IFD 索引直接開啟指定頁面，PDF 以指定 dpi 渲染
+    """
+
+    def __init__(self, input_path, dpi=300, password=None):
+        self.dpi = dpi
+        self.is_pdf = input_path.lower().endswith('.pdf')
+        self.input_path = input_path
+        if self.is_pdf:
+            from pdf_tools.pdf_dpi_conversion_tools import PDFOperator
+            self._processor = PDFOperator(input_path, password)
+            self.page_count = self._processor.total_pages
+        else:
+            from tif_tools.tiff_index import ifd_offsets
+            self.page_count = len(ifd_offsets(input_path))
+
+    def load_page(self, page_number):
+        if self.is_pdf:
+            pix = self._processor.capture_full_page(page_number, dpi=self.dpi)
+            page = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+            page.info['dpi'] = (self.dpi, self.dpi)
+            return page
+        from tif_tools.tiff_index import open_page
+        with stage('decode', 'watermark', page=page_number) as span:
+            page = open_page(self.input_path, page_number)
+            page.load()
+            span.image(page)
+        return page
+
+    def close(self):
+        if self.is_pdf:
+            self._processor.doc.close()
+
+
+def _init_document_worker(input_path, dpi, password):
+    global _document_source
+    _document_source = _DocumentSource(input_path, dpi, password)
+
+
+def _watermark_page_task(page_number, watermark_text, color_mode, encode, options):
+    """
+    讀取一頁並添加浮水印，二值頁面維持 '1' 模式；輸出 tif 時直接在行程中壓縮(二值 G4，其他 LZW)
+    """
+    page = _document_source.load_page(page_number)
+    dpi = page.info.get('dpi')
+    if color_mode == '1' and page.mode != '1':
+        with stage('convert', 'watermark', page=page_number, mode='1') as span:
+            page = page.convert('1')
+            span.image(page)
+    if page.mode == '1':
+        page = AddWatermark.apply_bilevel(page, watermark_text, **options)
+    else:
+        mode = page.mode if page.mode in ('L', 'RGB') else 'RGB'
+        page = AddWatermark.apply(page, watermark_text, **options).convert(color_mode or mode)
+    if dpi:
+        page.info['dpi'] = dpi
+    if encode:
+        from tif_tools.tiff_writer import encode_page
+        return encode_page(page, 'group4' if page.mode == '1' else 'tiff_lzw')
+    return page
+
 
 class AddWatermark:
     @staticmethod
-    def basic_auto_adaptation(input_image_path, output_image_path, watermark_text,
-                              position=None, font_size=None, rotation=None, auto_adapt=True, save_format=None):
-        # 打開原始圖像
-        base_image = Image.open(input_image_path).convert("RGBA")
-        base_width, base_height = base_image.size
+    def layer(canvas_size, watermark_text, position=None, font_size=None, rotation=None, auto_adapt=True,
+              font_path=FONT_PATH):
+        """
+        依圖像尺寸決定字體大小、位置與旋轉角度，並取得快取的浮水印圖層
+        :param canvas_size: 圖像尺寸 (寬, 高)
+        :param watermark_text: 浮水印文字
+        :param position: 文字位置，若未指定則置中
+        :param font_size: 字體大小，若未指定則為圖像短邊的 0.2 倍
+        :param rotation: 旋轉角度，若未指定則為45度
+        :param auto_adapt: 是否自動適應字體大小與位置
+        :param font_path: 字體文件的路徑
+        :return: (裁切到文字外接矩形的 RGBA 圖層, 貼上位置)，若沒有可見的文字則為 (None, None)
+        """
+        base_width, base_height = canvas_size
 
         # 如果未指定字體大小，則自動適應
         if not font_size and auto_adapt:
             font_size = int(min(base_width, base_height) * 0.2)
 
-        # 選擇字體和大小
-        font = ImageFont.truetype("msjhbd.ttc", font_size)
-
         # 獲取浮水印尺寸
         temp_draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
-        txt_bbox = temp_draw.textbbox((0, 0), watermark_text, font=font)
+        txt_bbox = temp_draw.textbbox((0, 0), watermark_text, font=load_font(font_path, font_size))
         txt_width, txt_height = txt_bbox[2] - txt_bbox[0], txt_bbox[3] - txt_bbox[1]
 
         # 如果未指定位置，則將浮水印放置在左下角到右上角
@@ -29,30 +166,164 @@ class AddWatermark:
         if not rotation:
             rotation = 45
 
-        # 創建一個新的透明圖層，大小與原始圖像相同
-        txt_layer = Image.new("RGBA", base_image.size, (255, 255, 255, 0))
+        return watermark_layer(watermark_text, tuple(canvas_size), tuple(position), font_size, rotation,
+                               font_path=font_path)
 
-        # 在新圖層上繪製水印文字
-        draw = ImageDraw.Draw(txt_layer)
-        draw.text(position, watermark_text, font=font, fill=(0, 0, 0, 100))
+    @staticmethod
+    def apply(base_image, watermark_text, **options):
+        """
+        在圖像上添加浮水印，只合成文字外接矩形的範圍
+        :param base_image: PIL 圖像，會轉為 RGBA
+        :param watermark_text: 浮水印文字
+        :param options: 傳給 AddWatermark.layer 的參數，例如 position、font_size、rotation、font_path
+        :return: 添加浮水印後的 RGBA 圖像
+        """
+        with stage('convert', 'watermark', mode='RGBA') as span:
+            base_image = base_image.convert("RGBA")
+            span.image(base_image)
 
-        # 旋轉浮水印圖層
-        txt_layer = txt_layer.rotate(rotation, resample=Image.BICUBIC, expand=1)
+        # 將旋轉後的浮水印圖層粘貼到原始圖像上
+        layer, layer_position = AddWatermark.layer(base_image.size, watermark_text, **options)
+        if layer is not None:
+            with stage('composite', 'watermark') as span:
+                base_image.paste(layer, layer_position, layer)
+                span.image(layer)
+        return base_image
 
-        # 計算旋轉後的圖層與基本圖像的偏移量
-        offset_x = (txt_layer.width - base_image.width) // 2
-        offset_y = (txt_layer.height - base_image.height) // 2
+    @staticmethod
+    def apply_bilevel(page, watermark_text, **options):
+        """
+        在二值圖上添加浮水印，只將文字外接矩形的區域轉為彩色合成後再轉回二值，頁面維持 '1' 模式
+        :param page: '1' 模式的 PIL 圖像，會直接修改
+        :param watermark_text: 浮水印文字
+        :param options: 傳給 AddWatermark.layer 的參數
+        :return: 添加浮水印後的 '1' 模式圖像
+        """
+        layer, position = AddWatermark.layer(page.size, watermark_text, **options)
+        if layer is None:
+            return page
+        x, y = position
+        box = (max(0, x), max(0, y), min(page.width, x + layer.width), min(page.height, y + layer.height))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return page
+        with stage('composite', 'watermark', mode='1') as span:
+            region = page.crop(box).convert("RGBA")
+            region.paste(layer, (x - box[0], y - box[1]), layer)
+            page.paste(region.convert("1"), box[:2])
+            span.image(region)
+        return page
 
-        # 將旋轉後的浮水印圖層粘貼到原始圖像上
-        base_image.paste(txt_layer, (-offset_x, -offset_y), txt_layer)
+    @staticmethod
+    def basic_auto_adaptation(input_image_path, output_image_path, watermark_text,
+                              position=None, font_size=None, rotation=None, auto_adapt=True, save_format=None,
+                              font_path=FONT_PATH):
+        # 打開原始圖像並添加浮水印
+        with stage('decode', 'watermark', path=input_image_path) as span:
+            image = Image.open(input_image_path)
+            image.load()
+            span.image(image)
+            span.file(input_image_path)
+        base_image = AddWatermark.apply(image, watermark_text, position=position,
+                                        font_size=font_size, rotation=rotation, auto_adapt=auto_adapt,
+                                        font_path=font_path)
 
         # 保存帶有浮水印的圖像
         if save_format:
-            base_image = base_image.convert(save_format)
-            base_image.save(output_image_path, dpi=(300, 300), compression='group4')
+            with stage('convert', 'watermark', mode=save_format) as span:
+                base_image = base_image.convert(save_format)
+                span.image(base_image)
+            with stage('encode', 'watermark', compression='group4') as span:
+                base_image.save(output_image_path, dpi=(300, 300), compression='group4')
+                span.file(output_image_path)
             return
         else:
-            base_image.save(output_image_path, dpi=(300, 300), compression='tiff_lzw')
+            with stage('encode', 'watermark', compression='tiff_lzw') as span:
+                base_image.save(output_image_path, dpi=(300, 300), compression='tiff_lzw')
+                span.file(output_image_path)
+
+    @staticmethod
+    def document(input_path, output_path, watermark_text, workers=None, dpi=300, password=None, color_mode=None,
+                 max_pending=None, **options):
+        """
+        為多頁 tif 或 PDF 的每一頁添加浮水印，逐頁讀取、處理並依序寫入，記憶體只保留等待寫入的頁面
+        輸出 .pdf 時以 PDFWriter 寫入，其他副檔名則寫成多頁 tif(二值頁面 G4，其他 LZW)
+        :param input_path: 多頁 tif 或 PDF 路徑
+        :param output_path: 輸出路徑
+        :param watermark_text: 浮水印文字
+        :param workers: 行程數量，若為 None 則使用 CPU 核心數，1 則不使用行程池
+        :param dpi: PDF 頁面渲染的 dpi
+        :param password: PDF 密碼
+        :param color_mode: 若為 '1' 則所有頁面輸出為二值圖，若為 None 則維持每頁原本的模式
+        :param max_pending: 最多同時處理中的頁數，若為 None 則為 workers 的兩倍
+        :param options: 傳給 AddWatermark.layer 的參數，例如 font_size、rotation、font_path
+        :return: 寫入的頁數
+        """
+        from collections import deque
+
+        to_pdf = output_path.lower().endswith('.pdf')
+        if to_pdf:
+            from pdf_tools.pdf_writer import PDFWriter
+            writer = PDFWriter(output_path, resolution=dpi)
+        else:
+            from tif_tools.tiff_writer import TiffWriter
+            writer = TiffWriter(output_path, workers=1)
+
+        def write(result):
+            if to_pdf:
+                writer.add_image(result, dpi=result.info.get('dpi', (dpi, dpi))[0])
+            else:
+                writer.write_encoded_page(result)
+
+        source = _DocumentSource(input_path, dpi, password)
+        page_count = source.page_count
+        source.close()
+        workers = workers or os.cpu_count() or 1
+        max_pending = max_pending or workers * 2
+        task_args = (watermark_text, color_mode, not to_pdf, options)
+        with writer:
+            if workers == 1:
+                _init_document_worker(input_path, dpi, password)
+                for page_number in range(page_count):
+                    write(_watermark_page_task(page_number, *task_args))
+                return page_count
+
+            pending = deque()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_document_worker,
+                                     initargs=(input_path, dpi, password)) as executor:
+                for page_number in range(page_count):
+                    pending.append(executor.submit(_watermark_page_task, page_number, *task_args))
+                    while pending and (len(pending) > max_pending or pending[0].done()):
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+        return page_count
+
+    @staticmethod
+    def batch(inputs, output_dir, watermark_text, workers=None, **options):
+        """
+        以多行程批次添加浮水印，每個行程各自快取字體與浮水印圖層，尺寸相同的頁面只需產生一次圖層
+        :param inputs: 圖片資料夾路徑或圖片路徑清單
+        :param output_dir: 輸出資料夾，輸出檔名與輸入相同
+        :param watermark_text: 浮水印文字
+        :param workers: 行程數量，若為 None 則使用 CPU 核心數，1 則不使用行程池
+        :param options: 其他傳給 basic_auto_adaptation 的參數，例如 font_size、rotation、save_format
+        :return: 依輸入順序的輸出路徑清單
+        """
+        if isinstance(inputs, str):
+            inputs = sorted(os.path.join(inputs, file) for file in os.listdir(inputs)
+                            if '.tif' in file or '.png' in file or '.jpg' in file)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        tasks = [(path, os.path.join(output_dir, os.path.basename(path)), watermark_text, options)
+                 for path in inputs]
+        if workers == 1:
+            return [_watermark_task(task) for task in tasks]
+        workers = workers or os.cpu_count() or 1
+        # 連續的頁面交給同一個行程，提高浮水印圖層快取的命中率
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_watermark_task, tasks, chunksize=chunksize))
 
 
 if __name__ == '__main__':